@@ -0,0 +1,102 @@
+"""
+Benchmarks of the float mission configuration loading
+
+Run with asv, or directly with::
+
+    python -m benchmarks.configuration
+
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from virtualargofleet import FloatConfiguration, MissionTable, MissionCatalogue
+
+
+class FloatConfigurationLoad:
+    """Float configuration creation from the default set of parameters and from a json file"""
+
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'config.json')
+        FloatConfiguration('default').update('parking_depth', 1500).to_json(self.path)
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def time_default(self):
+        FloatConfiguration('default')
+
+    def time_from_json(self):
+        FloatConfiguration(self.path)
+
+    def time_update(self):
+        FloatConfiguration('default').update('parking_depth', 1500).update('cycle_duration', 120)
+
+    def peakmem_from_json(self):
+        FloatConfiguration(self.path)
+
+
+class FloatConfigurationLoadMany:
+    """Loading of 1000 float configuration json files into a MissionTable"""
+    params = [True, False]
+    param_names = ['validate']
+    nfiles = 1000
+
+    def setup(self, validate):
+        self.folder = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(self.nfiles):
+            self.paths.append(os.path.join(self.folder, 'config_%0.4d.json' % i))
+            FloatConfiguration('default').update('parking_depth', 500 + i).to_json(self.paths[-1])
+
+    def teardown(self, validate):
+        shutil.rmtree(self.folder)
+
+    def time_load_many(self, validate):
+        FloatConfiguration.load_many(self.paths, validate=validate)
+
+    def time_one_by_one(self, validate):
+        [FloatConfiguration(path) for path in self.paths]
+
+
+class MissionCatalogueRead:
+    """Reading of a catalogue of 100,000 heterogeneous float missions"""
+    params = ['parquet', 'nc']
+    param_names = ['format']
+    nfloats = 100000
+
+    def setup(self, fmt):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'missions.%s' % fmt)
+        rng = np.random.default_rng(0)
+        table = MissionTable.from_any(FloatConfiguration('default')).broadcast(self.nfloats).to_dataframe()
+        table['parking_depth'] = rng.uniform(200, 2000, self.nfloats)
+        table['cycle_duration'] = rng.choice([120., 240.], self.nfloats)
+        MissionCatalogue(MissionTable.from_any(table), keys=np.arange(self.nfloats) + 6900000,
+                         key_name='wmo').to_file(self.path)
+
+    def teardown(self, fmt):
+        shutil.rmtree(self.folder)
+
+    def time_read(self, fmt):
+        MissionCatalogue.read(self.path)
+
+    def peakmem_read(self, fmt):
+        MissionCatalogue.read(self.path)
+
+
+if __name__ == '__main__':
+    bench = FloatConfigurationLoad()
+    bench.setup()
+    try:
+        for name in ['time_default', 'time_from_json', 'time_update']:
+            start = time.perf_counter()
+            for _ in range(100):
+                getattr(bench, name)()
+            print("%s: %0.2fms" % (name, (time.perf_counter() - start) * 1000 / 100))
+    finally:
+        bench.teardown()
@@ -0,0 +1,159 @@
+"""
+Benchmarks of the profile index extraction from trajectory stores
+
+Run with asv, or directly with::
+
+    python -m benchmarks.indexing
+
+"""
+import os
+import shutil
+import tempfile
+import time
+import warnings
+import numpy as np
+import xarray as xr
+import pandas as pd
+from tqdm import tqdm
+
+from virtualargofleet.utilities import simu2index, simu2index_par, simu2csv, splitonprofiles, get_trajdim
+from .synthetic import trajectory_store
+
+
+def simu2index_loop(ds: xr.Dataset, N: int = 1):
+    """Reference implementation of :meth:`virtualargofleet.utilities.simu2index` up to v0.5.1
+
+    It loops over trajectories and cycle numbers with xarray groupby.
+    """
+    trajdim = get_trajdim(ds)
+
+    ds_list = []
+    if 'cycle_number' in ds.data_vars:
+        for traj in tqdm(ds[trajdim], total=len(ds[trajdim])):
+            for cyc, grp in ds.loc[{trajdim: traj}].groupby(group='cycle_number'):
+                ds_cyc = grp.isel(obs=-1)
+                if ds_cyc['cycle_phase'] in [3, 4]:
+                    ds_cyc['traj_id'] = xr.DataArray(np.full_like((1,), fill_value=traj.data))
+                    ds_list.append(ds_cyc)
+
+    else:
+        warnings.warn("This is an old trajectory file, results not guaranteed !")
+        for traj in tqdm(ds[trajdim], total=len(ds[trajdim])):
+            for iphase, grp in ds.loc[{trajdim: traj}].groupby(group='cycle_phase'):
+                if iphase == 3:
+                    sub_grp = splitonprofiles(grp, N=N)
+                    sub_grp['cycle_number'] = xr.DataArray(np.arange(1, len(sub_grp['obs']) + 1), dims='obs')
+                    sub_grp['traj_id'] = xr.DataArray(np.full_like(sub_grp['obs'], fill_value=traj.data), dims='obs')
+                    ds_list.append(sub_grp)
+
+    ds_profiles = xr.concat(ds_list, dim='obs')
+    if 'wmo' not in ds_profiles.data_vars:
+        ds_profiles['wmo'] = ds_profiles['traj_id'] + 9000000
+    df = ds_profiles.to_dataframe()
+    df = df.rename({'time': 'date', 'lat': 'latitude', 'lon': 'longitude', 'z': 'min_depth'}, axis='columns')
+    df = df[['date', 'latitude', 'longitude', 'wmo', 'cycle_number', 'traj_id']]
+    df['wmo'] = df['wmo'].astype('int')
+    df['cycle_number'] = df['cycle_number'].astype('int')
+    df['traj_id'] = df['traj_id'].astype('int')
+    df['latitude'] = np.fix(df['latitude'] * 1000).astype('int') / 1000
+    df['longitude'] = np.fix(df['longitude'] * 1000).astype('int') / 1000
+    df = df.reset_index(drop=True)
+    return df
+
+
+def index_writer_legacy(df: pd.DataFrame, index_file: str):
+    """Reference implementation of the :meth:`virtualargofleet.utilities.simu2csv` index writer up to v0.5.1
+
+    It builds file names with a row-wise apply and formats dates with :meth:`pandas.DataFrame.to_csv`. Cycle numbers
+    in file names have 2 digits, as in v0.5.1.
+    """
+    ardf = df.copy()
+    ardf['institution'] = 'VF'
+    ardf['profiler_type'] = 999
+    ardf['ocean'] = 'A'
+    ardf['date_update'] = pd.to_datetime('now', utc=True)
+    ardf['file'] = ardf.apply(
+        lambda row: "vf/%i/profiles/R%i_%0.2d.nc" % (row['wmo'], row['wmo'], row['cycle_number']), axis=1)
+    ardf = ardf[['file', 'date', 'latitude', 'longitude', 'ocean', 'profiler_type', 'institution', 'date_update']]
+    with open(index_file, 'w') as f:
+        ardf.to_csv(f, index=False, header=True, date_format='%Y%m%d%H%M%S')
+
+
+class Simu2Index:
+    """Profile index extraction from a synthetic 10k-trajectory zarr store"""
+    timeout = 3600
+    ntraj = 10000
+
+    def setup_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), 'trajectories.zarr')
+        return trajectory_store(path, ntraj=self.ntraj)
+
+    def time_simu2index(self, path):
+        simu2index(xr.open_dataset(path, engine='zarr'))
+
+    def time_simu2index_par(self, path):
+        simu2index_par(path)
+
+    def time_simu2index_loop(self, path):
+        simu2index_loop(xr.open_dataset(path, engine='zarr'))
+
+
+class Simu2CSV:
+    """Argo profile index writing of 1 million synthetic profiles"""
+    timeout = 600
+    nprof = 1000000
+
+    def setup(self):
+        rng = np.random.default_rng(0)
+        self.df = pd.DataFrame({
+            'date': pd.to_datetime('2020-01-01') + pd.to_timedelta(rng.integers(0, 5 * 365 * 86400, self.nprof), 's'),
+            'latitude': np.fix(rng.uniform(-80, 80, self.nprof) * 1000).astype('int') / 1000,
+            'longitude': np.fix(rng.uniform(-180, 180, self.nprof) * 1000).astype('int') / 1000,
+            'wmo': rng.integers(9000000, 9100000, self.nprof),
+            'cycle_number': rng.integers(1, 300, self.nprof)})
+        self.folder = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def time_simu2csv(self):
+        simu2csv(None, index_file=os.path.join(self.folder, 'index.txt'), df=self.df)
+
+    def time_simu2csv_gzip(self):
+        simu2csv(None, index_file=os.path.join(self.folder, 'index.txt.gz'), df=self.df)
+
+    def time_index_writer_legacy(self):
+        index_writer_legacy(self.df, os.path.join(self.folder, 'index.txt'))
+
+
+if __name__ == '__main__':
+    bench = Simu2Index()
+    path = bench.setup_cache()
+    try:
+        ds = xr.open_dataset(path, engine='zarr')
+        results = {}
+        for name, func in [('vectorized', simu2index), ('loop', simu2index_loop)]:
+            start = time.perf_counter()
+            results[name] = func(ds)
+            print("%s: %0.2fs (%i profiles)" % (name, time.perf_counter() - start, len(results[name])))
+        pd.testing.assert_frame_equal(results['vectorized'], results['loop'])
+        print("Both implementations return the same profile index")
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+    # Index writers, file names differ by the number of digits of cycle numbers since v0.5.1:
+    bench = Simu2CSV()
+    bench.nprof = 10000
+    bench.setup()
+    try:
+        indexes = {}
+        for name, func in [('vectorized', bench.time_simu2csv), ('legacy', bench.time_index_writer_legacy)]:
+            start = time.perf_counter()
+            func()
+            print("%s writer: %0.2fs (%i profiles)" % (name, time.perf_counter() - start, bench.nprof))
+            indexes[name] = pd.read_csv(os.path.join(bench.folder, 'index.txt'), comment='#')
+        pd.testing.assert_frame_equal(indexes['vectorized'].drop(columns=['file', 'date_update']),
+                                      indexes['legacy'].drop(columns=['file', 'date_update']))
+        print("Both writers return the same profile index, outside of file names")
+    finally:
+        bench.teardown()
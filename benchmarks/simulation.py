@@ -0,0 +1,178 @@
+"""
+Benchmarks of the VirtualFleet set-up and simulation on a synthetic analytic velocity field
+
+Run with asv, or directly with::
+
+    python -m benchmarks.simulation
+
+"""
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from parcels import FieldSet
+
+from virtualargofleet import Velocity, VirtualFleet, FloatConfiguration
+from .synthetic import velocity_dataset, velocity_files, deployment_plan, VARIABLES, DIMENSIONS
+
+
+def synthetic_velocity(src=None, **kwargs):
+    """Create a :class:`Velocity` from the synthetic velocity field, by default an in memory xarray Dataset"""
+    src = velocity_dataset() if src is None else src
+    return Velocity(model='custom', src=src, variables=VARIABLES, dimensions=DIMENSIONS, **kwargs)
+
+
+class VelocityField:
+    """Creation of a velocity field from a synthetic in memory Dataset"""
+
+    def setup(self):
+        self.ds = velocity_dataset()
+
+    def time_velocity(self):
+        synthetic_velocity(self.ds)
+
+    def peakmem_velocity(self):
+        synthetic_velocity(self.ds)
+
+
+class AddMask:
+    """Bathymetric mask computation, from a Dataset or from netcdf files with and without the mask cache"""
+    params = ['dataset', 'files', 'files_cached']
+    param_names = ['source']
+
+    def setup_cache(self):
+        folder = tempfile.mkdtemp()
+        return velocity_files(folder)
+
+    def setup(self, files, source):
+        self.folder = tempfile.mkdtemp()
+        src = velocity_dataset() if source == 'dataset' else files
+        mask_cache = self.folder if source == 'files_cached' else False
+        self.V = synthetic_velocity(src, lazy=True, mask_cache=mask_cache)
+        if source == 'files_cached':
+            synthetic_velocity(src, mask_cache=mask_cache)  # Fill in the mask cache
+        # Create the fieldset without the mask, since a 'bathy' field can only be added once:
+        if source == 'dataset':
+            self.V.fieldset = FieldSet.from_xarray_dataset(self.V.field, self.V.var, self.V.dim,
+                                                           allow_time_extrapolation=True, time_periodic=False)
+        else:
+            self.V.fieldset = FieldSet.from_netcdf(self.V.field, self.V.var, self.V.dim,
+                                                   allow_time_extrapolation=True, time_periodic=False,
+                                                   deferred_load=True)
+
+    def teardown(self, files, source):
+        shutil.rmtree(self.folder)
+
+    def time_add_mask(self, files, source):
+        self.V.add_mask()
+
+
+class VirtualFleetInit:
+    """Creation of a VirtualFleet, with its ParticleSet"""
+    params = [100, 1000, 10000]
+    param_names = ['nfloats']
+
+    def setup(self, nfloats):
+        self.V = synthetic_velocity()
+        self.plan = deployment_plan(nfloats)
+        self.mission = FloatConfiguration('default')
+
+    def time_init(self, nfloats):
+        VirtualFleet(plan=self.plan, fieldset=self.V, mission=self.mission)
+
+    def peakmem_init(self, nfloats):
+        VirtualFleet(plan=self.plan, fieldset=self.V, mission=self.mission)
+
+
+class Simulate:
+    """Simulation of one day of float trajectories, with 5 minutes time steps and hourly outputs on a zarr store
+
+    Timings include the compilation of the kernels, done by parcels for each new simulation.
+    """
+    params = [100, 1000, 10000]
+    param_names = ['nfloats']
+    timeout = 1800
+    number = 1
+    repeat = 3
+    duration = timedelta(days=1)
+
+    def setup(self, nfloats):
+        self.folder = tempfile.mkdtemp()
+        self.VFleet = VirtualFleet(plan=deployment_plan(nfloats),
+                                   fieldset=synthetic_velocity(),
+                                   mission=FloatConfiguration('default'))
+
+    def teardown(self, nfloats):
+        shutil.rmtree(self.folder)
+
+    def _simulate(self):
+        self.VFleet.simulate(duration=self.duration,
+                             step=timedelta(minutes=5),
+                             record=timedelta(hours=1),
+                             output_folder=self.folder,
+                             output_file='simulation.zarr',
+                             verbose_progress=False)
+
+    def time_simulate(self, nfloats):
+        self._simulate()
+
+    def peakmem_simulate(self, nfloats):
+        self._simulate()
+
+    def track_output_size(self, nfloats):
+        self._simulate()
+        output = self.VFleet.output
+        return sum([os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(output) for f in files])
+    track_output_size.unit = 'bytes'
+
+
+class SimulatePrefetch:
+    """Simulation of 5 days of float trajectories on velocity files, with and without the prefetch of snapshots"""
+    params = [0, 2]
+    param_names = ['prefetch']
+    timeout = 1800
+    number = 1
+    repeat = 3
+    duration = timedelta(days=5)
+
+    def setup_cache(self):
+        folder = tempfile.mkdtemp()
+        return velocity_files(folder, nlon=401, nlat=301, ndays=8)
+
+    def setup(self, files, prefetch):
+        self.folder = tempfile.mkdtemp()
+        self.velocity = synthetic_velocity(files, prefetch=prefetch, mask_cache=False)
+        self.VFleet = VirtualFleet(plan=deployment_plan(1000), fieldset=self.velocity,
+                                   mission=FloatConfiguration('default'))
+
+    def teardown(self, files, prefetch):
+        self.velocity.close()
+        shutil.rmtree(self.folder)
+
+    def time_simulate(self, files, prefetch):
+        self.VFleet.simulate(duration=self.duration,
+                             step=timedelta(minutes=30),
+                             record=timedelta(hours=6),
+                             output_folder=self.folder,
+                             verbose_progress=False)
+
+
+if __name__ == '__main__':
+    for nfloats in Simulate.params:
+        for bench in [VirtualFleetInit(), Simulate()]:
+            bench.setup(nfloats)
+            tracemalloc.start()
+            start = time.perf_counter()
+            if isinstance(bench, Simulate):
+                bench._simulate()
+            else:
+                bench.time_init(nfloats)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%s(%i floats): %0.2fs, %0.1f MB traced memory peak"
+                  % (bench.__class__.__name__, nfloats, elapsed, peak / 1024 ** 2))
+            if hasattr(bench, 'teardown'):
+                bench.teardown(nfloats)
@@ -0,0 +1,129 @@
+"""
+Synthetic velocity fields, deployment plans and VirtualFleet trajectory stores used by benchmarks
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def trajectory_dataset(ntraj: int = 10000,
+                       nobs: int = 240,
+                       cycle_length: int = 24,
+                       seed: int = 0) -> xr.Dataset:
+    """Create a synthetic trajectory dataset with the layout of a parcels zarr output
+
+    Each virtual float cycles every ``cycle_length`` observations through phases 0 to 4. Floats are released at
+    random observations and some are deleted before the end of the simulation, so that the ``trajectory x obs`` arrays
+    are padded with fill values like in real simulation outputs.
+    """
+    rng = np.random.default_rng(seed)
+    iobs = np.arange(nobs)
+
+    # Phase pattern of one cycle:
+    pattern = np.zeros(cycle_length, dtype=float)
+    pattern[2:cycle_length - 8] = 1
+    pattern[cycle_length - 8:cycle_length - 5] = 2
+    pattern[cycle_length - 5:cycle_length - 1] = 3
+    pattern[cycle_length - 1] = 4
+
+    start = rng.integers(0, cycle_length, size=ntraj)
+    stop = np.where(rng.random(ntraj) < 0.2, rng.integers(nobs // 2, nobs, size=ntraj), nobs)
+    age = iobs[np.newaxis, :] - start[:, np.newaxis]
+    valid = (age >= 0) & (iobs[np.newaxis, :] < stop[:, np.newaxis])
+
+    cycle_phase = np.where(valid, pattern[np.mod(age, cycle_length)], np.nan)
+    cycle_number = np.where(valid, age // cycle_length + 1, np.nan)
+    t0 = np.datetime64('2020-01-01T00:00:00', 'ns')
+    time = np.where(valid, t0 + iobs[np.newaxis, :] * np.timedelta64(1, 'h'), np.datetime64('NaT'))
+    lat = np.where(valid, rng.uniform(-60, 60, size=(ntraj, 1)) + 1e-3 * age, np.nan).astype('float32')
+    lon = np.where(valid, rng.uniform(-180, 180, size=(ntraj, 1)) + 1e-3 * age, np.nan).astype('float32')
+    z = np.where(valid, 1000 * (cycle_phase > 0), np.nan).astype('float32')
+
+    dims = ('trajectory', 'obs')
+    ds = xr.Dataset(
+        {
+            'cycle_number': (dims, cycle_number),
+            'cycle_phase': (dims, cycle_phase),
+            'time': (dims, time),
+            'lat': (dims, lat),
+            'lon': (dims, lon),
+            'z': (dims, z),
+        },
+        coords={'trajectory': np.arange(ntraj, dtype='int64'), 'obs': iobs.astype('int32')},
+        attrs={'feature_type': 'trajectory', 'parcels_version': '3.1.4', 'parcels_mesh': 'spherical'},
+    )
+    return ds
+
+
+def trajectory_store(path: str, chunks: int = 1000, **kwargs) -> str:
+    """Write a synthetic trajectory dataset to a zarr store chunked along trajectories"""
+    ds = trajectory_dataset(**kwargs)
+    ds.chunk({'trajectory': chunks, 'obs': -1}).to_zarr(path, mode='w')
+    return path
+
+
+VARIABLES = {'U': 'uo', 'V': 'vo'}
+"""Variable names of the synthetic velocity field"""
+
+DIMENSIONS = {'time': 'time', 'depth': 'depth', 'lat': 'latitude', 'lon': 'longitude'}
+"""Dimension names of the synthetic velocity field"""
+
+DOMAIN = {'lon': [-60., -20.], 'lat': [20., 50.], 'time': '2020-01-01'}
+"""Space domain and start date of the synthetic velocity field"""
+
+
+def velocity_dataset(nlon: int = 81,
+                     nlat: int = 61,
+                     ndays: int = 15,
+                     speed: float = 0.3) -> xr.Dataset:
+    """Create an analytic double gyre velocity field, with a continental shelf, as an in memory xarray Dataset
+
+    Velocities decay with depth over 1000m and oscillate in time with a 10 days period. The bottom shoals from 4000m
+    to 200m over the western 5 degrees of longitude and velocities are set to NaN below it, so that the bathymetric
+    mask of the velocity field is not trivial.
+    """
+    lon = np.linspace(*DOMAIN['lon'], nlon)
+    lat = np.linspace(*DOMAIN['lat'], nlat)
+    depth = np.array([1., 10., 50., 100., 250., 500., 750., 1000., 1250., 1500., 2000., 3000., 4000.])
+    time = pd.date_range(DOMAIN['time'], periods=ndays, freq='D').values
+
+    x = 2 * (lon - lon[0]) / (lon[-1] - lon[0])  # In [0, 2]
+    y = (lat - lat[0]) / (lat[-1] - lat[0])  # In [0, 1]
+    days = np.arange(ndays)
+    amplitude = speed * (1 + 0.25 * np.sin(2 * np.pi * days / 10))[:, np.newaxis, np.newaxis, np.newaxis]
+    decay = np.exp(-depth / 1000)[np.newaxis, :, np.newaxis, np.newaxis]
+    u = (amplitude * decay * -np.outer(np.cos(np.pi * y), np.sin(np.pi * x))).astype('float32')
+    v = (amplitude * decay * np.outer(np.sin(np.pi * y), np.cos(np.pi * x))).astype('float32')
+
+    bottom = 200 + 3800 * np.clip((lon - lon[0]) / 5, 0, 1)
+    land = depth[:, np.newaxis, np.newaxis] > bottom[np.newaxis, np.newaxis, :]
+    land = np.broadcast_to(land, (len(depth), nlat, nlon))[np.newaxis, ...]
+    u = np.where(land, np.nan, u)
+    v = np.where(land, np.nan, v)
+
+    dims = (DIMENSIONS['time'], DIMENSIONS['depth'], DIMENSIONS['lat'], DIMENSIONS['lon'])
+    ds = xr.Dataset(
+        {VARIABLES['U']: (dims, u), VARIABLES['V']: (dims, v)},
+        coords={DIMENSIONS['time']: time, DIMENSIONS['depth']: depth, DIMENSIONS['lat']: lat, DIMENSIONS['lon']: lon},
+    )
+    return ds
+
+
+def velocity_files(folder: str, **kwargs) -> dict:
+    """Write a synthetic velocity field to daily netcdf files and return the ``src`` dictionary of :class:`Velocity`"""
+    ds = velocity_dataset(**kwargs)
+    files = []
+    for it in range(len(ds[DIMENSIONS['time']])):
+        files.append(os.path.join(folder, "velocity_%0.3d.nc" % it))
+        ds.isel({DIMENSIONS['time']: slice(it, it + 1)}).to_netcdf(files[-1])
+    return {'U': files, 'V': files}
+
+
+def deployment_plan(nfloats: int = 100, seed: int = 0) -> dict:
+    """Create a deployment plan of floats randomly released in the interior of the synthetic velocity field domain"""
+    rng = np.random.default_rng(seed)
+    return {'lon': rng.uniform(DOMAIN['lon'][0] + 10, DOMAIN['lon'][1] - 5, nfloats),
+            'lat': rng.uniform(DOMAIN['lat'][0] + 5, DOMAIN['lat'][1] - 5, nfloats),
+            'time': np.array([np.datetime64(DOMAIN['time']) + np.timedelta64(1, 'D')] * nfloats,
+                             dtype='datetime64[s]')}
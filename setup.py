@@ -18,7 +18,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/euroargodev/VirtualFleet",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*"]),
     package_dir={"virtualargofleet": "virtualargofleet"},
     package_data={"virtualargofleet": ["assets/*"]},
     install_requires=requirements,
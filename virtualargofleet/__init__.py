@@ -1,7 +1,9 @@
 from .virtualargofleet import VirtualFleet
-from .utilities import FloatConfiguration, ConfigParam
+from .utilities import FloatConfiguration, ConfigParam, MissionTable, MissionCatalogue
 from .velocity_helpers import VelocityFieldFacade as Velocity
 from .velocity_helpers import VelocityField
+from .ensemble import FleetEnsemble
+from .decomposition import TiledFleet
 
 import parcels
 import warnings
@@ -32,8 +34,12 @@ __all__ = (
     "Velocity",
     "VelocityField",
     "VirtualFleet",
+    "FleetEnsemble",
+    "TiledFleet",
     "FloatConfiguration",
     "ConfigParam",
+    "MissionTable",
+    "MissionCatalogue",
     # Constants
     "__version__"
 )
@@ -2,9 +2,16 @@
 Kernels are inspired from: https://nbviewer.org/github/OceanParcels/parcels/blob/master/parcels/examples/tutorial_Argofloats.ipynb
 """
 import numpy as np
-from parcels import JITParticle, Variable, StatusCode
+from parcels import JITParticle, Variable, StatusCode, ParticleFile, ParticleSet
+from parcels.fieldfilebuffer import DeferredNetcdfFileBuffer
+from datetime import timedelta
+import concurrent.futures
+import collections
+import weakref
 import logging
 import math
+import time
+import json
 
 
 log = logging.getLogger("virtualfleet.parcels")
@@ -406,4 +413,460 @@ def KeepInDomain(particle, fieldset, time):
     if particle.state == StatusCode.ErrorOutOfBounds:
         if fieldset.verbose_events == 1:            
             print("Field warning : Float out of the horizontal geographical domain OR interpolation error --> deleted")
-        particle.delete()
\ No newline at end of file
+        particle.delete()
+
+
+def DeleteErrorParticle(particle, fieldset, time):
+    """Delete particles in error, used to run kernels in isolation"""
+    if particle.state >= 50:
+        particle.delete()
+
+
+class ArgoParticleFile(ParticleFile):
+    """ParticleFile writing virtual Argo float observations on cycle events
+
+    Instead of writing all particles every ``outputdt``, a virtual float is only written when:
+
+    - it is released,
+    - its ``cycle_phase`` changes: start of descent, drift, descent to profile depth, profile and surface transmission,
+    - it is at the surface (phase 4), to record surface fixes,
+    - it has been drifting (phase 1) for ``drift_outputdt`` since its last record, if set.
+
+    This ParticleFile must be used with ``outputdt`` equal to the computation time step, so that events are written
+    at the time step they occur. For 10-day cycles, this reduces the trajectory file size by more than 90% compared
+    to hourly records, while the last surface fix of each cycle used by :class:`utilities.simu2index` is kept.
+    """
+
+    def __init__(self, name, particleset, outputdt, drift_outputdt=None, **kwargs):
+        super().__init__(name, particleset, outputdt, **kwargs)
+        if isinstance(drift_outputdt, timedelta):
+            drift_outputdt = drift_outputdt.total_seconds()
+        self.drift_outputdt = drift_outputdt
+        # Id, cycle phase and time of the last record of each float, sorted by id:
+        self._pids = np.empty((0,), dtype=np.int64)
+        self._last_phase = np.empty((0,), dtype=np.int32)
+        self._last_time = np.empty((0,), dtype=np.float64)
+
+    def _lookup(self, pids):
+        """Return the position of ids in the tracking arrays, and a mask of ids already written"""
+        pos = np.searchsorted(self._pids, pids)
+        known = pos < len(self._pids)
+        known[known] = self._pids[pos[known]] == pids[known]
+        return pos, known
+
+    def get_tracker(self, pids) -> tuple:
+        """Return cycle phase and time of the last record of floats, -1 and NaN if never written"""
+        pids = np.asarray(pids)
+        pos, known = self._lookup(pids)
+        last_phase, last_time = np.full(pids.shape, -1, dtype=np.int32), np.full(pids.shape, np.nan)
+        last_phase[known], last_time[known] = self._last_phase[pos[known]], self._last_time[pos[known]]
+        return last_phase, last_time
+
+    def set_tracker(self, pids, last_phase, last_time):
+        """Set cycle phase and time of the last record of floats, ignoring floats never written (phase -1)"""
+        pids, last_phase, last_time = np.asarray(pids), np.asarray(last_phase), np.asarray(last_time)
+        pos, known = self._lookup(pids)
+        self._last_phase[pos[known]], self._last_time[pos[known]] = last_phase[known], last_time[known]
+        new = ~known & (last_phase >= 0)
+        if np.any(new):
+            pids = np.concatenate([self._pids, pids[new]])
+            isort = np.argsort(pids)
+            self._pids = pids[isort]
+            self._last_phase = np.concatenate([self._last_phase, last_phase[new]])[isort]
+            self._last_time = np.concatenate([self._last_time, last_time[new]])[isort]
+        return self
+
+    def write(self, pset, time, indices=None):
+        if indices is None and pset.particledata._ncount > 0:
+            time_s = time.total_seconds() if isinstance(time, timedelta) else time
+            indices = pset.particledata._to_write_particles(time_s)
+            pids = pset.particledata.getvardata("id", indices)
+            phase = pset.particledata.getvardata("cycle_phase", indices)
+            last_phase, last_time = self.get_tracker(pids)
+            event = (phase != last_phase) | (phase == 4)
+            if self.drift_outputdt is not None:
+                t = pset.particledata.getvardata("time", indices)
+                event |= (phase == 1) & (t - last_time >= self.drift_outputdt)
+            indices = indices[event]
+            if len(indices) == 0:
+                return
+        super().write(pset, time, indices=indices)
+        if indices is not None and len(indices) > 0:
+            self.set_tracker(pset.particledata.getvardata("id", indices),
+                             pset.particledata.getvardata("cycle_phase", indices),
+                             pset.particledata.getvardata("time", indices))
+
+
+class ProfileCollector:
+    """Collect virtual profiles during a ParticleSet execution
+
+    This callable must be passed on to :meth:`parcels.particleset.ParticleSet.execute` as a post-iteration callback
+    called every time step. A profile is recorded whenever a float moves from phase 3 (profiling) to phase 4 (surface
+    transmission), with the time, position, cycle number and id of the float at surfacing. Profiles are appended to a
+    columnar buffer, one array per column and per callback.
+
+    Profiles are dated and positioned at surfacing, at the resolution of the time step, while
+    :meth:`utilities.simu2index` uses the last recorded observation of each cycle, at the end of the surface
+    transmission.
+    """
+
+    columns = ['time', 'lat', 'lon', 'cycle_number', 'trajectory']
+
+    def __init__(self, particleset):
+        self.particleset = particleset
+        self._buffer = {key: [] for key in self.columns}
+        self._profiling = self._ids_in_phase(3)  # Sorted ids of floats in phase 3 at the last callback
+
+    def _ids_in_phase(self, phase: int) -> np.ndarray:
+        data = self.particleset.particledata.data
+        return np.sort(data['id'][data['cycle_phase'] == phase])
+
+    def __call__(self):
+        data = self.particleset.particledata.data
+        surfaced = np.flatnonzero(data['cycle_phase'] == 4)
+        surfaced = surfaced[np.isin(data['id'][surfaced], self._profiling, assume_unique=True)]
+        if len(surfaced) > 0:
+            for key, var in zip(self.columns, ['time', 'lat', 'lon', 'cycle_number', 'id']):
+                self._buffer[key].append(data[var][surfaced].copy())
+        self._profiling = self._ids_in_phase(3)
+
+    def __len__(self):
+        return int(np.sum([len(a) for a in self._buffer['time']]))
+
+    def to_arrays(self) -> dict:
+        """Return the buffer as a dictionary of arrays, time in seconds since the FieldSet time origin"""
+        return {key: np.concatenate(self._buffer[key]) if len(self._buffer[key]) > 0 else np.empty((0,))
+                for key in self.columns}
+
+
+class SimulationProfiler:
+    """Measure where time is spent during a ParticleSet execution
+
+    Used as a context manager around :meth:`parcels.particleset.ParticleSet.execute`, it wraps the FieldSet
+    ``computeTimeChunk`` method (loading of velocity snapshots), the kernel ``compile`` and ``execute`` methods and the
+    ParticleFile ``write`` method, to accumulate the time spent in each of them. The number of particles is recorded
+    after each kernel execution, whenever it changes.
+
+    Parcels compiles all kernels into a single C loop, so the compute time of each kernel can't be measured during the
+    simulation. With :meth:`profile_kernels`, each kernel is run in isolation on the initial floats, and the kernel
+    compute time of the simulation is shared among kernels in proportion to their isolated timings.
+
+    Examples
+    --------
+    >>> with SimulationProfiler(P, K, output_file=pfile) as profiler:
+    >>>     P.execute(K, runtime=timedelta(days=10), dt=timedelta(minutes=5), output_file=pfile)
+    >>> profiler.profile_kernels(ArgoParticle, [ArgoFloatKernel, AdvectionRK4], dt=timedelta(minutes=5))
+    >>> profiler.to_json('profile.json')
+    """
+
+    steps = ['fieldset_io', 'compile', 'kernels', 'output_write']
+    """Steps of the execution timed by the profiler"""
+
+    def __init__(self, particleset, kernel, output_file=None, variables: list = None):
+        """
+
+        Parameters
+        ----------
+        particleset: :class:`parcels.particleset.ParticleSet`
+        kernel: :class:`parcels.kernel.Kernel`
+            The kernel passed on to :meth:`parcels.particleset.ParticleSet.execute`
+        output_file: :class:`parcels.particlefile.ParticleFile`, optional
+        variables: list, optional
+            Particle variables to copy, in addition to positions, to run kernels in isolation with :meth:`profile_kernels`
+        """
+        self.particleset = particleset
+        self.kernel = kernel
+        self.output_file = output_file
+        self.variables = list(variables) if variables is not None else []
+        self.timings = {step: 0. for step in self.steps}
+        self.calls = {step: 0 for step in self.steps}
+        self.wall_time = 0.
+        self.kernels = None
+        self._counts = {'time': [], 'particles': []}
+        self._patched = []
+        self._initial = None
+        self._last_count = None
+
+    def _wrap(self, obj, method: str, step: str):
+        """Replace the method of an object by a timed version"""
+        func = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timings[step] += time.perf_counter() - start
+                self.calls[step] += 1
+                if step == 'kernels':
+                    self._count(kwargs['endtime'] if 'endtime' in kwargs else args[1])
+
+        setattr(obj, method, timed)
+        self._patched.append((obj, method))
+
+    def _count(self, t: float):
+        n = len(self.particleset)
+        self._last_count = (float(t), n)
+        if len(self._counts['particles']) == 0 or self._counts['particles'][-1] != n:
+            self._counts['time'].append(float(t))
+            self._counts['particles'].append(n)
+
+    def __enter__(self):
+        data = self.particleset.particledata.data
+        self._initial = {var: data[var].copy() for var in ['lon', 'lat', 'depth', 'time'] + self.variables}
+        self._wrap(self.particleset.fieldset, 'computeTimeChunk', 'fieldset_io')
+        self._wrap(self.kernel, 'compile', 'compile')
+        self._wrap(self.kernel, 'execute', 'kernels')
+        if self.output_file is not None:
+            self._wrap(self.output_file, 'write', 'output_write')
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.wall_time += time.perf_counter() - self._start
+        for obj, method in self._patched:
+            delattr(obj, method)  # Back to the class method
+        self._patched = []
+        if self._last_count is not None and self._counts['time'][-1] != self._last_count[0]:
+            # Close the time series at the end of the execution:
+            self._counts['time'].append(self._last_count[0])
+            self._counts['particles'].append(self._last_count[1])
+        return False
+
+    def profile_kernels(self, pclass, kernels: list, dt, steps: int = 48):
+        """Time each kernel in isolation and share the kernel compute time of the simulation among them
+
+        Each kernel is run for ``steps`` time steps on a new ParticleSet with the initial floats, all released at the
+        first deployment time. Particles in error are deleted. The time of a run with :meth:`DeleteErrorParticle` alone
+        is the parcels loop overhead, that is subtracted from the time of each kernel.
+
+        Parameters
+        ----------
+        pclass: :class:`parcels.particle.JITParticle`
+            Particle class of the simulation
+        kernels: list
+            List of kernel functions
+        dt: :class:`datetime.timedelta`
+            Time step of the simulation
+        steps: int, default=48
+            Number of time steps to run each kernel for
+
+        Returns
+        -------
+        self
+        """
+        initial = self._initial
+        if initial is None or len(initial['lon']) == 0:
+            raise ValueError("Can't profile kernels without particles, the profiler must be used on an execution first")
+        fieldset = self.particleset.fieldset
+        dt = dt.total_seconds() if isinstance(dt, timedelta) else float(dt)
+        t0 = np.nanmin(initial['time'])
+
+        isolated = {}
+        for kernel in [DeleteErrorParticle] + list(kernels):
+            P = ParticleSet(fieldset=fieldset, pclass=pclass,
+                            lon=initial['lon'], lat=initial['lat'], depth=initial['depth'],
+                            time=np.full_like(initial['time'], t0),
+                            **{var: initial[var] for var in self.variables})
+            K = P.Kernel(kernel) if kernel == DeleteErrorParticle else P.Kernel(kernel) + P.Kernel(DeleteErrorParticle)
+            P.execute(K, runtime=dt, dt=dt, verbose_progress=False)  # Compile the kernel
+            start = time.perf_counter()
+            P.execute(K, runtime=steps * dt, dt=dt, verbose_progress=False)
+            isolated[kernel.__name__] = time.perf_counter() - start
+            log.debug("%s: %0.4fs for %i steps in isolation" % (kernel.__name__, isolated[kernel.__name__], steps))
+
+        overhead = isolated.pop(DeleteErrorParticle.__name__)
+        cost = {name: max(isolated[name] - overhead, 0.) for name in isolated}
+        cost['loop'] = overhead
+        total = np.sum(list(cost.values()))
+        self.kernels = {name: self.timings['kernels'] * cost[name] / total for name in cost}
+        self.kernels_isolated = {name: isolated[name] / steps / len(initial['lon']) for name in isolated}
+        return self
+
+    def to_dict(self) -> dict:
+        """Return profiling results as a dictionary serialisable in json, times in seconds"""
+        profile = {'wall_time': self.wall_time}
+        for step in self.steps:
+            profile["%s_time" % step] = self.timings[step]
+        profile['other_time'] = self.wall_time - np.sum(list(self.timings.values()))
+        profile['calls'] = self.calls.copy()
+        if self.kernels is not None:
+            profile['kernels'] = self.kernels.copy()
+            profile['kernels_isolated_time_per_particle_step'] = self.kernels_isolated.copy()
+        time_origin = self.particleset.fieldset.time_origin
+        profile['particles'] = {'time': [str(time_origin.fulltime(t)) for t in self._counts['time']],
+                                'count': list(self._counts['particles'])}
+        return profile
+
+    def to_json(self, fp=None, indent=4):
+        """Save profiling results to a JSON file or return a JSON string"""
+        if fp is None:
+            return json.dumps(self.to_dict(), indent=indent)
+        if isinstance(fp, str):
+            with open(fp, 'w') as f:
+                json.dump(self.to_dict(), f, indent=indent)
+        else:
+            json.dump(self.to_dict(), fp, indent=indent)
+
+
+class PrefetchFileBuffer(DeferredNetcdfFileBuffer):
+    """Parcels file buffer serving velocity snapshots decoded in advance by a :class:`SnapshotPrefetcher`
+
+    Parcels creates one file buffer per velocity snapshot to load. This one does not open the file: time steps and
+    data are requested from the :attr:`prefetcher` of the class, created by :meth:`SnapshotPrefetcher.attach`.
+    """
+
+    prefetcher = None
+    """The :class:`SnapshotPrefetcher` serving snapshots to this class of file buffers"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._args, self._kwargs = args, kwargs
+
+    def __enter__(self):
+        return self
+
+    def time_access(self):
+        if self.timestamp is not None:
+            return super().time_access()
+        return self.prefetcher.get_time(self)
+
+    def data_access(self):
+        return self.prefetcher.get_data(self)
+
+
+class SnapshotPrefetcher:
+    """Decode the next velocity snapshots in a background thread, while kernels integrate the current ones
+
+    With a deferred load FieldSet, parcels loads a new velocity snapshot from files whenever the simulation time moves
+    to the next time step of the velocity field, on the critical path of :meth:`parcels.particleset.ParticleSet.execute`.
+    Once attached to the fields of a FieldSet, the prefetcher decodes the ``window`` snapshots following the last one
+    loaded by parcels, so that file reading and decoding overlap with the kernels execution.
+
+    Decoded snapshots are kept in a ring buffer bounded to ``window`` snapshots per variable, that only holds the
+    snapshots ahead of the last one loaded. All file accesses are made by a single background thread, that is stopped
+    by :meth:`close`, or when the prefetcher is garbage collected.
+
+    Examples
+    --------
+    >>> prefetcher = SnapshotPrefetcher(window=2).attach(fieldset.U).attach(fieldset.V)
+    >>> P.execute(K, runtime=timedelta(days=10), dt=timedelta(minutes=5))
+    >>> prefetcher.stats  # Snapshots served from the ring buffer ('hits') or decoded on demand ('misses')
+    >>> prefetcher.close()
+    """
+
+    def __init__(self, window: int = 2):
+        """
+
+        Parameters
+        ----------
+        window: int, default=2
+            Number of snapshots decoded in advance, per variable
+        """
+        if int(window) < 1:
+            raise ValueError("'window' must be a positive number of snapshots")
+        self.window = int(window)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='virtualfleet-prefetch')
+        self._finalizer = weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+        self._fields = []  # Attached fields
+        self._ring = {}  # Variable name -> OrderedDict of (file, time index) -> Future of decoded data
+        self._sequences = {}  # Variable name -> (files of each time step, index of the first time step of each file)
+        self._last = {}  # Variable name -> time step of the last snapshot served
+        self._times = {}  # File -> time steps
+        self.stats = {'hits': 0, 'misses': 0, 'wait_time': 0.}
+
+    def __repr__(self):
+        summary = ["<SnapshotPrefetcher>"]
+        summary.append("- Window: %i snapshot(s) per variable" % self.window)
+        summary.append("- Variables: %s" % ", ".join(self._sequences.keys()))
+        summary.append("- Hits: %i, misses: %i, wait time: %0.3fs" % (
+            self.stats['hits'], self.stats['misses'], self.stats['wait_time']))
+        return "\n".join(summary)
+
+    def attach(self, field):
+        """Serve the snapshots of a deferred load :class:`parcels.field.Field` from this prefetcher
+
+        Fields loaded in memory, with per-file timestamps or with dask chunks, are left unchanged.
+        """
+        if not field.grid.defer_load or field._field_fb_class is not DeferredNetcdfFileBuffer \
+                or field.timestamps is not None or not isinstance(field.filebuffername, str):
+            log.debug("No snapshot prefetching for field %s" % field.name)
+            return self
+        files = np.asarray(field._dataFiles).astype(str)
+        first = {}
+        for ii, file in enumerate(files):
+            first.setdefault(file, ii)
+        self._sequences[field.filebuffername] = (files, first)
+        self._ring[field.filebuffername] = collections.OrderedDict()
+        field._field_fb_class = type('PrefetchFileBuffer', (PrefetchFileBuffer,), {'prefetcher': self})
+        self._fields.append(field)
+        return self
+
+    def close(self):
+        """Cancel pending snapshots, stop the background thread and detach fields
+
+        Snapshots of detached fields are loaded on demand by parcels again.
+        """
+        self._finalizer.detach()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for ring in self._ring.values():
+            ring.clear()
+        for field in self._fields:
+            field._field_fb_class = DeferredNetcdfFileBuffer
+        self._fields = []
+        return self
+
+    def _read_time(self, filebuffer, file):
+        if file not in self._times:
+            with DeferredNetcdfFileBuffer(file, *filebuffer._args[1:], **filebuffer._kwargs) as fb:
+                self._times[file] = fb.time
+        return self._times[file]
+
+    def _decode(self, filebuffer, file, name, ti):
+        with DeferredNetcdfFileBuffer(file, *filebuffer._args[1:], **filebuffer._kwargs) as fb:
+            if file not in self._times:
+                self._times[file] = fb.time
+            fb.name, fb.ti = name, ti
+            return fb.data
+
+    def _wait(self, future):
+        start = time.perf_counter()
+        result = future.result()
+        self.stats['wait_time'] += time.perf_counter() - start
+        return result
+
+    def get_time(self, filebuffer) -> np.ndarray:
+        """Return the time steps of the file of a file buffer"""
+        file = str(filebuffer.filename)
+        if file in self._times:
+            return self._times[file]
+        return self._wait(self._executor.submit(self._read_time, filebuffer, file))
+
+    def get_data(self, filebuffer) -> np.ndarray:
+        """Return the snapshot of a file buffer, and schedule the decoding of the next ones"""
+        file, name = str(filebuffer.filename), filebuffer.name
+        ti = int(filebuffer.ti) % len(self.get_time(filebuffer))  # Parcels gives -1 for the last time step of a file
+        ring = self._ring[name]
+        future = ring.pop((file, ti), None)
+        if future is None:
+            self.stats['misses'] += 1
+            future = self._executor.submit(self._decode, filebuffer, file, name, ti)
+        else:
+            self.stats['hits'] += 1
+        data = self._wait(future)
+
+        # Schedule the next snapshots, in the direction of the simulation:
+        files, first = self._sequences[name]
+        if file in first:
+            step = first[file] + ti
+            direction = -1 if name in self._last and step < self._last[name] else 1
+            self._last[name] = step
+            ahead = [(files[ii], ii - first[files[ii]])
+                     for ii in range(step + direction, step + direction * (self.window + 1), direction)
+                     if 0 <= ii < len(files)]
+            for key in [key for key in ring if key not in ahead]:  # Drop snapshots not ahead anymore
+                ring.pop(key).cancel()
+            for key in ahead:
+                if key not in ring:
+                    ring[key] = self._executor.submit(self._decode, filebuffer, key[0], name, key[1])
+        return data
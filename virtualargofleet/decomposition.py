@@ -0,0 +1,414 @@
+"""
+Run a Virtual Fleet simulation with a spatial domain decomposition
+"""
+import concurrent.futures
+import numbers
+import os
+import shutil
+import time
+import logging
+from datetime import timedelta
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+import zarr
+
+from .virtualargofleet import VirtualFleet, DEFAULT_DEPLOYMENT_DEPTH, STATE_VARIABLES
+from .velocity_helpers import VelocityFieldFacade, get_subset_box, DEFAULT_MAX_DRIFT_SPEED
+from .app_parcels import ArgoParticle
+from .utilities import SimulationSet, MissionTable
+
+
+log = logging.getLogger("virtualfleet.decomposition")
+
+
+_tile_velocity = None
+"""VelocityField of a tile process, clipped to the padded tile domain"""
+
+_tile_fleet = None
+"""VirtualFleet of a tile process, re-used at each synchronization date with the kernels it compiled"""
+
+
+def _init_tile(velocity: dict, box: dict):
+    """Build the VelocityField of a tile process"""
+    global _tile_velocity
+    start = time.perf_counter()
+    _tile_velocity = VelocityFieldFacade(**{**velocity, 'subset': box})
+    _tile_velocity.fieldset  # Make sure a lazy field is built now
+    log.info("Tile process %i: velocity field built in %0.2fs" % (os.getpid(), time.perf_counter() - start))
+
+
+def _run_tile(state: dict, end: np.datetime64, step, record, isglobal: bool, output_path: str) -> dict:
+    """Simulate floats of a tile up to a synchronization date, and return their new state
+
+    The VirtualFleet of the tile process is created on the first call, and its floats are replaced with
+    :meth:`VirtualFleet.set_state` on the next calls, so that parcels kernels are only compiled once per tile.
+    """
+    global _tile_fleet
+    if _tile_fleet is None:
+        plan = {key: state[key] for key in ['lat', 'lon', 'depth', 'time']}
+        mission = MissionTable({key: state[key] for key in MissionTable.required}, validate=False)
+        _tile_fleet = VirtualFleet(plan=plan, fieldset=_tile_velocity, mission=mission,
+                                   isglobal=isglobal and _tile_velocity.isglobal)
+    VFleet = _tile_fleet
+    VFleet.set_state(state)
+    VFleet.simulations_set = SimulationSet()  # Each synchronization period is a new simulation of the tile
+
+    # Parcels starts the execution at the earliest float date, so that the duration is adjusted to end on time:
+    duration = pd.Timedelta(end - np.min(state['time'])).to_pytimedelta()
+    # A single chunk of observations per float, so that parcels doesn't extend the trajectory store at every record:
+    chunks = (len(state['float']), int(duration / record) + 1)
+    VFleet.simulate(duration=duration, step=step, record=record, restart=True, verbose_progress=False,
+                    output_folder=os.path.dirname(output_path), output_file=os.path.basename(output_path),
+                    output_chunks=chunks)
+
+    run = VFleet.simulations_set.last.copy()
+    run.pop('opts')  # Holds the parcels ParticleFile, that can't be sent back to the main process
+    run['worker'] = os.getpid()
+    run['id_offset'] = VFleet._parcels['id_offset']
+    new_state = VFleet.get_state()
+    run['lost'] = np.setdiff1d(state['float'], new_state['float'])
+    return {'state': new_state, 'run': run}
+
+
+def _initial_state(plan: dict, mission: MissionTable) -> dict:
+    """Return the state of floats at deployment"""
+    N = len(plan['lat'])
+    state = {'float': np.arange(N),
+             'lon': np.asarray(plan['lon'], dtype=np.float32),
+             'lat': np.asarray(plan['lat'], dtype=np.float32),
+             'depth': np.asarray(plan['depth'], dtype=np.float32) if plan.get('depth') is not None
+             else np.full((N,), DEFAULT_DEPLOYMENT_DEPTH, dtype=np.float32),
+             'time': np.asarray(plan['time'], dtype='datetime64[ns]')}
+    for key in STATE_VARIABLES:
+        v = getattr(ArgoParticle, key)
+        state[key] = np.full((N,), v.initial, dtype=v.dtype)
+    for key in MissionTable.required:
+        state[key] = np.asarray(mission[key])
+    return state
+
+
+def _select(state: dict, mask: np.ndarray) -> dict:
+    return {key: state[key][mask] for key in state}
+
+
+def _concat(states: List[dict]) -> dict:
+    state = {key: np.concatenate([s[key] for s in states]) for key in states[0]}
+    isort = np.argsort(state['float'])
+    return {key: state[key][isort] for key in state}
+
+
+def merge_trajectories(parts: List[Tuple[str, int]], output_path: str, N: int, record, chunks: int = 1000) -> str:
+    """Merge partial trajectory stores into a single trajectory store
+
+    Observations are aligned on the recording period from the first date of each float, as in a single
+    simulation. Observations recorded more than once, at synchronization dates, are written once.
+
+    Parameters
+    ----------
+    parts: list of tuples
+        List of (path, offset) tuples, with the path to a partial zarr trajectory store and the offset to subtract
+        from its ``trajectory`` values to get the index of the float in the deployment plan.
+    output_path: str
+        Path to the merged zarr trajectory store
+    N: int
+        Number of floats in the deployment plan
+    record: :class:`datetime.timedelta`
+        Recording period of the partial simulations
+    chunks: int, optional
+        Number of trajectories per chunk of the merged store
+
+    Returns
+    -------
+    str
+        Path to the merged trajectory store
+    """
+    def read_times(group):
+        """Return float index and observation dates of a partial store"""
+        origin = np.datetime64(group['time'].attrs['units'].split('since')[-1].strip(), 'ns')
+        seconds = group['time'][:]
+        dates = origin + np.round(np.nan_to_num(seconds) * 1e9).astype('timedelta64[ns]')
+        return dates.astype('int64'), ~np.isnan(seconds)
+
+    record = np.int64(pd.Timedelta(record).value)
+
+    # First pass to get the first and last recorded dates of each float:
+    first = np.full((N,), np.iinfo(np.int64).max)
+    last = np.full((N,), np.iinfo(np.int64).min)
+    for path, offset in parts:
+        group = zarr.open_group(path, mode='r')
+        ifloat = np.broadcast_to((group['trajectory'][:] - offset)[:, np.newaxis], group['time'].shape)
+        dates, valid = read_times(group)
+        np.minimum.at(first, ifloat[valid], dates[valid])
+        np.maximum.at(last, ifloat[valid], dates[valid])
+    recorded = first <= last
+    nobs = int(np.max((last[recorded] - first[recorded] + record // 2) // record)) + 1 if np.any(recorded) else 0
+    t0 = np.min(first[recorded]) if np.any(recorded) else 0
+
+    # Create the merged store with the layout of the first partial store:
+    template = zarr.open_group(parts[0][0], mode='r')
+    merged = zarr.open_group(output_path, mode='w')
+    merged.attrs.update(template.attrs.asdict())
+    shape, chunks = (N, nobs), (min(chunks, max(N, 1)), max(nobs, 1))
+    for name in template.array_keys():
+        if name in ['trajectory', 'obs']:
+            continue
+        z = merged.create_dataset(name, shape=shape, chunks=chunks, dtype=template[name].dtype,
+                                  fill_value=template[name].fill_value)
+        z.attrs.update(template[name].attrs.asdict())
+    merged['time'].attrs['units'] = "seconds since %s" % np.datetime64(int(t0), 'ns')
+    # Coordinates have no fill value, as in parcels stores, otherwise xarray would mask float 0 and obs 0:
+    for name, values in [('trajectory', np.arange(N, dtype=np.int64)), ('obs', np.arange(nobs, dtype=np.int32))]:
+        merged.create_dataset(name, data=values, fill_value=template[name].fill_value).attrs.update(
+            template[name].attrs.asdict())
+
+    # Second pass to write observations of each partial store:
+    for path, offset in parts:
+        group = zarr.open_group(path, mode='r')
+        ifloat = np.broadcast_to((group['trajectory'][:] - offset)[:, np.newaxis], group['time'].shape)
+        dates, valid = read_times(group)
+        rows = ifloat[valid]
+        cols = (dates[valid] - first[rows] + record // 2) // record
+        for name in merged.array_keys():
+            if name in ['trajectory', 'obs']:
+                continue
+            if name == 'time':
+                values = (dates[valid] - t0) / 1e9
+            else:
+                values = group[name][:][valid]
+            merged[name].set_coordinate_selection((rows, cols), values)
+    zarr.consolidate_metadata(output_path)
+    return output_path
+
+
+class TiledFleet:
+    """Virtual Fleet simulation with a spatial domain decomposition
+
+    The deployment plan is partitioned into longitude/latitude tiles, and floats of each tile are simulated in their
+    own process, with a velocity field clipped to the tile domain padded by the distance that can be covered by a
+    float between two synchronization dates. At each synchronization date, floats are handed off to the tile they
+    drifted into. Partial trajectories are merged into a single trajectory store at the end of the simulation.
+
+    Tile edges are set from the quantiles of the deployment positions, so that tiles hold about the same number of
+    floats at deployment. The outer tiles extend to the domain that can be reached by floats during the simulation.
+
+    Each tile process keeps a single :class:`VirtualFleet` for the whole simulation, so that parcels kernels are only
+    compiled once per tile. Floats deleted during a tile simulation, e.g. because they drifted out of the padded tile
+    domain with a ``max_speed`` too low, are counted in :meth:`to_dataframe`, listed in the ``lost`` attribute and
+    reported with a warning.
+
+    Examples
+    --------
+    >>> velocity = {'model': 'GLORYS12V1', 'src': "/home/data/GLORYS12V1/*.nc"}
+    >>> VFleet = TiledFleet(plan=my_plan, mission=FloatConfiguration('default'), velocity=velocity, tiles=(4, 2))
+    >>> VFleet.simulate(duration=timedelta(days=365), sync=timedelta(days=10), output_file='simu.zarr')
+    >>> VFleet.to_dataframe()  # Timings of each tile simulation
+    """
+
+    def __init__(self,
+                 plan: dict,
+                 mission,
+                 velocity: dict,
+                 tiles: Tuple[int, int] = (2, 2),
+                 isglobal: bool = False,
+                 max_speed: float = DEFAULT_MAX_DRIFT_SPEED):
+        """Create a Virtual Fleet simulation with a spatial domain decomposition
+
+        Parameters
+        ----------
+        plan: dict
+            A dictionary with the deployment plan coordinates as keys: ``lat``, ``lon``, ``time``, [``depth``]
+        mission:
+            Float mission parameters, see :class:`VirtualFleet` for possible values
+        velocity: dict
+            Arguments to pass on to :meth:`Velocity` in order to build the velocity field in each tile process.
+        tiles: tuple of int, default=(2, 2)
+            Number of tiles along longitude and latitude. There is one process per tile.
+        isglobal: bool, optional, default=False
+            A boolean indicating weather the velocity field is global or not. Periodic boundary conditions only
+            apply to tiles covering the entire longitude range of the velocity field.
+        max_speed: float, optional
+            Upper bound of the floats drift speed, in m/s, used to pad tiles
+        """
+        for key in ['lat', 'lon', 'time']:
+            if key not in plan:
+                raise ValueError("The 'plan' argument must have a '%s' key" % key)
+        self.deployment_plan = plan
+        mission = MissionTable.from_any(mission)
+        if len(mission) != len(plan['lat']):
+            if len(mission) == 1:
+                mission = mission.broadcast(len(plan['lat']))
+            else:
+                raise TypeError("When providing a `mission` array, it should be the same lenght as your `plan`")
+        self.mission = mission
+
+        if not isinstance(velocity, dict):
+            raise TypeError("'velocity' must be a dictionary of arguments to pass on to Velocity()")
+        self.velocity = velocity
+        self.tiles = tuple(tiles)
+        if len(self.tiles) != 2 or min(self.tiles) < 1:
+            raise ValueError("'tiles' must be a tuple with the number of tiles along longitude and latitude")
+        self.isglobal = bool(isglobal)
+        self.max_speed = max_speed
+        self.output = None
+        self.edges = None
+        self.runs = []
+        self.lost = None
+        self.simulations_set = SimulationSet()
+
+    def __repr__(self):
+        summary = ["<VirtualFleet.TiledFleet>"]
+        summary.append("- %i floats in the deployment plan" % self.N)
+        summary.append("- %i x %i tiles" % self.tiles)
+        if self.simulations_set.simulated:
+            summary.append("- Trajectory file: %s" % self.output)
+        else:
+            summary.append("- No simulation performed")
+        return "\n".join(summary)
+
+    @property
+    def N(self):
+        """Number of floats in the deployment plan"""
+        return len(self.deployment_plan['lat'])
+
+    def _set_edges(self, box: dict):
+        """Compute tile edges from the quantiles of deployment positions, within the reachable domain"""
+        self.edges = {}
+        for key, n in zip(['lon', 'lat'], self.tiles):
+            inner = np.quantile(np.asarray(self.deployment_plan[key], dtype=float), np.linspace(0, 1, n + 1)[1:-1])
+            self.edges[key] = np.concatenate([[box[key][0]], inner, [box[key][1]]])
+        return self
+
+    def tile_of(self, lon, lat) -> np.ndarray:
+        """Return the tile index of positions
+
+        Positions outside of the tiles are assigned to the nearest tile.
+        """
+        nx, ny = self.tiles
+        ix = np.clip(np.searchsorted(self.edges['lon'][1:-1], lon, side='right'), 0, nx - 1)
+        iy = np.clip(np.searchsorted(self.edges['lat'][1:-1], lat, side='right'), 0, ny - 1)
+        return iy * nx + ix
+
+    def tile_box(self, itile: int, sync, tmin, tmax) -> dict:
+        """Return the domain of the velocity field of a tile, padded by the distance covered in ``sync``"""
+        nx, _ = self.tiles
+        ix, iy = itile % nx, itile // nx
+        corners = {'lon': self.edges['lon'][ix:ix + 2], 'lat': self.edges['lat'][iy:iy + 2], 'time': [tmin]}
+        box = get_subset_box(corners, sync, self.max_speed)
+        box['time'] = [tmin, tmax]
+        return box
+
+    def simulate(self,
+                 duration,
+                 step=timedelta(minutes=5),
+                 record=timedelta(hours=1),
+                 sync=timedelta(days=10),
+                 output_folder: str = ".",
+                 output_file: str = "simulation.zarr"):
+        """Execute the Virtual Fleet simulation
+
+        Parameters
+        ----------
+        duration: :class:`datetime.timedelta` or numeric
+            Length of the simulation (in days if numeric)
+        step: :class:`datetime.timedelta`, default=5 minutes
+            Time step for the computation
+        record: :class:`datetime.timedelta`, default=1 hours
+            Time step for writing the output
+        sync: :class:`datetime.timedelta` or numeric, default=10 days
+            Time between two synchronization dates, when floats are handed off between tiles. It must be a multiple
+            of ``record``. Longer periods require larger tile paddings.
+        output_folder: str, default="."
+            Name of folder where to store the ``output_file`` zarr archive
+        output_file: str, default="simulation.zarr"
+            Name of the zarr store where to save merged trajectories
+
+        Returns
+        -------
+        self
+        """
+        if isinstance(duration, numbers.Number):
+            duration = timedelta(days=float(duration))
+        if isinstance(sync, numbers.Number):
+            sync = timedelta(days=float(sync))
+        if np.remainder(sync, record) > timedelta(0):
+            raise ValueError('The synchronization period must be a multiple of the recording period')
+
+        state = _initial_state(self.deployment_plan, self.mission)
+        tmin = np.min(state['time'])
+        tmax = tmin + np.timedelta64(duration)
+        box = get_subset_box(self.deployment_plan, duration, self.max_speed)
+        self._set_edges(box)
+
+        self.output = os.path.abspath(os.path.join(output_folder, output_file))
+        parts_folder = self.output + ".parts"
+        os.makedirs(parts_folder, exist_ok=True)
+
+        ntiles = int(np.prod(self.tiles))
+        log.info("Starting simulation of %i floats with %i tiles" % (self.N, ntiles))
+        execution_start, process_start = time.time(), time.process_time()
+        executors = [concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_init_tile,
+                                                            initargs=(self.velocity,
+                                                                      self.tile_box(itile, sync, tmin, tmax)))
+                     for itile in range(ntiles)]
+        parts, runs, lost = [], [], []
+        try:
+            isync, start = 0, tmin
+            while start < tmax:
+                end = min(start + np.timedelta64(sync), tmax)
+                deployed = state['time'] < end  # Floats not deployed yet wait in the main process
+                tile = self.tile_of(state['lon'], state['lat'])
+                futures = {}
+                for itile in range(ntiles):
+                    selected = deployed & (tile == itile)
+                    if np.any(selected):
+                        path = os.path.join(parts_folder, "tile_%0.3d_sync_%0.4d.zarr" % (itile, isync))
+                        futures[executors[itile].submit(_run_tile, _select(state, selected), end, step, record,
+                                                        self.isglobal, path)] = (itile, path, np.sum(selected))
+                states = [_select(state, ~deployed)]
+                for future in concurrent.futures.as_completed(futures):
+                    itile, path, n = futures[future]
+                    result = future.result()
+                    states.append(result['state'])
+                    parts.append((path, result['run']['id_offset']))
+                    runs.append({**result['run'], 'tile': itile, 'sync': isync, 'N': int(n),
+                                 'lost': len(result['run']['lost'])})
+                    lost.append(result['run']['lost'])
+                    if len(result['run']['lost']) > 0:
+                        log.warning("Synchronization %i (%s): %i float(s) of tile %i deleted, they may have left "
+                                    "the padded tile domain, in which case 'max_speed' should be increased: %s"
+                                    % (isync, end, len(result['run']['lost']), itile, result['run']['lost'][:10]))
+                state = _concat(states)
+                log.info("Synchronization %i (%s): %i floats" % (isync, end, len(state['float'])))
+                isync, start = isync + 1, end
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+        log.info("Merging %i partial trajectory stores" % len(parts))
+        merge_start = time.time()
+        merge_trajectories(sorted(parts), self.output, self.N, record)
+        shutil.rmtree(parts_folder)
+        execution_end, process_end = time.time(), time.process_time()
+
+        self.runs = runs
+        self.lost = np.sort(np.concatenate(lost)) if len(lost) > 0 else np.empty((0,), dtype=int)
+        self.simulations_set.add({'duration': duration,
+                                  'N': self.N,
+                                  'step': step,
+                                  'record': record,
+                                  'sync': sync,
+                                  'tiles': self.tiles,
+                                  'output_path': self.output,
+                                  'execution_wall_time': pd.Timedelta(execution_end - execution_start, 's'),
+                                  'execution_cpu_time': pd.Timedelta(process_end - process_start, 's'),
+                                  'merge_wall_time': pd.Timedelta(execution_end - merge_start, 's'),
+                                  'execution_date': pd.to_datetime("now", utc=True).strftime("%Y%m%d-%H%M%S"),
+                                  })
+        return self
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return the number of floats, number of deleted floats and timings of each tile simulation, between two
+        synchronization dates"""
+        cols = ['sync', 'tile', 'N', 'lost', 'worker', 'execution_wall_time', 'execution_cpu_time']
+        return pd.DataFrame([{key: run[key] for key in cols} for run in self.runs]).set_index(['sync', 'tile'])
@@ -0,0 +1,192 @@
+"""
+Run ensembles of independent Virtual Fleet simulations
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import time
+import logging
+from datetime import timedelta
+from typing import Iterable, List
+import pandas as pd
+import zarr
+
+from .virtualargofleet import VirtualFleet
+from .velocity_helpers import VelocityFieldFacade
+from .utilities import SimulationSet, FloatConfiguration, MissionTable
+
+
+log = logging.getLogger("virtualfleet.ensemble")
+
+
+_worker_velocity = None
+"""VelocityField of a worker process, built once and shared by all the members run by this worker"""
+
+
+def _init_worker(velocity: dict):
+    """Build the VelocityField of a worker process"""
+    global _worker_velocity
+    start = time.perf_counter()
+    _worker_velocity = VelocityFieldFacade(**velocity)
+    _worker_velocity.fieldset  # Make sure a lazy field is built now
+    log.info("Worker %i: velocity field built in %0.2fs" % (os.getpid(), time.perf_counter() - start))
+
+
+def _run_member(imember: int, plan: dict, mission, isglobal: bool, simulate: dict, output_path: str) -> dict:
+    """Simulate one ensemble member with the velocity field of the worker process and return its meta-data"""
+    start = time.perf_counter()
+    VFleet = VirtualFleet(plan=plan, fieldset=_worker_velocity, mission=mission, isglobal=isglobal)
+    init_time = time.perf_counter() - start
+
+    if output_path is not None:
+        output = {'output_folder': os.path.dirname(output_path), 'output_file': os.path.basename(output_path)}
+    else:
+        output = {'output': False}
+    VFleet.simulate(**simulate, **output)
+
+    run = VFleet.simulations_set.last.copy()
+    run.pop('opts')  # Holds the parcels ParticleFile, that can't be sent back to the main process
+    run['member'] = imember
+    run['N'] = len(plan['lat'])
+    run['init_time'] = pd.Timedelta(init_time, 's')
+    run['velocity_timings'] = _worker_velocity.timings
+    run['worker'] = os.getpid()
+    return run
+
+
+class FleetEnsemble:
+    """Ensemble of independent Virtual Fleet simulations run in a pool of processes
+
+    All members share the same velocity field, and each member has its own deployment plan and float mission.
+    Each worker process builds the velocity field once and re-uses it for all the members it runs.
+    Trajectories of each member are written to their own zarr group of a single zarr store.
+
+    Examples
+    --------
+    >>> velocity = {'model': 'GLORYS12V1', 'src': "/home/data/GLORYS12V1/*.nc"}
+    >>> members = [(my_plan, FloatConfiguration('default').update('parking_depth', d)) for d in [500, 1000, 1500]]
+    >>> E = FleetEnsemble(members, velocity=velocity)
+    >>> E.run(duration=timedelta(days=60), output_file='ensemble.zarr', workers=3)
+    >>> E.simulations_set.runs  # Meta-data of each member simulation
+    >>> xr.open_zarr(E.output, group=E.groups[0])  # Trajectories of the 1st member
+    """
+
+    def __init__(self,
+                 members: Iterable,
+                 velocity: dict,
+                 isglobal: bool = False):
+        """Create an ensemble of Virtual Fleet simulations
+
+        Parameters
+        ----------
+        members: iterable
+            An iterable of (plan, mission) tuples, or of dictionaries with ``plan`` and ``mission`` keys. See
+            :class:`VirtualFleet` for possible plan and mission values.
+        velocity: dict
+            Arguments to pass on to :meth:`Velocity` in order to build the velocity field in each worker process.
+        isglobal: bool, optional, default=False
+            A boolean indicating weather the velocity field is global or not
+        """
+        self.members = []
+        for member in members:
+            if isinstance(member, dict):
+                member = (member['plan'], member['mission'])
+            plan, mission = member
+            if isinstance(mission, FloatConfiguration):
+                mission = mission.mission  # Send a dictionary to the workers
+            elif isinstance(mission, MissionTable):
+                mission = mission.to_dataframe()
+            self.members.append((plan, mission))
+
+        if not isinstance(velocity, dict):
+            raise TypeError("'velocity' must be a dictionary of arguments to pass on to Velocity()")
+        self.velocity = velocity
+        self.isglobal = bool(isglobal)
+        self.output = None
+        self.simulations_set = SimulationSet()
+
+    def __repr__(self):
+        summary = ["<VirtualFleet.FleetEnsemble>"]
+        summary.append("- %i members" % self.N)
+        summary.append("- %i floats in total" % sum([len(plan['lat']) for plan, _ in self.members]))
+        if self.simulations_set.simulated:
+            summary.append("- Ensemble output: %s" % self.output)
+        else:
+            summary.append("- No simulation performed")
+        return "\n".join(summary)
+
+    @property
+    def N(self):
+        """Number of members in the ensemble"""
+        return len(self.members)
+
+    @property
+    def groups(self) -> List[str]:
+        """Name of the zarr group with trajectories of each member"""
+        return ["member_%0.3d.zarr" % imember for imember in range(self.N)]
+
+    def run(self,
+            duration,
+            step=timedelta(minutes=5),
+            record=timedelta(hours=1),
+            output=True,
+            output_folder: str = ".",
+            output_file: str = "ensemble.zarr",
+            workers: int = None):
+        """Execute simulations of all ensemble members
+
+        Parameters
+        ----------
+        duration: :class:`datetime.timedelta`,
+            Length of the simulation
+        step: :class:`datetime.timedelta`, default=5 minutes
+            Time step for the computation
+        record: :class:`datetime.timedelta`, default=1 hours
+            Time step for writing the output
+        output: bool, default=True
+            Should the simulation trajectories be saved on file or not
+        output_folder: str, default="."
+            Name of folder where to store the ``output_file`` zarr archive
+        output_file: str, default="ensemble.zarr"
+            Name of the zarr store where to save trajectories, with one group per member
+        workers: int, optional
+            Number of worker processes. By default, the number of CPUs or of members, whichever is smaller.
+
+        Returns
+        -------
+        self
+        """
+        if output:
+            self.output = os.path.abspath(os.path.join(output_folder, output_file))
+            zarr.open_group(self.output, mode='w')  # Root group of all members
+            output_paths = [os.path.join(self.output, group) for group in self.groups]
+        else:
+            self.output = None
+            output_paths = [None] * self.N
+
+        simulate = {'duration': duration, 'step': step, 'record': record, 'verbose_progress': False}
+        workers = min(multiprocessing.cpu_count(), self.N) if workers is None else workers
+
+        log.info("Starting ensemble of %i simulations with %i workers" % (self.N, workers))
+        execution_start = time.time()
+        runs = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    initializer=_init_worker,
+                                                    initargs=(self.velocity,)) as executor:
+            future_to_member = {executor.submit(_run_member, imember, plan, mission, self.isglobal, simulate,
+                                                output_paths[imember]): imember
+                                for imember, (plan, mission) in enumerate(self.members)}
+            for future in concurrent.futures.as_completed(future_to_member):
+                imember = future_to_member[future]
+                runs[imember] = future.result()
+                log.info("Member %i done in %s" % (imember, runs[imember]['execution_wall_time']))
+        log.info("Ensemble done in %0.2fs" % (time.time() - execution_start))
+
+        for imember in range(self.N):
+            self.simulations_set.add(runs[imember])
+        return self
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return the meta-data and timings of each member simulation as a :class:`pandas.DataFrame`"""
+        cols = ['member', 'N', 'worker', 'init_time', 'execution_wall_time', 'execution_cpu_time', 'output_path']
+        return pd.DataFrame([{key: run[key] for key in cols} for run in self.simulations_set.runs]).set_index('member')
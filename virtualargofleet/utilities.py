@@ -1,4 +1,6 @@
+import base64
 import collections
+import hashlib
 import warnings
 import numpy as np
 import xarray as xr
@@ -6,26 +8,108 @@ from tqdm import tqdm
 import concurrent.futures
 import multiprocessing
 import os
+import gzip
+import shutil
 import pandas as pd
 import logging
 import json
+import tempfile
+import http.client
 import urllib.request
+import urllib.parse
+import urllib.error
 from string import Formatter
 import platform
 import socket
+import threading
+import time
 import psutil
+import parcels
 from packaging import version
-from typing import List, Dict, Union, TextIO
+from typing import List, Dict, Union, TextIO, Iterable
 import jsonschema
 from referencing import Registry, Resource
 from jsonschema import Draft202012Validator
 from pathlib import Path
 
+try:
+    import dask
+    has_dask = True
+except ModuleNotFoundError:
+    has_dask = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    has_pyarrow = True
+except ModuleNotFoundError:
+    has_pyarrow = False
+
 
 log = logging.getLogger("virtualfleet.utils")
 path2data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
 path2schemas = os.path.sep.join([os.path.dirname(os.path.abspath(__file__)), '..', 'schemas'])
 
+DEFAULT_INDEX_BLOCK_SIZE = 1000
+"""Default number of trajectories to load at once when computing a profile index"""
+
+_VALIDATORS = {}
+"""Compiled json schema validators, by schema file path"""
+
+_DEFAULT_META = {}
+"""Meta-data of the parameters of the default float configuration, loaded on first use"""
+
+DTYPES = {'float': float, 'int': int, 'str': str, 'bool': bool}
+"""Python types of configuration parameters, by the name used in json files"""
+
+
+def parse_dtype(dtype: str) -> type:
+    """Return the python type of a configuration parameter from its name in a json file"""
+    if dtype == '':
+        return dtype
+    if dtype not in DTYPES:
+        raise ValueError("Unsupported configuration parameter dtype '%s', must be one of %s" % (dtype, list(DTYPES)))
+    return DTYPES[dtype]
+
+
+def dtype_name(dtype) -> str:
+    """Return the name of a configuration parameter python type, as used in json files"""
+    return dtype.__name__ if isinstance(dtype, type) else str(dtype)
+
+
+def read_configuration(path, validate: bool = True) -> tuple:
+    """Read a float configuration json file, in format version 1.0 or 2.0
+
+    The file is read once, and a 2.0 file is validated against the configuration json schema, unless ``validate`` is
+    False.
+
+    Returns
+    -------
+    tuple
+        The configuration name and a list of parameters, each one a dictionary with ``key``, ``value`` and meta-data
+        (``description``, ``unit``, ``dtype`` as a python type and ``techkey``) to create a :class:`ConfigParam`
+    """
+    with open(path, "r") as f:
+        js = json.load(f)
+    params = []
+    if js['version'] == "1.0":
+        warnings.warn("There is a newer json file format '2.0' for Argo float configuration available, please re-save this configuration, it will automatically be updated to the new format.")
+        for key, item in js['data'].items():
+            params.append({**item['meta'], 'key': key, 'value': item['value'], 'dtype': parse_dtype(item['meta']['dtype'])})
+    elif js['version'] == "2.0":
+        # Validate json against schema:
+        json_schema = os.path.join(path2schemas, 'VF-ArgoFloat-Configuration.json')
+        errors = VFschema_configuration.validate(js, json_schema) if validate else True
+        if isinstance(errors, list):
+            log.debug(errors)
+            raise jsonschema.exceptions.ValidationError("This Float configuration file is not valid against format version 2.0\n%s" % str(errors))
+        for item in js['parameters']:
+            params.append({**item['meta'], 'key': item['name'], 'value': item['value'],
+                           'description': item['description'], 'dtype': parse_dtype(item['meta']['dtype'])})
+    else:
+        raise ValueError("Unsupported file format version '%s'" % js['version'])
+    return js['name'], params
+
 
 class VFschema:
     """A base class to export json files following a schema"""
@@ -92,31 +176,30 @@ class VFschema:
                     o = json.dump(jsdata, fpp, indent=indent, cls=self.JSONEncoder)
                 return o
 
+    @staticmethod
+    def get_validator(schema) -> Draft202012Validator:
+        """Return the validator of a json schema file, compiled once and cached at the module level"""
+        key = os.path.abspath(schema)
+        if key not in _VALIDATORS:
+            # Read schema and create validator:
+            schema = json.loads(Path(schema).read_text())
+            Draft202012Validator.check_schema(schema)
+            res = Resource.from_contents(schema)
+            registry = Registry(retrieve = res)
+            _VALIDATORS[key] = jsonschema.Draft202012Validator(schema, registry=registry)
+        return _VALIDATORS[key]
+
     @staticmethod
     def validate(data, schema) -> Union[bool, List]:
-        # Read schema and create validator:
-        schema = json.loads(Path(schema).read_text())
-        res = Resource.from_contents(schema)
-        registry = Registry(retrieve = res)
-        validator = jsonschema.Draft202012Validator(schema, registry=registry)
+        """Validate json data, a file path or an already decoded dictionary, against a json schema file
 
-        # Read data and validate against schema:
-        data = json.loads(Path(data).read_text())
-        # return validator.validate(data)
-        try:
-            validator.validate(data)
-        except jsonschema.exceptions.ValidationError:
-            pass
-        except jsonschema.exceptions.SchemaError as error:
-            log.debug("SchemaError")
-            raise
-        except jsonschema.exceptions.UnknownType as error:
-            log.debug("UnknownType")
-            raise
-        except jsonschema.exceptions.UndefinedTypeCheck as error:
-            log.debug("UndefinedTypeCheck")
-            raise
+        Returns True if data are valid, or the list of validation errors.
+        """
+        validator = VFschema.get_validator(schema)
 
+        # Read data and validate against schema:
+        if not isinstance(data, dict):
+            data = json.loads(Path(data).read_text())
         errors = list(validator.iter_errors(data))
         return True if len(errors) == 0 else errors
 
@@ -198,7 +281,7 @@ class ConfigParam:
     >>> p.value
 
     """
-    str_val = lambda s, v: ("%s" % v).split("'")[1] if isinstance(v, type) else str(v)
+    str_val = lambda s, v: dtype_name(v)
 
     def __init__(self, key, value, **kwargs):
         self.key = key
@@ -219,7 +302,7 @@ class ConfigParam:
             try:
                 value = self.meta['dtype'](value)
             except ValueError:
-                raise ValueError("Cannot cast '%s' value as expected %s" % (self.key, self.str_val(self.meta['dtype'])))
+                raise ValueError("Cannot cast '%s' value as expected %s" % (self.key, dtype_name(self.meta['dtype'])))
         self._value = value
 
     @property
@@ -230,7 +313,7 @@ class ConfigParam:
             'description': self.meta['description'],
             'meta': {
                     'unit': self.meta['unit'],
-                    'dtype': self.str_val(self.meta['dtype']),
+                    'dtype': dtype_name(self.meta['dtype']),
                     'techkey': self.meta['techkey']}
         })
 
@@ -254,6 +337,7 @@ class FloatConfiguration:
     >>> cfg = FloatConfiguration('local-change')  # Internally defined
     >>> cfg = FloatConfiguration('cfg_file.json')  # From any json file
     >>> cfg = FloatConfiguration([6902919, 132])  # From Euro-Argo Fleet API
+    >>> cfgs = FloatConfiguration.from_wmos([6902919, 6902920])  # Batch download from Euro-Argo Fleet API
     >>> cfg.update('parking_depth', 500)  # Update one parameter value
     >>> cfg.params  # Return the list of parameters
     >>> cfg.mission # Return the configuration as a dictionary
@@ -268,64 +352,20 @@ class FloatConfiguration:
 
         Parameters
         ----------
-        name: str
-            Name of the configuration to load
+        name: str or list
+            Name of the configuration to load, a json file, or a [wmo, cycle number] list to load the configuration
+            of a real float cycle from the Euro-Argo fleet monitoring API
+        data: dict, optional
+            With a [wmo, cycle number] list, the float meta-data already downloaded with :meth:`fetch_float_meta`
         """
         self._params_dict = {}
 
-        def load_from_json_v1(name):
-            # Load configuration from file
-            with open(name, "r") as f:
-                js = json.load(f)
-            if js['version'] != "1.0":
-                raise ValueError("This file is not with format 1.0 version: '%s'" % js['version'])
-            name = js['name']
-            data = js['data']
-            for key in data.keys():
-                value = data[key]['value']
-                meta = data[key]['meta']
-                meta['dtype'] = eval(meta['dtype'])
-                self.params = ConfigParam(key=key, value=value, **meta)
-            return name, data
-
-        def load_from_json_v2(name):
-            # Load configuration from file:
-            with open(name, "r") as f:
-                js = json.load(f)
-            if js['version'] != "2.0":
-                raise ValueError("This file is not with format 2.0 version: '%s'" % js['version'])
-
-            # Validate json against schema:
-            # json_schema = Path(os.path.join(path2schemas, 'VF-ArgoFloat-Configuration.json')).read_text()
-            json_schema = os.path.join(path2schemas, 'VF-ArgoFloat-Configuration.json')
-            errors = VFschema_configuration.validate(name, json_schema)
-            if isinstance(errors, list):
-                log.debug(list)
-                raise jsonschema.exceptions.ValidationError("This Float configuration file is not valid against format version 2.0\n%s" % str(errors))
-
-            # Load to FloatConfiguration instance:
-            name = js['name']
-            parameters = js['parameters']
-            for param_obj in parameters:
-                key = param_obj['name']
-                value = param_obj['value']
-                meta = param_obj['meta']
-                meta['description'] = param_obj['description']
-                meta['dtype'] = eval(meta['dtype'])
-                self.params = ConfigParam(key=key, value=value, **meta)
-            return name, parameters
-
         def load_from_json(name):
             # Load configuration from file
-            with open(name, "r") as f:
-                js = json.load(f)
-            if js['version'] == "1.0":
-                warnings.warn("There is a newer json file format '2.0' for Argo float configuration available, please re-save this configuration, it will automatically be updated to the new format.")
-                return load_from_json_v1(name)
-            elif js['version'] == "2.0":
-                return load_from_json_v2(name)
-            else:
-                raise ValueError("Unsupported file format version '%s'" % js['version'])
+            name, params = read_configuration(name)
+            for param in params:
+                self.params = ConfigParam(**param)
+            return name, params
 
         if name == 'default':
             name, data = load_from_json(os.path.join(path2data, 'FloatConfiguration_default.json'))
@@ -347,7 +387,7 @@ class FloatConfiguration:
             wmo = name[0]
             cyc = name[1]
             name = "Float %i - Cycle %i" % (wmo, cyc)
-            df = get_float_config(wmo, cyc)
+            df = get_float_config(wmo, cyc, data=kwargs['data'] if 'data' in kwargs else None)
 
             di = {'CONFIG_ProfilePressure_dbar': 'profile_depth',
                   'CONFIG_ParkPressure_dbar': 'parking_depth',
@@ -372,6 +412,83 @@ class FloatConfiguration:
 
         self.name = name
 
+    @staticmethod
+    def from_wmos(floats: Iterable, **kwargs) -> List['FloatConfiguration']:
+        """Create configurations of many real floats, with a single batch of Euro-Argo API requests
+
+        Float meta-data are downloaded concurrently and cached on disk with :meth:`fetch_float_meta`, so that each
+        float is only requested once, whatever its number of cycles.
+
+        Parameters
+        ----------
+        floats: iterable
+            Float WMO numbers, to get the configuration of their last cycle, or [wmo, cycle number] pairs
+        **kwargs:
+            Arguments passed on to :meth:`fetch_float_meta`: ``api``, ``cache``, ``ttl`` and ``workers``
+
+        Returns
+        -------
+        list of :class:`FloatConfiguration`, one per item of ``floats``
+
+        Examples
+        --------
+        >>> cfgs = FloatConfiguration.from_wmos([6902919, 6902920])  # Last cycle of each float
+        >>> cfgs = FloatConfiguration.from_wmos([[6902919, 132], [6902919, 133]])
+        >>> mission = MissionTable.from_any(cfgs)
+        """
+        floats = [[int(f[0]), int(f[1])] if isinstance(f, (list, tuple, np.ndarray)) else [int(f), None]
+                  for f in floats]
+        data = fetch_float_meta([wmo for wmo, _ in floats], **kwargs)
+        configs = []
+        for wmo, cyc in floats:
+            if cyc is None:
+                cycles = [int(c) for cycles in data[wmo]['configurations']['missionCycles'].values() for c in cycles]
+                if len(cycles) == 0:
+                    raise ValueError("No cycle with a configuration for float %i" % wmo)
+                cyc = max(cycles)
+            configs.append(FloatConfiguration([wmo, cyc], data=data[wmo]))
+        return configs
+
+    @staticmethod
+    def load_many(paths: Iterable[Union[str, Path]], validate: bool = True) -> 'MissionTable':
+        """Load float configurations from many json files into a :class:`MissionTable`
+
+        Each file is read once and validated with a json schema validator compiled once for all files. Parameter
+        values are cast to their dtype and gathered into one array per parameter, without creating a
+        :class:`FloatConfiguration` for each file.
+
+        Parameters
+        ----------
+        paths: iterable of str or :class:`pathlib.Path`
+            Paths to float configuration json files, in format version 1.0 or 2.0
+        validate: bool, default=True
+            Validate files against the configuration json schema. This is most of the loading time, and can be
+            skipped for trusted files.
+
+        Returns
+        -------
+        :class:`MissionTable`
+            With one row per file, in order, and the parameters defined in all files
+
+        Examples
+        --------
+        >>> mission = FloatConfiguration.load_many(sorted(glob.glob("configs/*.json")))
+        >>> VFleet = VirtualFleet(plan=my_plan, fieldset=VELfield, mission=mission)
+        """
+        columns, nfiles = {}, 0
+        for ifile, path in enumerate(paths):
+            _, params = read_configuration(path, validate=validate)
+            for param in params:
+                value = param['dtype'](param['value']) if param['dtype'] != '' else param['value']
+                if param['key'] in columns or ifile == 0:
+                    columns.setdefault(param['key'], []).append(value)
+            # Only keep parameters defined in all files:
+            columns = {key: values for key, values in columns.items() if len(values) == ifile + 1}
+            nfiles = ifile + 1
+        if nfiles == 0:
+            raise ValueError("No configuration file to load")
+        return MissionTable({key: np.array(values) for key, values in columns.items()})
+
     def __repr__(self):
         summary = ["<FloatConfiguration><%s>" % self.name]
         for p in self._params_dict.keys():
@@ -438,38 +555,429 @@ class FloatConfiguration:
         return self.json_schema.to_json(*args, **kwargs)
 
 
-class SimulationSet:
-    """Convenient class to manage a collection of simulations meta-data
+class MissionTable:
+    """Columnar float mission parameters manager
+
+    Store the mission parameters of a fleet of floats as a struct-of-arrays, with one typed :class:`numpy.ndarray`
+    per mission parameter. This is used by :class:`VirtualFleet` instances to hold the mission of each float of the
+    deployment plan.
+
+    Examples
+    --------
+    >>> mt = MissionTable.from_any(FloatConfiguration('default'))  # One mission
+    >>> mt = MissionTable.from_any([cfg.mission for cfg in cfgs])  # From a list of dictionaries
+    >>> mt = MissionTable.from_any(pd.DataFrame({'parking_depth': [500, 1000], ...}))  # From a DataFrame
+    >>> mt = mt.broadcast(100)  # One mission for 100 floats, without copy
+    >>> mt['parking_depth']  # Array of parking depths
+    >>> mt[0]  # Mission of the 1st float, as a dictionary
+    >>> mt.to_dataframe()
+    """
+
+    required: List = ['parking_depth', 'profile_depth', 'cycle_duration', 'vertical_speed', 'life_expectancy']
+    """Mission parameters required by the :class:`VirtualFleet` float kernels"""
+
+    def __init__(self, data: Dict[str, np.ndarray], validate: bool = True):
+        """
+
+        Parameters
+        ----------
+        data: dict
+            Dictionary with mission parameter names as keys and 1D arrays of values as values. All arrays must have
+            the same length.
+        validate: bool, default: True
+            Validate mission parameter values
+        """
+        self._data = {key: np.asarray(data[key]) for key in data}
+        sizes = np.unique([self._data[key].size for key in self._data])
+        if len(sizes) > 1:
+            raise ValueError("All mission parameters must have the same number of values")
+        if validate:
+            self.validate()
+
+    @staticmethod
+    def from_records(records: Iterable[Union[Dict, 'FloatConfiguration']]) -> 'MissionTable':
+        """Create a table from an iterable of mission dictionaries or :class:`FloatConfiguration` instances
+
+        Only mission parameters defined for all records are kept.
+        """
+        records = [r.mission if isinstance(r, FloatConfiguration) else r for r in records]
+        for r in records:
+            if not isinstance(r, dict):
+                raise TypeError("The `mission` argument must be a dictionary or a `FloatConfiguration` instance")
+        if len(records) == 0:
+            raise ValueError("The `mission` argument must not be empty")
+        keys = [key for key in records[0] if all(key in r for r in records[1:])]
+        return MissionTable({key: np.array([r[key] for r in records]) for key in keys})
+
+    @staticmethod
+    def from_dataframe(df: pd.DataFrame) -> 'MissionTable':
+        """Create a table from a :class:`pandas.DataFrame` with one row per float and one column per parameter"""
+        return MissionTable({key: df[key].to_numpy() for key in df.columns})
+
+    @staticmethod
+    def from_any(mission) -> 'MissionTable':
+        """Create a table from a dictionary, a :class:`FloatConfiguration`, a :class:`pandas.DataFrame` or an
+        iterable of dictionaries or :class:`FloatConfiguration`"""
+        if isinstance(mission, MissionTable):
+            return mission
+        elif isinstance(mission, pd.DataFrame):
+            return MissionTable.from_dataframe(mission)
+        elif isinstance(mission, (dict, FloatConfiguration)):
+            return MissionTable.from_records([mission])
+        elif isinstance(mission, (list, tuple, np.ndarray)):
+            return MissionTable.from_records(mission)
+        else:
+            raise TypeError("The `mission` argument must be a dictionary or a `FloatConfiguration` instance")
+
+    def __repr__(self):
+        summary = ["<MissionTable>"]
+        summary.append("- %i float mission(s)" % len(self))
+        for key in self.keys():
+            values = self._data[key]
+            if not np.issubdtype(values.dtype, np.number) or len(values) == 0:
+                summary.append("- %s: %s" % (key, values[:1]))
+                continue
+            vmin, vmax = np.min(values), np.max(values)
+            if vmin == vmax:
+                summary.append("- %s: %s" % (key, vmin))
+            else:
+                summary.append("- %s: [%s - %s]" % (key, vmin, vmax))
+        return "\n".join(summary)
+
+    def __len__(self):
+        return 0 if len(self._data) == 0 else next(iter(self._data.values())).size
+
+    def __getitem__(self, item):
+        """Return the array of values for a parameter name, or the mission dictionary of a float for an integer"""
+        if isinstance(item, str):
+            return self._data[item]
+        else:
+            return {key: self._data[key][item].item() for key in self._data}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        """List of mission parameter names"""
+        return list(self._data.keys())
+
+    def validate(self):
+        """Check that required parameters are present and that their values are within valid ranges"""
+        for key in self.required:
+            if key not in self._data:
+                raise ValueError("The 'mission' argument must have a '%s' key" % key)
+
+        if np.any((self['parking_depth'] < 0) | (self['parking_depth'] > 6000)):
+            raise ValueError('Parking depth must be in [0-6000] db')
+
+        if np.any((self['profile_depth'] < 0) | (self['profile_depth'] > 6000)):
+            raise ValueError('Profile depth must be in [0-6000] db')
+
+        if np.any(self['cycle_duration'] < 0):
+            raise ValueError('Cycle duration must be positive')
+
+        if np.any(self['vertical_speed'] < 0):
+            raise ValueError('Vertical speed must be positive')
+        if np.any(self['vertical_speed'] > 1):
+            warnings.warn("%f m/s is pretty fast for an Argo float ! Typical speed is 0.09 m/s"
+                          % np.max(self['vertical_speed']))
+        return self
+
+    def broadcast(self, N: int) -> 'MissionTable':
+        """Return a table with a single mission repeated for N floats, without copying data"""
+        if len(self) != 1:
+            raise ValueError("Only a table with a single mission can be broadcast")
+        return MissionTable({key: np.broadcast_to(self._data[key], (N,)) for key in self._data}, validate=False)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return mission parameters as a :class:`pandas.DataFrame`, with one row per float"""
+        return pd.DataFrame({key: np.asarray(self._data[key]) for key in self._data})
 
-    This class is used by VirtualFleet instances to keep track of all calls to the 'simulate' method.
 
-    In the future, this could be used to computed aggregated statistics from several simulations.
+def _default_meta() -> Dict[str, dict]:
+    """Return the meta-data of the parameters of the default float configuration, read once"""
+    if len(_DEFAULT_META) == 0:
+        for key, param in FloatConfiguration('default')._params_dict.items():
+            _DEFAULT_META[key] = {**param.meta, 'dtype': dtype_name(param.meta['dtype'])}
+    return _DEFAULT_META
+
+
+class MissionCatalogue:
+    """Catalogue of float missions, stored in a single Parquet or NetCDF file
+
+    A catalogue holds one mission per row, keyed by float WMO or by deployment plan index, in a :class:`MissionTable`.
+    The meta-data of each parameter (description, unit, dtype and Argo technical key, see :class:`ConfigParam`) are
+    stored once in the file header. A catalogue, or the path to a catalogue file, can be passed on to a
+    :class:`VirtualFleet` as ``mission``: rows are then selected with the ``wmo`` key of the deployment plan if the
+    catalogue is keyed by WMO, or in the deployment plan order otherwise.
+
+    Examples
+    --------
+    >>> cat = MissionCatalogue(MissionTable.from_any(cfgs), keys=wmos, key_name='wmo')
+    >>> cat = MissionCatalogue.from_configurations(FloatConfiguration.from_wmos(wmos), keys=wmos, key_name='wmo')
+    >>> cat.to_file('missions.parquet')  # or 'missions.nc'
+    >>> cat = MissionCatalogue.read('missions.parquet')
+    >>> cat.select([6902919, 6902920])  # MissionTable of two floats
+    >>> VFleet = VirtualFleet(plan={**my_plan, 'wmo': wmos}, fieldset=VELfield, mission='missions.parquet')
+    """
+
+    version: str = "1.0"
+    """Version of the catalogue file format"""
+
+    key_names: List = ['wmo', 'index']
+    """Possible catalogue keys: float WMO or deployment plan index"""
+
+    def __init__(self, table: MissionTable, keys=None, key_name: str = 'index', meta: Dict[str, dict] = None):
+        """
+
+        Parameters
+        ----------
+        table: :class:`MissionTable`
+            Missions, one row per float
+        keys: array-like, optional
+            Integer key of each row. By default, the row number.
+        key_name: str, default='index'
+            Name of the key: ``wmo`` or ``index`` for deployment plan indices
+        meta: dict, optional
+            Meta-data of each parameter, a dictionary with ``description``, ``unit``, ``dtype`` and ``techkey`` keys.
+            By default, meta-data of parameters of the default :class:`FloatConfiguration` are used.
+        """
+        if key_name not in self.key_names:
+            raise ValueError("'key_name' must be one of %s" % self.key_names)
+        if len(table) == 1 and keys is not None and len(keys) > 1:
+            table = table.broadcast(len(keys))
+        self.table = table
+        self.keys = np.arange(len(table)) if keys is None else np.asarray(keys).astype(np.int64)
+        if self.keys.shape != (len(table),):
+            raise ValueError("There must be one key per mission")
+        if len(np.unique(self.keys)) != len(self.keys):
+            raise ValueError("Catalogue keys must be unique")
+        self.key_name = key_name
+
+        default = _default_meta()
+        self.meta = {}
+        for key in table.keys():
+            param_meta = meta[key] if meta is not None and key in meta else default.get(key, {})
+            param_meta = {**{'description': '', 'unit': '', 'dtype': '', 'techkey': ''}, **param_meta}
+            param_meta['dtype'] = dtype_name(param_meta['dtype'])
+            self.meta[key] = {k: param_meta[k] for k in ['description', 'unit', 'dtype', 'techkey']}
+
+    def __repr__(self):
+        summary = ["<MissionCatalogue>"]
+        summary.append("- %i float mission(s), keyed by %s" % (len(self), self.key_name))
+        summary.append("\n".join(repr(self.table).split("\n")[2:]))
+        return "\n".join(summary)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def from_configurations(configurations: Iterable['FloatConfiguration'], keys=None, key_name: str = 'index'
+                            ) -> 'MissionCatalogue':
+        """Create a catalogue from a list of :class:`FloatConfiguration`, with meta-data of the first one"""
+        configurations = list(configurations)
+        meta = {key: param.meta for key, param in configurations[0]._params_dict.items()}
+        return MissionCatalogue(MissionTable.from_records(configurations), keys=keys, key_name=key_name, meta=meta)
+
+    def _header(self) -> dict:
+        return {'version': self.version, 'key': self.key_name, 'parameters': self.meta}
+
+    def to_parquet(self, path):
+        """Save the catalogue to a Parquet file, with parameter meta-data in the file schema meta-data
+
+        Requires pyarrow.
+        """
+        if not has_pyarrow:
+            raise ModuleNotFoundError("pyarrow is required to export to parquet")
+        columns = {self.key_name: pa.array(self.keys)}
+        for key in self.table.keys():
+            columns[key] = pa.array(np.asarray(self.table[key]))
+        table = pa.table(columns).replace_schema_metadata({'virtualfleet': json.dumps(self._header())})
+        pq.write_table(table, path)
+        return self
+
+    def to_netcdf(self, path):
+        """Save the catalogue to a NetCDF file, with parameter meta-data as variable attributes"""
+        ds = xr.Dataset(coords={self.key_name: self.keys})
+        for key in self.table.keys():
+            meta = self.meta[key]
+            ds[key] = xr.DataArray(np.asarray(self.table[key]), dims=self.key_name,
+                                   attrs={'long_name': meta['description'], 'units': meta['unit'],
+                                          'dtype': meta['dtype'], 'techkey': meta['techkey']})
+        ds.attrs = {'virtualfleet_catalogue_version': self.version, 'virtualfleet_catalogue_key': self.key_name}
+        ds.to_netcdf(path)
+        return self
+
+    def to_file(self, path):
+        """Save the catalogue to a Parquet (``.parquet``) or NetCDF (``.nc``) file"""
+        ext = os.path.splitext(str(path))[-1]
+        if ext == '.parquet':
+            return self.to_parquet(path)
+        elif ext == '.nc':
+            return self.to_netcdf(path)
+        raise ValueError("Unsupported catalogue file extension '%s', must be '.parquet' or '.nc'" % ext)
+
+    @staticmethod
+    def read(path, validate: bool = True) -> 'MissionCatalogue':
+        """Read a catalogue from a Parquet or NetCDF file
+
+        All columns are read at once, cast to the dtype of their meta-data, and mission values are validated with the
+        vectorized range checks of :meth:`MissionTable.validate`.
+        """
+        ext = os.path.splitext(str(path))[-1]
+        if ext == '.parquet':
+            if not has_pyarrow:
+                raise ModuleNotFoundError("pyarrow is required to read parquet files")
+            table = pq.read_table(path)
+            if table.schema.metadata is None or b'virtualfleet' not in table.schema.metadata:
+                raise ValueError("%s is not a VirtualFleet mission catalogue" % path)
+            header = json.loads(table.schema.metadata[b'virtualfleet'])
+            columns = {name: table.column(name).to_numpy() for name in table.column_names}
+        elif ext == '.nc':
+            # Do not decode parameters with time units (e.g. 'cycle_duration' in hours) as timedelta:
+            with xr.open_dataset(path, decode_times=False, decode_timedelta=False) as ds:
+                if 'virtualfleet_catalogue_key' not in ds.attrs:
+                    raise ValueError("%s is not a VirtualFleet mission catalogue" % path)
+                header = {'version': ds.attrs['virtualfleet_catalogue_version'],
+                          'key': ds.attrs['virtualfleet_catalogue_key'],
+                          'parameters': {key: {'description': ds[key].attrs.get('long_name', ''),
+                                               'unit': ds[key].attrs.get('units', ''),
+                                               'dtype': ds[key].attrs.get('dtype', ''),
+                                               'techkey': ds[key].attrs.get('techkey', '')} for key in ds.data_vars}}
+                columns = {header['key']: ds[header['key']].values,
+                           **{key: ds[key].values for key in ds.data_vars}}
+        else:
+            raise ValueError("Unsupported catalogue file extension '%s', must be '.parquet' or '.nc'" % ext)
+        if header['version'] != MissionCatalogue.version:
+            raise ValueError("Unsupported catalogue format version '%s'" % header['version'])
+
+        keys = columns.pop(header['key'])
+        data = {}
+        for key in columns:
+            dtype = parse_dtype(header['parameters'][key]['dtype']) if key in header['parameters'] else ''
+            data[key] = columns[key].astype(dtype) if dtype != '' else columns[key]
+        return MissionCatalogue(MissionTable(data, validate=validate), keys=keys, key_name=header['key'],
+                                meta=header['parameters'])
+
+    def select(self, keys) -> MissionTable:
+        """Return the missions of a list of keys, in this order, as a :class:`MissionTable`"""
+        keys = np.asarray(keys).astype(np.int64)
+        order = np.argsort(self.keys)
+        pos = np.searchsorted(self.keys, keys, sorter=order)
+        pos = np.clip(pos, 0, len(order) - 1)
+        found = self.keys[order[pos]] == keys
+        if not np.all(found):
+            raise ValueError("%i key(s) not in the mission catalogue, e.g. %s=%s"
+                             % (np.sum(~found), self.key_name, keys[~found][:5]))
+        rows = order[pos]
+        return MissionTable({key: np.asarray(self.table[key])[rows] for key in self.table.keys()}, validate=False)
+
+    def for_plan(self, plan: dict) -> MissionTable:
+        """Return the missions of the floats of a deployment plan
+
+        With a catalogue keyed by WMO, the deployment plan must have a ``wmo`` key. Otherwise, missions are selected by
+        deployment plan index.
+        """
+        if self.key_name == 'wmo':
+            if 'wmo' not in plan:
+                raise ValueError("This mission catalogue is keyed by WMO, the 'plan' argument must have a 'wmo' key")
+            return self.select(plan['wmo'])
+        return self.select(np.arange(len(plan['lat'])))
+
+
+class SimulationSet:
+    """Registry of simulations meta-data and performance records
+
+    This class is used by VirtualFleet instances to keep track of all calls to the 'simulate' method. The meta-data of
+    each simulation are kept as a dictionary in :attr:`runs`, and summarised as a flat performance record: number of
+    floats, throughput in particle-steps per second, wall and CPU time, peak memory, output size, host, parcels and
+    VirtualFleet versions. The peak memory of a simulation (``memory_hwm``) is the peak resident set size sampled
+    while it runs, if resources are monitored (see :class:`ResourceSampler`), and None otherwise. The memory
+    high-water mark of the whole process lifetime is recorded as ``process_memory_hwm``, but since it does not depend
+    on a single simulation, it is not one of the performance :attr:`metrics`. Records are available as a
+    :class:`pandas.DataFrame` with :meth:`to_dataframe`, and can be saved to and loaded from a JSON-lines file, to
+    track performance across code and data versions.
 
     Examples
     --------
     >>> s = SimulationSet()
-    >>> s.add({'execution_time': 1.8, 'platform': 'Darwin', 'output_path': 'trajectories_part1.zarr'})
-    >>> s.add({'execution_time': 2.4, 'platform': 'Darwin', 'output_path': 'trajectories_part2.zarr'})
+    >>> s.add({'N': 100, 'duration': timedelta(days=10), 'step': timedelta(minutes=5), 'execution_wall_time': 1.8})
     >>> s.N
     >>> s.last
+    >>> s.to_jsonl('runs.jsonl')  # Append records to a registry file
+    >>> registry = SimulationSet.from_jsonl('runs.jsonl')
+    >>> registry.stats(by='host')
+    >>> registry.compare(by='virtualfleet_version', baseline='0.5.1')
     """
 
+    columns = ['execution_date', 'label', 'host', 'platform', 'parcels_version', 'virtualfleet_version',
+               'N', 'duration', 'step', 'record', 'sampling', 'particle_steps', 'wall_time', 'cpu_time', 'throughput',
+               'memory_hwm', 'process_memory_hwm', 'output_size', 'output_path']
+    """Columns of the performance records, durations and times in seconds, sizes in bytes"""
+
+    metrics = ['wall_time', 'cpu_time', 'throughput', 'memory_hwm', 'output_size']
+    """Performance metrics of the records"""
+
     def __init__(self):
         self.simulated = False
         self.runs = []
+        self.records = []
 
     def __repr__(self):
         summary = ["<VirtualFleet.SimulationSet>"]
         summary.append("Executed: %s" % self.simulated)
         summary.append("Number of simulation(s): %i" % self.N)
+        if self.N > 0 and self.records[-1]['throughput'] is not None:
+            summary.append("Last throughput: %0.0f particle-steps/s" % self.records[-1]['throughput'])
         return "\n".join(summary)
 
     def add(self, params):
         """Add a new set of parameters to the simulation set"""
         self.simulated = True
         self.runs.append(params)
+        self.records.append(self._record(params))
         return self
 
+    @staticmethod
+    def _record(params: dict) -> dict:
+        """Return the performance record of a simulation meta-data dictionary"""
+        def seconds(td):
+            if td is None:
+                return None
+            return pd.Timedelta(td).total_seconds() if not isinstance(td, (int, float)) else float(td)
+
+        system = params['execution_system'] if params.get('execution_system', None) is not None else {}
+        record = {'execution_date': params.get('execution_date', None),
+                  'label': params.get('label', None),
+                  'host': system.get('hostname', None),
+                  'platform': system.get('platform', None),
+                  'parcels_version': params.get('parcels_version', parcels.__version__),
+                  'virtualfleet_version': params.get('virtualfleet_version', virtualfleet_version()),
+                  'N': int(params['N']) if params.get('N', None) is not None else None,
+                  'duration': seconds(params.get('duration', None)),
+                  'step': seconds(params.get('step', None)),
+                  'record': seconds(params.get('record', None)),
+                  'sampling': params.get('sampling', None),
+                  'wall_time': seconds(params.get('execution_wall_time', None)),
+                  'cpu_time': seconds(params.get('execution_cpu_time', None)),
+                  'memory_hwm': params.get('memory_hwm', None),
+                  'process_memory_hwm': params.get('process_memory_hwm', None),
+                  'output_path': params.get('output_path', None),
+                  }
+        if record['execution_date'] is not None:
+            record['execution_date'] = pd.to_datetime(record['execution_date'], format="%Y%m%d-%H%M%S").isoformat()
+        record['particle_steps'], record['throughput'] = None, None
+        if record['N'] is not None and record['duration'] is not None and record['step']:
+            record['particle_steps'] = int(record['N'] * np.ceil(record['duration'] / record['step']))
+            if record['wall_time']:
+                record['throughput'] = record['particle_steps'] / record['wall_time']
+        record['output_size'] = get_output_size(record['output_path'])
+        return {key: record[key] for key in SimulationSet.columns}
+
     @property
     def N(self):
         """Return the number of simulations in the set"""
@@ -480,6 +988,257 @@ class SimulationSet:
         """Return meta-data from the last simulation in the set"""
         return self.runs[-1]
 
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return performance records of all simulations as a :class:`pandas.DataFrame`, one row per simulation"""
+        df = pd.DataFrame(self.records, columns=self.columns)
+        df['execution_date'] = pd.to_datetime(df['execution_date'])
+        return df
+
+    def to_jsonl(self, path: str, append: bool = True):
+        """Save performance records to a JSON-lines file, one simulation per line
+
+        Parameters
+        ----------
+        path: str
+            Path to the JSON-lines registry file
+        append: bool, default=True
+            Append records to an existing file, or overwrite it
+        """
+        with open(path, 'a' if append else 'w') as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=str) + "\n")
+        return self
+
+    @classmethod
+    def from_jsonl(cls, path: str):
+        """Load performance records from a JSON-lines file written by :meth:`to_jsonl`
+
+        Each record is also used as the run meta-data, since simulation options are not saved in the registry file.
+        """
+        registry = cls()
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    registry.simulated = True
+                    registry.runs.append(record)
+                    registry.records.append({key: record.get(key, None) for key in cls.columns})
+        return registry
+
+    def stats(self, by: Union[str, tuple] = ('host', 'parcels_version', 'virtualfleet_version'),
+              metrics: list = None) -> pd.DataFrame:
+        """Aggregated statistics of performance metrics, for groups of simulations
+
+        Parameters
+        ----------
+        by: str or tuple, default=('host', 'parcels_version', 'virtualfleet_version')
+            Columns to group simulations by
+        metrics: list, optional
+            Performance metrics to aggregate, by default all of :attr:`metrics`
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            With count, mean, std, min and max of each metric
+        """
+        metrics = self.metrics if metrics is None else metrics
+        df = self.to_dataframe()
+        by = by if isinstance(by, str) else list(by)
+        return df.groupby(by, dropna=False)[list(metrics)].agg(['count', 'mean', 'std', 'min', 'max'])
+
+    def compare(self, other=None, by: str = 'virtualfleet_version', baseline=None,
+                on: tuple = ('N', 'duration', 'step'), metrics: tuple = ('throughput', 'wall_time', 'memory_hwm')
+                ) -> pd.DataFrame:
+        """Compare performance metrics of simulations of the same experiment, between groups of simulations
+
+        Simulations are matched by experiment size (the ``on`` columns), and the median of each metric is computed for
+        each value of the ``by`` column. Ratios to the ``baseline`` group are added for each metric. Simulations without
+        a value in the ``by`` column, e.g. without ``label``, are grouped as ``'None'``.
+
+        Parameters
+        ----------
+        other: :class:`SimulationSet`, optional
+            Another simulation set to compare this one to. Simulations are then grouped by their set, named ``self``
+            and ``other``, and ``other`` is the baseline.
+        by: str, default='virtualfleet_version'
+            Column to compare simulations by, e.g. ``label``, ``host`` or ``parcels_version``
+        baseline: optional
+            Value of the ``by`` column for the reference group. By default, the first value in the registry.
+        on: tuple, default=('N', 'duration', 'step')
+            Columns defining an experiment
+        metrics: tuple, default=('throughput', 'wall_time', 'memory_hwm')
+            Performance metrics to compare. Metrics without any value are ignored.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Indexed by experiment, with (metric, group) columns for the median of each metric, and (metric_ratio, group)
+            columns for the ratio to the baseline group.
+        """
+        df = self.to_dataframe()
+        if other is not None:
+            df = pd.concat([df.assign(set='self'), other.to_dataframe().assign(set='other')], ignore_index=True)
+            by, baseline = 'set', 'other'
+        df[by] = df[by].astype(object).where(df[by].notna(), 'None')  # pivot_table drops missing groups
+        on = list(on)
+        metrics = [metric for metric in metrics if df[metric].notna().any()]  # e.g. memory_hwm without monitoring
+        groups = list(pd.unique(df[by]))
+        baseline = groups[0] if baseline is None else baseline
+        if baseline not in groups:
+            raise ValueError("'%s' is not a value of the '%s' column: %s" % (baseline, by, groups))
+
+        table = df.pivot_table(index=on, columns=by, values=metrics, aggfunc='median')
+        for metric in metrics:
+            for group in groups:
+                if group != baseline and (metric, group) in table.columns:
+                    table[("%s_ratio" % metric, group)] = table[(metric, group)] / table[(metric, baseline)]
+        return table
+
+
+def virtualfleet_version() -> str:
+    """Return the version of VirtualFleet"""
+    from . import __version__
+    return __version__
+
+
+def get_memory_hwm() -> int:
+    """Return the memory high-water mark (peak resident set size) of the current process, in bytes
+
+    This is the peak over the lifetime of the process, not over a single simulation.
+    """
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(maxrss) if platform.system() == 'Darwin' else int(maxrss) * 1024  # Bytes on macOS, kB on Linux
+    except ImportError:
+        return int(psutil.Process().memory_info().peak_wset)  # Windows
+
+
+class ResourceSampler:
+    """Sample resources used by the current process in a background thread
+
+    At a fixed interval, the sampler records the resident set size (RSS), CPU utilization, number of open file
+    handles and cumulative I/O bytes read and written by the process. I/O counters are not available on all
+    platforms, in which case they are not recorded.
+
+    Examples
+    --------
+    >>> with ResourceSampler(interval=1.) as sampler:
+    >>>     VFleet.simulate(duration=timedelta(days=10))
+    >>> sampler.peaks
+    >>> sampler.to_dataframe()
+    """
+
+    columns = ['time', 'rss', 'cpu_percent', 'open_files', 'read_bytes', 'write_bytes']
+    """Recorded resources: elapsed time in seconds, sizes in bytes"""
+
+    def __init__(self, interval: float = 1.):
+        """
+
+        Parameters
+        ----------
+        interval: float, default=1.
+            Sampling interval in seconds
+        """
+        if interval <= 0:
+            raise ValueError("'interval' must be strictly positive, got %s" % interval)
+        self.interval = float(interval)
+        self.process = psutil.Process()
+        self.samples = {key: [] for key in self.columns}
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def __repr__(self):
+        summary = ["<VirtualFleet.ResourceSampler>"]
+        summary.append("- %i samples every %0.1fs" % (len(self.samples['time']), self.interval))
+        if len(self.samples['time']) > 0:
+            peaks = self.peaks
+            summary.append("- Peak RSS: %0.1f MB" % (peaks['rss'] / 1024 ** 2))
+            summary.append("- Peak CPU: %0.0f%%" % peaks['cpu_percent'])
+        return "\n".join(summary)
+
+    def _open_files(self) -> int:
+        return self.process.num_fds() if hasattr(self.process, 'num_fds') else self.process.num_handles()
+
+    def _io(self) -> tuple:
+        if not hasattr(self.process, 'io_counters'):
+            return None, None
+        try:
+            io = self.process.io_counters()
+            return io.read_bytes, io.write_bytes
+        except (psutil.AccessDenied, NotImplementedError):
+            return None, None
+
+    def sample(self):
+        """Record the current resources used by the process"""
+        with self.process.oneshot():
+            self.samples['time'].append(time.perf_counter() - self._start)
+            self.samples['rss'].append(self.process.memory_info().rss)
+            self.samples['cpu_percent'].append(self.process.cpu_percent())
+            self.samples['open_files'].append(self._open_files())
+            read_bytes, write_bytes = self._io()
+            self.samples['read_bytes'].append(read_bytes)
+            self.samples['write_bytes'].append(write_bytes)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        self._start = time.perf_counter()
+        self.process.cpu_percent()  # The first call always returns 0
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name='virtualfleet-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling, with a last sample"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sample()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    @property
+    def peaks(self) -> dict:
+        """Peak values of the resources, and total I/O bytes over the sampling period"""
+        peaks = {key: max(self.samples[key]) for key in ['rss', 'cpu_percent', 'open_files']}
+        for key in ['read_bytes', 'write_bytes']:
+            values = [v for v in self.samples[key] if v is not None]
+            peaks[key] = values[-1] - values[0] if len(values) > 0 else None
+        return peaks
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return samples as a :class:`pandas.DataFrame` indexed by elapsed time"""
+        return pd.DataFrame(self.samples, columns=self.columns).set_index('time')
+
+    def to_dict(self) -> dict:
+        """Return the sampling interval, peak values and samples as a dictionary serialisable in json"""
+        return {'interval': self.interval, 'peaks': self.peaks,
+                'samples': {key: list(self.samples[key]) for key in self.columns}}
+
+
+def get_output_size(path: str) -> int:
+    """Return the size in bytes of a simulation output, a zarr store folder or a file, None if it does not exist"""
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return int(np.sum([os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files]))
+
 
 def get_splitdates(t, N = 1):
     """Given a list of dates, return index of dates before a date change larger than N days"""
@@ -495,7 +1254,129 @@ def splitonprofiles(ds, N = 1):
     return sub_grp
 
 
-def simu2index(ds: xr.Dataset, N: int = 1):
+def get_trajdim(ds: xr.Dataset) -> str:
+    """Return the name of the trajectory dimension of a simulation dataset"""
+    return 'trajectory' if version.parse(ds.attrs['parcels_version']) >= version.parse("2.4.0") else 'traj'
+
+
+def _profiles_from_arrays(traj: np.ndarray,
+                          time: np.ndarray,
+                          lat: np.ndarray,
+                          lon: np.ndarray,
+                          cycle_phase: np.ndarray,
+                          cycle_number: np.ndarray = None,
+                          wmo: np.ndarray = None,
+                          N: int = 1) -> pd.DataFrame:
+    """Columnar profile extraction from ``trajectory x obs`` arrays
+
+    All 2D arrays are flattened in C order, so that observations are sorted by trajectory and then by obs. The last
+    observation of each (trajectory, cycle_number) sequence is found by comparing every valid observation with the
+    next one, instead of grouping each trajectory one by one.
+
+    Parameters
+    ----------
+    traj: :class:`numpy.ndarray`
+        1D array with trajectory IDs
+    time, lat, lon, cycle_phase: :class:`numpy.ndarray`
+        2D arrays of shape ``(trajectory, obs)``
+    cycle_number: :class:`numpy.ndarray`, optional
+        2D array of shape ``(trajectory, obs)``. If not provided, we fall back on the old trajectory file algorithm.
+    wmo: :class:`numpy.ndarray`, optional
+        1D array with one WMO per trajectory, or 2D array of shape ``(trajectory, obs)``
+    N: int, optional
+        The minimal time lag (in days) between cycle_phase sequences of old trajectory files
+
+    Returns
+    -------
+    df: :class:`pandas.DataFrame`
+        The profiles index, possibly empty
+    """
+    ntraj, nobs = cycle_phase.shape
+    itraj = np.repeat(np.arange(ntraj), nobs)
+    phase = cycle_phase.ravel()
+
+    if cycle_number is not None:
+        cyc = cycle_number.ravel()
+        ii = np.flatnonzero(~np.isnan(cyc))  # Drop fill values (particles not released yet or deleted)
+        # An observation is the last of its cycle if the next valid observation has another trajectory or cycle:
+        last = np.ones(ii.shape, dtype=bool)
+        last[:-1] = (itraj[ii[:-1]] != itraj[ii[1:]]) | (cyc[ii[:-1]] != cyc[ii[1:]])
+        ii = ii[last]
+        ii = ii[np.isin(phase[ii], [3, 4])]
+        cyc = cyc[ii]
+    else:
+        ii = np.flatnonzero(phase == 3)
+        # A profile is the last observation of a phase 3 sequence separated by more than N days from the next one:
+        dt = np.diff(time.ravel()[ii]).astype('timedelta64[D]')
+        split = (itraj[ii[:-1]] == itraj[ii[1:]]) & (dt > np.timedelta64(N, 'D'))
+        ii = ii[:-1][split]
+        # Cycle numbers are counted from 1 for each trajectory:
+        first = np.ones(ii.shape, dtype=bool)
+        first[1:] = itraj[ii[1:]] != itraj[ii[:-1]]
+        rank = np.arange(len(ii))
+        cyc = rank - np.maximum.accumulate(np.where(first, rank, 0)) + 1
+
+    itraj = itraj[ii]
+    traj_id = np.asarray(traj)[itraj]
+    if wmo is None:
+        wmo = traj_id + 9000000
+    else:
+        wmo = np.asarray(wmo)
+        wmo = wmo[itraj] if wmo.ndim == 1 else wmo.ravel()[ii]
+
+    df = pd.DataFrame({
+        'date': time.ravel()[ii],
+        'latitude': np.fix(lat.ravel()[ii] * 1000).astype('int') / 1000,
+        'longitude': np.fix(lon.ravel()[ii] * 1000).astype('int') / 1000,
+        'wmo': wmo.astype('int'),
+        'cycle_number': cyc.astype('int'),
+        'traj_id': traj_id.astype('int'),
+    })
+    return df
+
+
+def _ds2profiles(ds: xr.Dataset, trajdim: str, N: int = 1) -> pd.DataFrame:
+    """Load the required variables of a trajectory dataset and extract its profiles, possibly none"""
+    def load(name):
+        return ds[name].transpose(trajdim, 'obs').values
+
+    return _profiles_from_arrays(
+        ds[trajdim].values,
+        load('time'), load('lat'), load('lon'), load('cycle_phase'),
+        cycle_number=load('cycle_number') if 'cycle_number' in ds.data_vars else None,
+        wmo=ds['wmo'].values if 'wmo' in ds.data_vars else None,
+        N=N)
+
+
+def simu2index_iter(ds: xr.Dataset, block_size: int = DEFAULT_INDEX_BLOCK_SIZE, N: int = 1):
+    """Iterate over the profile index of a trajectory simulation :class:`xarray.Dataset`, one block at a time
+
+    The trajectory dimension is read by blocks of ``block_size`` trajectories. Only one block of the ``trajectory x
+    obs`` arrays is loaded in memory at a time, so that the peak memory remains bounded by the block size whatever
+    the size of the trajectory store.
+
+    Parameters
+    ----------
+    ds: :class:`xarray.Dataset`
+        The simulation trajectories dataset, preferably lazily opened from a zarr store
+    block_size: int, optional
+        Number of trajectories to load at once
+    N: int, optional
+        The minimal time lag between cycle_phase sequences to be identified as a new profile (old trajectory files
+        only)
+
+    Returns
+    -------
+    Generator of :class:`pandas.DataFrame`
+        The profiles index of each block, possibly empty
+    """
+    trajdim = get_trajdim(ds)
+    ntraj = ds.sizes[trajdim]
+    for start in range(0, ntraj, block_size):
+        yield _ds2profiles(ds.isel({trajdim: slice(start, start + block_size)}), trajdim, N=N)
+
+
+def simu2index(ds: xr.Dataset, N: int = 1, block_size: int = DEFAULT_INDEX_BLOCK_SIZE, parallel: bool = None):
     """Convert a trajectory simulation :class:`xarray.Dataset` to an Argo index of profiles
 
     Profiles are identified using the ``cycle_number`` dataset variable. A profile is identified if the last
@@ -505,6 +1386,9 @@ def simu2index(ds: xr.Dataset, N: int = 1):
     variable. In this case, a profile is identified if the last observation of a cycle_phase==3 sequence is separated
     by N days from the next sequence.
 
+    Profiles are extracted with vectorized operations on the flattened ``trajectory x obs`` arrays, by blocks of
+    ``block_size`` trajectories (see :meth:`simu2index_iter`).
+
     Parameters
     ----------
     ds: :class:`xarray.Dataset`
@@ -512,125 +1396,162 @@ def simu2index(ds: xr.Dataset, N: int = 1):
     N: int, optional
         The minimal time lag between cycle_phase sequences to be identified as a new profile. This will be removed in
         the future when we'll drop support for old netcdf outputs.
+    block_size: int, optional
+        Number of trajectories to load at once
+    parallel: bool, optional
+        Process blocks in parallel with dask. By default, this is done if dask is installed and there is more than one
+        block. Peak memory is then bounded by the block size times the number of dask workers.
+
     Returns
     -------
     df: :class:`pandas.DataFrame`
         The profiles index
     """
-    trajdim = 'trajectory' if version.parse(ds.attrs['parcels_version']) >= version.parse("2.4.0") else 'traj'
+    trajdim = get_trajdim(ds)
+    if 'cycle_number' not in ds.data_vars:
+        warnings.warn("This is an old trajectory file, results not guaranteed !")
 
-    ds_list = []
-    if 'cycle_number' in ds.data_vars:
-        for traj in tqdm(ds[trajdim], total=len(ds[trajdim])):
-            for cyc, grp in ds.loc[{trajdim: traj}].groupby(group='cycle_number'):
-                ds_cyc = grp.isel(obs=-1)
-                if ds_cyc['cycle_phase'] in [3, 4]:
-                    ds_cyc['traj_id'] = xr.DataArray(np.full_like((1,), fill_value=traj.data))
-                    ds_list.append(ds_cyc)
+    if parallel is None:
+        parallel = has_dask and ds.sizes[trajdim] > block_size
+    if parallel and not has_dask:
+        raise ValueError("Parallel profile indexing requires dask")
 
+    if parallel:
+        ntraj = ds.sizes[trajdim]
+        blocks = [dask.delayed(_ds2profiles)(ds.isel({trajdim: slice(start, start + block_size)}), trajdim, N=N)
+                  for start in range(0, ntraj, block_size)]
+        df_list = dask.compute(*blocks)
     else:
-        warnings.warn("This is an old trajectory file, results not guaranteed !")
-        for traj in tqdm(ds[trajdim], total=len(ds[trajdim])):
-            for iphase, grp in ds.loc[{trajdim: traj}].groupby(group='cycle_phase'):
-                if iphase == 3:
-                    sub_grp = splitonprofiles(grp, N=N)
-                    sub_grp['cycle_number'] = xr.DataArray(np.arange(1, len(sub_grp['obs']) + 1), dims='obs')
-                    sub_grp['traj_id'] = xr.DataArray(np.full_like(sub_grp['obs'], fill_value=traj.data), dims='obs')
-                    ds_list.append(sub_grp)
-
-    if len(ds_list) > 0:
-        ds_profiles = xr.concat(ds_list, dim='obs')
-        if 'wmo' not in ds_profiles.data_vars:
-            ds_profiles['wmo'] = ds_profiles['traj_id'] + 9000000
-        df = ds_profiles.to_dataframe()
-        df = df.rename({'time': 'date', 'lat': 'latitude', 'lon': 'longitude', 'z': 'min_depth'}, axis='columns')
-        df = df[['date', 'latitude', 'longitude', 'wmo', 'cycle_number', 'traj_id']]
-        df['wmo'] = df['wmo'].astype('int')
-        df['cycle_number'] = df['cycle_number'].astype('int')
-        df['traj_id'] = df['traj_id'].astype('int')
-        df['latitude'] = np.fix(df['latitude'] * 1000).astype('int') / 1000
-        df['longitude'] = np.fix(df['longitude'] * 1000).astype('int') / 1000
-        df = df.reset_index(drop=True)
-        return df
+        df_list = list(simu2index_iter(ds, block_size=block_size, N=N))
+
+    df_list = [df for df in df_list if len(df) > 0]
+    if len(df_list) > 0:
+        return pd.concat(df_list, ignore_index=True)
     else:
         raise ValueError('No virtual floats reaches the final cycling phase, hence no profiles to index')
 
 
-def simu2index_par(ds):
-    def reducerA(sub_ds):
-        sub_grp = None
-        traj_id = np.unique(sub_ds['trajectory'])[0]
-        for iphase, grp in sub_ds.groupby(group='cycle_phase'):
-            if iphase == 3:
-                sub_grp = splitonprofiles(grp, N=1)
-                sub_grp['cycle_number'] = xr.DataArray(np.arange(1, len(sub_grp['obs']) + 1), dims='obs')
-                sub_grp['traj_id'] = xr.DataArray(
-                    np.full_like(sub_grp['obs'], fill_value=traj_id), dims='obs')
-                return sub_grp
-
-    def reducerB(sub_ds):
-        ds_list = []
-        traj_id = np.unique(sub_ds['trajectory'])[0]
-        for cyc, grp in sub_ds.groupby(group='cycle_number'):
-            ds_cyc = grp.isel(obs=-1)
-            if ds_cyc['cycle_phase'] in [3, 4]:
-                ds_cyc['traj_id'] = xr.DataArray(np.full_like((1,), fill_value=traj_id), dims='obs')
-                ds_list.append(ds_cyc)
-        try:
-            ds = xr.concat(ds_list, dim='obs')
-        except Exception:
-            log.debug("Error on concat with traj_id: %i" % traj_id)
-            ds = None
-            pass
-        return ds
-
-    reducer = reducerB if 'cycle_number' in ds.data_vars else reducerA
-
-    ConcurrentExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
-    with ConcurrentExecutor as executor:
-        future_to_url = {executor.submit(reducer, ds.sel(traj=traj)): ds.sel(traj=traj) for traj in ds['traj']}
-        futures = concurrent.futures.as_completed(future_to_url)
-        futures = tqdm(futures, total=len(ds['traj']))
-
-        ds_list, failed = [], []
-        for future in futures:
-            data = None
-            try:
-                data = future.result()
-            except Exception:
-                failed.append(future_to_url[future])
-                raise
-            finally:
-                ds_list.append(data)
-
-    ds_list = [r for r in ds_list if r is not None]  # Only keep non-empty results
-    ds_profiles = xr.concat(ds_list, dim='obs')
-    if 'wmo' not in ds_profiles.data_vars:
-        ds_profiles['wmo'] = ds_profiles['traj_id'] + 9000000
-    df = ds_profiles.to_dataframe()
-    df = df.rename({'time': 'date', 'lat': 'latitude', 'lon': 'longitude', 'z': 'min_depth'}, axis='columns')
-    df = df[['date', 'latitude', 'longitude', 'wmo', 'cycle_number', 'traj_id']]
-    df['wmo'] = df['wmo'].astype('int')
-    df['traj_id'] = df['traj_id'].astype('int')
-    df['latitude'] = np.fix(df['latitude'] * 1000).astype('int') / 1000
-    df['longitude'] = np.fix(df['longitude'] * 1000).astype('int') / 1000
-    df = df.reset_index(drop=True)
-    return df
+def _index_shard(simu_file: str, engine: str, start: int, stop: int, N: int = 1) -> pd.DataFrame:
+    """Open a trajectory file and return the profile index of one shard of trajectories (process pool worker)"""
+    with xr.open_dataset(simu_file, engine=engine) as ds:
+        trajdim = get_trajdim(ds)
+        return _ds2profiles(ds.isel({trajdim: slice(start, stop)}), trajdim, N=N)
+
 
+def simu2index_par(simu_file: str, workers: int = None, chunksize: int = DEFAULT_INDEX_BLOCK_SIZE, N: int = 1):
+    """Convert a trajectory simulation file to an Argo index of profiles, using a pool of processes
 
-def simu2csv(simu_file: str, index_file: str=None, df: pd.DataFrame=None):
+    The trajectory dimension is split into shards of ``chunksize`` trajectories, that are indexed in parallel by a
+    :class:`concurrent.futures.ProcessPoolExecutor`. Each worker opens the trajectory file lazily by itself and only
+    loads its own shard, so that no dataset is sent to the workers. Shards are merged in trajectory order, hence the
+    profile index is the same as the one returned by :meth:`simu2index`.
+
+    Parameters
+    ----------
+    simu_file: str
+        Path to the zarr or netcdf file of simulation results
+    workers: int, optional
+        Number of worker processes. By default, the number of CPUs.
+    chunksize: int, optional
+        Number of trajectories per shard
+    N: int, optional
+        The minimal time lag between cycle_phase sequences to be identified as a new profile (old trajectory files
+        only)
+
+    Returns
+    -------
+    df: :class:`pandas.DataFrame`
+        The profiles index
+    """
+    if not isinstance(simu_file, (str, Path)):
+        raise TypeError("'simu_file' must be the path to a trajectory file, not a %s" % type(simu_file))
+    simu_file = str(simu_file)
+    engine = 'zarr' if '.zarr' in simu_file else 'netcdf4'
+    with xr.open_dataset(simu_file, engine=engine) as ds:
+        ntraj = ds.sizes[get_trajdim(ds)]
+        if 'cycle_number' not in ds.data_vars:
+            warnings.warn("This is an old trajectory file, results not guaranteed !")
+
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    shards = [(start, min(start + chunksize, ntraj)) for start in range(0, ntraj, chunksize)]
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        future_to_shard = {executor.submit(_index_shard, simu_file, engine, start, stop, N): start
+                           for start, stop in shards}
+        futures = concurrent.futures.as_completed(future_to_shard)
+        for future in tqdm(futures, total=len(shards)):
+            results[future_to_shard[future]] = future.result()
+
+    df_list = [results[start] for start, _ in shards if len(results[start]) > 0]
+    if len(df_list) > 0:
+        return pd.concat(df_list, ignore_index=True)
+    else:
+        raise ValueError('No virtual floats reaches the final cycling phase, hence no profiles to index')
+
+
+def _index_dates(dates) -> np.ndarray:
+    """Format dates as ``YYYYMMDDhhmmss`` strings, with integer arithmetic on the whole column"""
+    t = np.asarray(dates, dtype='datetime64[s]')
+    days = t.astype('datetime64[D]')
+    months = t.astype('datetime64[M]')
+    years = t.astype('datetime64[Y]')
+    seconds = (t - days).astype(np.int64)
+    stamp = (years.astype(np.int64) + 1970) * 10 ** 10 \
+        + (months - years).astype(np.int64) * 10 ** 8 + 10 ** 8 \
+        + (days - months).astype(np.int64) * 10 ** 6 + 10 ** 6 \
+        + (seconds // 3600) * 10 ** 4 + (seconds % 3600 // 60) * 100 + seconds % 60
+    return stamp.astype(str)
+
+
+def _index_lines(df: pd.DataFrame, date_update: str) -> str:
+    """Format a profile index as lines of an Argo GDAC ``ar_index_global_prof.txt`` file
+
+    All columns are formatted at once with array string operations.
+    """
+    wmo = df['wmo'].to_numpy().astype(np.int64).astype(str)
+    cyc = np.char.zfill(df['cycle_number'].to_numpy().astype(np.int64).astype(str), 3)
+    file = np.char.add(np.char.add(np.char.add(np.char.add(np.char.add('vf/', wmo), '/profiles/R'), wmo), '_'), cyc)
+    columns = [np.char.add(file, '.nc'),
+               _index_dates(df['date']),
+               df['latitude'].to_numpy().astype(np.float64).astype(str),
+               df['longitude'].to_numpy().astype(np.float64).astype(str)]
+    line = columns[0]
+    for column in columns[1:]:
+        line = np.char.add(np.char.add(line, ','), column)
+    # Constant columns: ocean 'A' (Atlantic ocean area), profiler_type 999 (Reserved), institution 'VF' (VirtualFleet)
+    line = np.char.add(line, ',A,999,VF,%s\n' % date_update)
+    return "".join(line.tolist())
+
+
+def simu2csv(simu_file: str, index_file: str = None, df: pd.DataFrame = None,
+             block_size: int = DEFAULT_INDEX_BLOCK_SIZE, compression: str = 'infer', append: bool = False):
     """Save simulation results profile index to file, as Argo index
 
-    Argo profile index can be loaded with argopy.
+    Argo profile index can be loaded with argopy. The file follows the layout of the Argo GDAC
+    ``ar_index_global_prof.txt`` file.
+
+    When the index is computed from ``simu_file``, the trajectory file is read by blocks of ``block_size``
+    trajectories and profiles are appended to the index file block after block, so that the whole trajectory store is
+    never loaded in memory. Each block is formatted with array string operations.
 
     Parameters
     ----------
     simu_file: str
-        Path to netcdf file of simulation results, to load profiles from
+        Path to netcdf file of simulation results, to load profiles from. It can be None if ``df`` and
+        ``index_file`` are provided.
     index_file: str, optional
         Path to csv file to write index to. By default, it is set using the ``simu_file`` value.
     df: :class:`pandas.DataFrame`, optional
         If provided, will be used as the profile index, otherwise, compute index from ``simu_file``
+    block_size: int, optional
+        Number of trajectories to load at once when computing the index from ``simu_file``
+    compression: str, optional, default='infer'
+        Use ``'gzip'`` to write a gzip compressed index file, or None. By default, the index file is compressed if
+        its name ends with ``.gz``.
+    append: bool, optional, default=False
+        Append profiles to an existing index file, without writing the header. This is useful for segmented
+        simulations.
 
     Returns
     -------
@@ -638,10 +1559,31 @@ def simu2csv(simu_file: str, index_file: str=None, df: pd.DataFrame=None):
         Path to the Argo profile index created
     """
     if index_file is None:
-        file_name, file_extension = os.path.splitext(index_file)
+        file_name, file_extension = os.path.splitext(simu_file)
         index_file = simu_file.replace(file_extension, "_ar_index_prof.txt")
+    if compression == 'infer':
+        compression = 'gzip' if index_file.endswith('.gz') else None
+    if compression not in [None, 'gzip']:
+        raise ValueError("'compression' must be 'gzip', 'infer' or None")
+    open_index = gzip.open if compression == 'gzip' else open
 
-    txt_header = """# Title : Profile directory file of a VirtualFleet simulation
+    if df is None:
+        log.debug("Computing profile index from simulation file: %s" % simu_file)
+        engine = 'zarr' if '.zarr' in simu_file else 'netcdf4'
+        ds = xr.open_dataset(simu_file, engine=engine)
+        if 'cycle_number' not in ds.data_vars:
+            warnings.warn("This is an old trajectory file, results not guaranteed !")
+        blocks = simu2index_iter(ds, block_size=block_size)
+    else:
+        blocks = [df]
+
+    log.debug("Writing profile index file: %s" % index_file)
+    date_update = pd.to_datetime('now', utc=True).strftime('%Y%m%d%H%M%S')
+    append = append and os.path.exists(index_file)
+    nprof = 0
+    with open_index(index_file, 'at' if append else 'wt') as f:
+        if not append:
+            f.write("""# Title : Profile directory file of a VirtualFleet simulation
 # Description : Profiles from simulation result file: {}
 # Project : ARGO, EARISE
 # Format version : 2.0
@@ -649,47 +1591,160 @@ def simu2csv(simu_file: str, index_file: str=None, df: pd.DataFrame=None):
 # FTP root number 1 : ftp://ftp.ifremer.fr/ifremer/argo/dac
 # FTP root number 2 : ftp://usgodae.org/pub/outgoing/argo/dac
 # GDAC node : -
-""".format(os.path.abspath(simu_file), pd.to_datetime('now', utc=True).strftime('%Y%m%d%H%M%S'))
-    with open(index_file, 'w') as f:
-        f.write(txt_header)
-
-    if df is None:
-        log.debug("Computing profile index from simulation file: %s" % simu_file)
-        engine = 'zarr' if '.zarr' in simu_file else 'netcdf4'
-        ds = xr.open_dataset(simu_file, engine=engine)
-        ardf = simu2index(ds)
-        # try:
-        #     ardf = simu2index_par(xr.open_dataset(simu_file))
-        # except ValueError:
-        #     ardf = simu2index(xr.open_dataset(simu_file))
-    else:
-        ardf = df.copy()
-
-    if len(ardf) > 0:
-        log.debug("Writing profile index file: %s" % index_file)
-        with open(index_file, 'a+') as f:
-            ardf['institution'] = 'VF'  # VirtualFleet
-            ardf['profiler_type'] = 999  # Reserved
-            ardf['ocean'] = 'A'  # Atlantic ocean area
-            ardf['date_update'] = pd.to_datetime('now', utc=True)
-            ardf['file'] = ardf.apply(
-                lambda row: "vf/%i/profiles/R%i_%0.2d.nc" % (row['wmo'], row['wmo'], row['cycle_number']), axis=1)
-            ardf = ardf[['file', 'date', 'latitude', 'longitude', 'ocean', 'profiler_type', 'institution', 'date_update']]
-            ardf.to_csv(f, index=False, date_format='%Y%m%d%H%M%S')
+file,date,latitude,longitude,ocean,profiler_type,institution,date_update
+""".format(os.path.abspath(simu_file) if simu_file is not None else '-', date_update))
+        for ardf in blocks:
+            if len(ardf) > 0:
+                f.write(_index_lines(ardf, date_update))
+                nprof += len(ardf)
+
+    if df is None and nprof == 0:
+        raise ValueError('No virtual floats reaches the final cycling phase, hence no profiles to index')
 
     return index_file
 
 
-def set_WMO(ds: xr.Dataset, argo_index: pd.DataFrame):
+def _write_parquet_block(df: pd.DataFrame, path: str, traj_block, date: str, part: int):
+    """Append a block of rows to a parquet dataset partitioned by trajectory block and month"""
+    df['traj_block'] = traj_block
+    df['month'] = np.asarray(df[date], dtype='datetime64[M]').astype(str)
+    pq.write_to_dataset(pa.Table.from_pandas(df, preserve_index=False),
+                        root_path=path,
+                        partition_cols=['traj_block', 'month'],
+                        basename_template="part-%0.5d-{i}.parquet" % part,
+                        existing_data_behavior='overwrite_or_ignore')
+
+
+def _new_parquet_dataset(path: str):
+    if not has_pyarrow:
+        raise ModuleNotFoundError("pyarrow is required to export to parquet")
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def simu2parquet(simu_file: str, path: str = None, block_size: int = DEFAULT_INDEX_BLOCK_SIZE):
+    """Export simulation trajectories to a parquet dataset
+
+    Trajectories are written as rows, one per observation, with the ``trajectory`` and ``obs`` indices and all
+    ``trajectory x obs`` variables of the simulation (``time``, ``lat``, ``lon``, ``z``, ``cycle_number``,
+    ``cycle_phase``, ...). Fill values of floats not released yet or deleted are dropped.
+
+    The dataset is partitioned by block of ``block_size`` trajectories (``traj_block``, computed from the
+    ``trajectory`` value) and by month of observation (``month``), with hive-style directory names (e.g.
+    ``traj_block=0/month=2020-01``), so that pandas, polars or duckdb can select rows without scanning the whole
+    dataset. Partitions are the same as those of :meth:`index2parquet` with the same ``block_size``. The trajectory
+    file is read by blocks of ``block_size`` trajectories.
+
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    simu_file: str
+        Path to the zarr (or netcdf) file of simulation results
+    path: str, optional
+        Path to the parquet dataset directory to create. By default, it is set using the ``simu_file`` value.
+        An existing dataset with this path is replaced.
+    block_size: int, optional
+        Number of trajectories per block
+
+    Returns
+    -------
+    path: str
+        Path to the parquet dataset created
+    """
+    if path is None:
+        path = os.path.splitext(simu_file)[0] + ".parquet"
+    _new_parquet_dataset(path)
+
+    engine = 'zarr' if '.zarr' in simu_file else 'netcdf4'
+    ds = xr.open_dataset(simu_file, engine=engine)
+    trajdim = get_trajdim(ds)
+    variables = [v for v in ds.data_vars if ds[v].dims == (trajdim, 'obs')]
+    ntraj = ds.sizes[trajdim]
+    for iblock, start in enumerate(range(0, ntraj, block_size)):
+        block = ds[variables].isel({trajdim: slice(start, start + block_size)}).load()
+        traj = block[trajdim].values
+        ii = np.flatnonzero(~np.isnat(block['time'].values.ravel()))
+        df = pd.DataFrame({
+            'trajectory': np.repeat(traj, block.sizes['obs'])[ii],
+            'obs': np.tile(np.arange(block.sizes['obs'], dtype=np.int32), len(traj))[ii],
+        })
+        for v in variables:
+            df[v] = block[v].values.ravel()[ii]
+        for v in ['cycle_number', 'cycle_phase']:
+            if v in df and not df[v].isna().any():
+                df[v] = df[v].astype(np.int32)  # Integers are decoded as floats because of fill values
+        if len(df) > 0:
+            _write_parquet_block(df, path, df['trajectory'].to_numpy() // block_size, 'time', iblock)
+    return path
+
+
+def index2parquet(df: pd.DataFrame, path: str, block_size: int = DEFAULT_INDEX_BLOCK_SIZE):
+    """Export a profile index to a parquet dataset
+
+    The dataset is partitioned by block of ``block_size`` trajectories (``traj_block``, computed from ``traj_id``,
+    the ``trajectory`` value) and by month of the profile ``date`` (``month``), as in :meth:`simu2parquet`.
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    df: :class:`pandas.DataFrame`
+        A profile index, as returned by :meth:`simu2index`
+    path: str
+        Path to the parquet dataset directory to create. An existing dataset with this path is replaced.
+    block_size: int, optional
+        Number of trajectories per block
+
+    Returns
+    -------
+    path: str
+        Path to the parquet dataset created
+    """
+    _new_parquet_dataset(path)
+    df = df.copy()
+    _write_parquet_block(df, path, df['traj_id'].to_numpy() // block_size, 'date', 0)
+    return path
+
+
+EARTH_RADIUS = 6371.
+"""Mean Earth radius, in km"""
+
+
+def _unit_vectors(lon, lat) -> np.ndarray:
+    """Return cartesian coordinates on the unit sphere of longitudes and latitudes in degrees, as a (N, 3) array"""
+    lon, lat = np.deg2rad(np.asarray(lon, dtype=float)), np.deg2rad(np.asarray(lat, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def haversine(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """Great circle distance, in km, between points given by longitudes and latitudes in degrees"""
+    lon1, lat1, lon2, lat2 = [np.deg2rad(np.asarray(x, dtype=float)) for x in [lon1, lat1, lon2, lat2]]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def first_positions(ds: xr.Dataset) -> pd.DataFrame:
+    """Return the time and position of the first observation of each trajectory of a simulation dataset"""
+    trajdim = 'trajectory' if 'trajectory' in ds.dims else 'traj'
+    t = ds['time'].values.astype('datetime64[ns]')
+    first = np.argmin(np.where(np.isnat(t), np.datetime64(np.iinfo(np.int64).max, 'ns'), t), axis=1)
+    pick = lambda a: np.take_along_axis(a, first[:, np.newaxis], axis=1)[:, 0]
+    return pd.DataFrame({'time': pick(t), 'longitude': pick(ds['lon'].values), 'latitude': pick(ds['lat'].values)},
+                        index=pd.Index(ds[trajdim].values, name=trajdim))
+
+
+def set_WMO(ds: xr.Dataset, argo_index: pd.DataFrame, metric: str = 'haversine', date_tolerance=None):
     """Identify virtual floats with their real WMO
 
     This function will try to identify WMO from ``argo_index`` in the ``ds`` trajectories.
 
-    The Argo index must have at least the ``longitude`` and ``latitude`` variables.
-    It's assumed to be the deployment plan.
+    The Argo index must have at least the ``longitude``, ``latitude`` and ``wmo`` variables, and a ``date`` variable
+    to match deployment dates. It's assumed to be the deployment plan.
 
     Real WMO numbers are identified as the closest floats from ``argo_index`` to the initial positions
-    of virtual floats from ``ds``.
+    of virtual floats from ``ds``. The initial positions of all virtual floats are matched at once, with a nearest
+    neighbour search in a KD-tree of the Argo index positions, so that thousands of floats are identified in a fraction
+    of a second.
 
     Parameters
     ----------
@@ -697,31 +1752,237 @@ def set_WMO(ds: xr.Dataset, argo_index: pd.DataFrame):
         The simulation trajectories dataset
     argo_index: :class:`pandas.DataFrame`
         The deployment plan profiles index
+    metric: str, default='haversine'
+        Distance between positions: ``haversine`` for the great circle distance, or ``euclidean`` for the distance in
+        degrees of longitude and latitude, as in versions up to 0.5.1.
+    date_tolerance: :class:`datetime.timedelta`, optional
+        If set, a virtual float can only be identified with a real float deployed within ``date_tolerance`` of its
+        first observation. Virtual floats without such a real float get a WMO of 0.
 
     Returns
     -------
     ds: :class:`xarray.Dataset`
-        The simulation trajectories dataset with a new variable ``wmo``
+        The simulation trajectories dataset with a new variable ``wmo``, and a new variable ``wmo_distance`` with the
+        distance to the identified real float (in km for haversine distances, in degrees otherwise)
 
     """
-    ds['wmo'] = xr.DataArray(np.full((len(ds['traj']),), 0), dims='traj')
-    wmos = []
-
-    x_real = np.round(argo_index['longitude'], 5).values
-    y_real = np.round(argo_index['latitude'], 5).values
-    for i in ds['traj']:
-        this = ds.isel(traj=i).sortby('time')
-        x_virt = np.round(this.sel(obs=0)['lon'], 3).values
-        y_virt = np.round(this.sel(obs=0)['lat'], 3).values
-        ii = np.argmin(np.sqrt(np.power(x_real - x_virt, 2) + np.power(y_real - y_virt, 2)))
-        wmo = np.array((argo_index.iloc[ii]['wmo'],))[0]
-        wmos.append(wmo)
-    ds['wmo'].values = wmos
+    from scipy.spatial import cKDTree
+
+    first = first_positions(ds)
+    trajdim = first.index.name
+    if metric == 'haversine':
+        points_real = _unit_vectors(argo_index['longitude'].values, argo_index['latitude'].values)
+        points_virt = _unit_vectors(first['longitude'].values, first['latitude'].values)
+    elif metric == 'euclidean':
+        points_real = np.stack([argo_index['longitude'].values, argo_index['latitude'].values], axis=-1)
+        points_virt = np.stack([first['longitude'].values, first['latitude'].values], axis=-1)
+    else:
+        raise ValueError("'metric' must be 'haversine' or 'euclidean'")
+    tree = cKDTree(points_real)
+
+    valid = np.all(np.isfinite(points_virt), axis=1)
+    ii = np.full((len(first),), -1)
+    if date_tolerance is None:
+        ii[valid] = tree.query(points_virt[valid], k=1)[1]
+    else:
+        tolerance = pd.Timedelta(date_tolerance).to_timedelta64()
+        date_real = pd.to_datetime(argo_index['date']).values.astype('datetime64[ns]')
+        date_virt = first['time'].values.astype('datetime64[ns]')
+        todo = np.flatnonzero(valid)
+        k = min(16, len(argo_index))
+        while len(todo) > 0:
+            # Among the k closest real floats, pick the closest one deployed within the tolerance:
+            candidates = tree.query(points_virt[todo], k=k)[1].reshape(len(todo), k)
+            ok = np.abs(date_real[candidates] - date_virt[todo][:, np.newaxis]) <= tolerance
+            found = np.any(ok, axis=1)
+            ii[todo[found]] = candidates[found, np.argmax(ok[found], axis=1)]
+            if k == len(argo_index):
+                break
+            todo = todo[~found]
+            k = min(k * 8, len(argo_index))
+        if np.any(valid & (ii < 0)):
+            log.warning("%i virtual floats have no real float deployed within %s" % (np.sum(valid & (ii < 0)),
+                                                                                     date_tolerance))
+
+    matched = ii >= 0
+    wmo = np.zeros((len(first),), dtype=np.int64)
+    wmo[matched] = argo_index['wmo'].values[ii[matched]]
+    distance = np.full((len(first),), np.nan)
+    if metric == 'haversine':
+        distance[matched] = haversine(first['longitude'].values[matched], first['latitude'].values[matched],
+                                      argo_index['longitude'].values[ii[matched]],
+                                      argo_index['latitude'].values[ii[matched]])
+    else:
+        distance[matched] = np.linalg.norm(points_virt[matched] - points_real[ii[matched]], axis=1)
+
+    ds['wmo'] = xr.DataArray(wmo, dims=trajdim)
+    ds['wmo_distance'] = xr.DataArray(distance, dims=trajdim,
+                                      attrs={'units': 'km' if metric == 'haversine' else 'degree',
+                                             'long_name': 'Distance to the real float initial position'})
 
     return ds
 
 
-def get_float_config(wmo: int, cyc: int = None):
+EA_FLEETMONITORING_API = "https://fleetmonitoring.euro-argo.eu/floats"
+"""URL of the Euro-Argo fleet monitoring API end-point with float meta-data"""
+
+DEFAULT_API_CACHE_TTL = 86400
+"""Default time to live (in seconds) of Euro-Argo API responses cached on disk"""
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections to a single host, one connection per thread
+
+    Proxies are set from the environment (``HTTP_PROXY``, ``HTTPS_PROXY`` and ``NO_PROXY``) as with
+    :meth:`urllib.request.urlopen`, HTTPS requests being tunneled through the proxy. Redirections to the same host
+    re-use the connection, and other redirections are followed with :meth:`urllib.request.urlopen`.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, url: str, timeout: float = 30):
+        url = urllib.parse.urlsplit(url)
+        self.scheme, self.netloc, self.path = url.scheme, url.netloc, url.path.rstrip('/')
+        self.timeout = timeout
+        proxy = urllib.request.getproxies().get(self.scheme, None)
+        self.proxy = None if proxy is None or urllib.request.proxy_bypass(url.hostname) else urllib.parse.urlsplit(
+            proxy if '://' in proxy else 'http://%s' % proxy)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _proxy_headers(self) -> dict:
+        if self.proxy.username is None:
+            return {}
+        credentials = "%s:%s" % (urllib.parse.unquote(self.proxy.username),
+                                 urllib.parse.unquote(self.proxy.password or ''))
+        return {'Proxy-Authorization': 'Basic %s' % base64.b64encode(credentials.encode()).decode()}
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        if self.proxy is None:
+            conn = cls(self.netloc, timeout=self.timeout)
+        elif self.scheme == 'https':
+            conn = cls(self.proxy.hostname, self.proxy.port, timeout=self.timeout)
+            conn.set_tunnel(self.netloc, headers=self._proxy_headers())
+        else:
+            conn = http.client.HTTPConnection(self.proxy.hostname, self.proxy.port, timeout=self.timeout)
+        with self._lock:
+            self._connections.append(conn)
+        self._local.conn = conn
+        return conn
+
+    def _request(self, path: str):
+        """Send a GET request on the connection of this thread, and return the response and its body"""
+        headers = {'Connection': 'keep-alive', 'Accept': 'application/json'}
+        if self.proxy is not None and self.scheme == 'http':
+            path = "http://%s%s" % (self.netloc, path)  # Absolute URL and credentials for the proxy
+            headers.update(self._proxy_headers())
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None) or self._connect()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have closed an idle keep-alive connection, retry once with a new one:
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+
+    def get(self, name: str) -> bytes:
+        """Return the body of a GET request to ``<url>/<name>``, following redirections"""
+        url = "%s://%s%s/%s" % (self.scheme, self.netloc, self.path, name)
+        for redirect in range(self.max_redirects + 1):
+            location = urllib.parse.urlsplit(url)
+            if (location.scheme, location.netloc) != (self.scheme, self.netloc):
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    return response.read()
+            response, body = self._request(urllib.parse.urlunsplit(('', '', location.path, location.query, '')))
+            if response.status in [301, 302, 303, 307, 308] and response.getheader('Location') is not None:
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return body
+        raise urllib.error.HTTPError(url, response.status, "Too many redirections", response.headers, None)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+def fetch_float_meta(wmos: Iterable[int],
+                     api: str = EA_FLEETMONITORING_API,
+                     cache: Union[bool, str] = True,
+                     ttl: float = DEFAULT_API_CACHE_TTL,
+                     workers: int = 8) -> Dict[int, dict]:
+    """Download float meta-data from the Euro-Argo fleet monitoring API, concurrently and with an on-disk cache
+
+    Requests are sent by a pool of threads, each re-using a keep-alive connection to the API server. Raw JSON
+    responses are cached on disk, in the ``api`` folder of the VirtualFleet cache directory (see
+    :meth:`velocity_helpers.get_cache_dir`), and re-used as long as they are younger than ``ttl`` seconds.
+
+    Parameters
+    ----------
+    wmos: iterable of int
+        Float WMO numbers
+    api: str, default: :data:`EA_FLEETMONITORING_API`
+        URL of the API end-point, float meta-data being at ``<api>/<wmo>``
+    cache: bool or str, default: True
+        Cache API responses on disk, in the default cache directory if True or in this directory if a path
+    ttl: float, default: :data:`DEFAULT_API_CACHE_TTL`
+        Time to live of cached responses, in seconds
+    workers: int, default: 8
+        Number of concurrent requests
+
+    Returns
+    -------
+    dict
+        Float meta-data, a dictionary decoded from the API JSON response, for each WMO
+    """
+    from .velocity_helpers import get_cache_dir
+    wmos = list(dict.fromkeys([int(wmo) for wmo in wmos]))  # Unique, in order
+    cache_dir = None
+    if cache:
+        cache_dir = os.path.join(get_cache_dir() if cache is True else cache, 'api',
+                                 hashlib.sha1(api.encode()).hexdigest()[:12])
+        os.makedirs(cache_dir, exist_ok=True)
+
+    data, missing = {}, []
+    for wmo in wmos:
+        cache_file = os.path.join(cache_dir, "%i.json" % wmo) if cache_dir is not None else None
+        if cache_file is not None and os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+            with open(cache_file, 'rb') as f:
+                data[wmo] = json.loads(f.read())
+        else:
+            missing.append(wmo)
+    log.debug("Float meta-data: %i from cache, %i to download" % (len(data), len(missing)))
+
+    if len(missing) > 0:
+        pool = _ConnectionPool(api)
+
+        def fetch(wmo):
+            body = pool.get(str(wmo))
+            if cache_dir is not None:
+                with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.json', delete=False) as f:
+                    f.write(body)
+                os.replace(f.name, os.path.join(cache_dir, "%i.json" % wmo))
+            return json.loads(body)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+                for wmo, meta in zip(missing, executor.map(fetch, missing)):
+                    data[wmo] = meta
+        finally:
+            pool.close()
+    return {wmo: data[wmo] for wmo in wmos}
+
+
+def get_float_config(wmo: int, cyc: int = None, data: dict = None, **kwargs):
     """Download float configuration using the Euro-Argo meta-data API
 
     Parameters
@@ -730,25 +1991,18 @@ def get_float_config(wmo: int, cyc: int = None):
         The float WMO number
     cyc: int, default: None
         The specific cycle number to retrieve data from. If set to None, all cycles meta-data are fetched.
+    data: dict, optional
+        Float meta-data already downloaded with :meth:`fetch_float_meta`. If not set, meta-data are fetched with
+        :meth:`fetch_float_meta` and other arguments are passed on to it.
 
     Returns
     -------
     :class:`pandas.DataFrame`
         A dataframe with relevant float configuration parameters for 1 or more cycle numbers.
     """
-
-    def id_mission(missionCycles, a_cyc):
-        this_mission = None
-        for im, mission in enumerate(missionCycles):
-            cycles = missionCycles[mission]
-            if str(a_cyc) in cycles:
-                this_mission = mission
-        return this_mission
-
     # Download float meta-data from EA API:
-    URI = "https://fleetmonitoring.euro-argo.eu/floats/%s" % wmo
-    with urllib.request.urlopen(URI) as url:
-        data = json.load(url)
+    if data is None:
+        data = fetch_float_meta([wmo], **kwargs)[int(wmo)]
 
     # data['configurations']['cycles'] -> dict
     #    keys (str): comma separated list of cycle numbers
@@ -762,46 +2016,35 @@ def get_float_config(wmo: int, cyc: int = None):
     #    values (list of str): items of the list are cycle numbers, as str, with this configuration
     #                Eg: ['105', '78', '80', '83', '99', '108', '74', '93']
 
+    # Index cycle numbers to their mission ID and to their configuration:
+    cycle_mission, cycle_config = {}, {}
+    for mission, cycles in data['configurations']['missionCycles'].items():
+        for c in cycles:
+            cycle_mission[int(c)] = mission
+    for cycles, items in data['configurations']['cycles'].items():
+        config = {}
+        for item in items:
+            config.setdefault(item['argoCode'], item['value'])  # First value of a code (issue #26)
+        for c in cycles.split(','):
+            cycle_config.setdefault(int(c), config)  # The first configuration listing a cycle wins
+
     # Get the list of cycles covered:
-    all_cycles = []
-    for mission in data['configurations']['missionCycles']:
-        cycles = data['configurations']['missionCycles'][mission]
-        cycles = np.sort([int(cyc) for cyc in cycles])
-        [all_cycles.append(cyc) for cyc in cycles]
-    all_cycles = np.sort(all_cycles)
-    if cyc is not None:
-        all_cycles = [cyc]
+    all_cycles = np.sort(list(cycle_mission.keys())) if cyc is None else [cyc]
 
     # Create a dictionary with 'CONFIG_*' as keys
-    # the CONFIG_MissionID is set manually, then we add all possible config keys by scanning all argoCode
-    CONFIG = {'CONFIG_MissionID': []}
-    for cyles_with_this_config in list(data['configurations']['cycles'].keys()):
-        for item in data['configurations']['cycles'][cyles_with_this_config]:
-            if cyc is not None:
-                if cyc in [int(c) for c in cyles_with_this_config.split(',')]:
-                    CONFIG[item['argoCode']] = []
-            else:
-                CONFIG[item['argoCode']] = []
-    CONFIG = dict(sorted(CONFIG.items()))
-
-    # Loop through all cycle numbers
-    # for each cycle we identify the associated entry
-    for icyc, a_cyc in enumerate(all_cycles):
-        mission_id = id_mission(data['configurations']['missionCycles'], a_cyc)
-        for im, cyles_with_this_config in enumerate(data['configurations']['cycles']):
-            if a_cyc in [int(c) for c in cyles_with_this_config.split(',')]:
-                this_config = data['configurations']['cycles'][cyles_with_this_config]
-                for key in CONFIG:
-                    if key in [item['argoCode'] for item in this_config]:
-                        for item in this_config:
-                            if item['argoCode'] == key:
-                                if len(CONFIG[item[
-                                    'argoCode']]) == icyc:  # issue: https://github.com/euroargodev/VirtualFleet/issues/26
-                                    CONFIG[item['argoCode']].append(item['value'])
-                    elif key == 'CONFIG_MissionID':
-                        CONFIG['CONFIG_MissionID'].append(mission_id)
-                    else:
-                        CONFIG[key].append('')
+    # the CONFIG_MissionID is set manually, then we add all possible config keys from all configurations
+    if cyc is None:
+        configs = data['configurations']['cycles'].values()
+        keys = set([item['argoCode'] for items in configs for item in items])
+    else:
+        keys = set(cycle_config.get(cyc, {}).keys())
+    keys = sorted(keys | {'CONFIG_MissionID'})
+
+    CONFIG = {key: [] for key in keys}
+    for a_cyc in all_cycles:
+        config = {**cycle_config.get(a_cyc, {}), 'CONFIG_MissionID': cycle_mission.get(a_cyc, None)}
+        for key in keys:
+            CONFIG[key].append(config.get(key, ''))
 
     df = pd.DataFrame(CONFIG, index=all_cycles)
     df.index.name = 'CYCLE_NUMBER'
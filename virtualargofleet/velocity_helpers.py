@@ -2,17 +2,110 @@
 Velocity Field Helper
 """
 
-from parcels import FieldSet, ParticleSet, Field
+from parcels import FieldSet, ParticleSet, Field, NestedField
+import numpy as np
 import xarray as xr
 import glob
-from abc import ABC
+import os
+import hashlib
+import tempfile
+import time
+from datetime import timedelta
+from abc import ABC, abstractmethod
 import logging
-from .app_parcels import ArgoParticle
+from .app_parcels import ArgoParticle, SnapshotPrefetcher
 
 
 log = logging.getLogger("virtualfleet.velocity")
 
 
+BATHY_SECURITY_DEPTH = 50
+"""Security distance (in m) above the deepest velocity field level used to compute bathymetry"""
+
+
+def get_cache_dir():
+    """Return the default VirtualFleet cache directory
+
+    This is ``$VIRTUALFLEET_CACHE_DIR`` if set, otherwise ``~/.cache/virtualfleet``.
+    """
+    return os.environ.get('VIRTUALFLEET_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'virtualfleet'))
+
+
+DEFAULT_PREFETCH_WINDOW = 2
+"""Default number of velocity snapshots decoded in advance, per variable, with ``Velocity(..., prefetch=True)``"""
+
+
+DEFAULT_MAX_DRIFT_SPEED = 0.5
+"""Default upper bound of the floats drift speed (in m/s), used to compute the domain reachable by a fleet"""
+
+
+def get_subset_box(plan: dict, duration, max_speed: float = DEFAULT_MAX_DRIFT_SPEED) -> dict:
+    """Return the space/time domain that can be reached by floats from a deployment plan
+
+    The domain is the bounding box of the deployment positions, padded by the distance covered in ``duration`` at
+    ``max_speed``, and the time window from the first deployment to the last deployment plus ``duration``.
+
+    Longitudes of the domain are in the -180/180 convention, or in the 0/360 convention if this gives a narrower
+    domain, e.g. for a deployment plan across the antimeridian. The domain is wrapped to the longitude convention of
+    the velocity field when it is clipped.
+
+    Parameters
+    ----------
+    plan: dict
+        A deployment plan, with ``lat``, ``lon`` and ``time`` keys
+    duration: :class:`datetime.timedelta` or numeric
+        Length of the simulation (in days if numeric)
+    max_speed: float, optional
+        Upper bound of the floats drift speed, in m/s
+
+    Returns
+    -------
+    dict
+        A dictionary with ``lon``, ``lat`` and ``time`` keys, and [min, max] lists as values
+    """
+    if not isinstance(duration, timedelta):
+        duration = timedelta(days=float(duration))
+    lat, lon = np.asarray(plan['lat'], dtype=float), np.asarray(plan['lon'], dtype=float)
+    lon = (lon + 180.) % 360. - 180.
+    if np.ptp(lon % 360.) < np.ptp(lon):  # Plan across the antimeridian
+        lon = lon % 360.
+    tim = np.asarray(plan['time'], dtype='datetime64[ns]')
+
+    pad_lat = max_speed * duration.total_seconds() / 111195.  # Meters per degree of latitude
+    lat_min, lat_max = max(np.min(lat) - pad_lat, -90.), min(np.max(lat) + pad_lat, 90.)
+    cos_lat = np.cos(np.deg2rad(max(abs(lat_min), abs(lat_max))))
+    pad_lon = 360. if cos_lat < 1e-3 else pad_lat / cos_lat
+    return {'lon': [np.min(lon) - pad_lon, np.max(lon) + pad_lon],
+            'lat': [lat_min, lat_max],
+            'time': [np.min(tim), np.max(tim) + np.timedelta64(duration)]}
+
+
+def _wrap_lon_box(lon: np.ndarray, box: list):
+    """Wrap a [min, max] longitude box to the longitude convention of a 1D coordinate
+
+    Returns
+    -------
+    list or None
+        The wrapped box, or None if the box covers the entire globe or crosses the seam of the coordinate convention
+    """
+    if box[1] - box[0] >= 360.:
+        return None
+    lon_start = 0. if np.max(lon) > 180. else -180.
+    shift = np.floor((box[0] - lon_start) / 360.) * 360.
+    box = [box[0] - shift, box[1] - shift]
+    if box[1] >= lon_start + 360.:
+        return None
+    return box
+
+
+def _subset_slice(coord: np.ndarray, vmin, vmax) -> slice:
+    """Return the slice of a 1D coordinate covering [vmin, vmax], with one more point on each side"""
+    ii = np.flatnonzero((coord >= vmin) & (coord <= vmax))
+    if len(ii) == 0:
+        raise ValueError("Velocity field does not cover the subset domain [%s, %s]" % (vmin, vmax))
+    return slice(max(ii.min() - 1, 0), min(ii.max() + 2, len(coord)))
+
+
 class VelocityField(ABC):
     """Class prototype to manage a Virtual Fleet velocity field
 
@@ -29,8 +122,9 @@ class VelocityField(ABC):
     """Internal definition of the velocity fields; it can be a :class:`xarray.Dataset` or a dictionary with ``U`` 
     and ``V`` as keys and list of corresponding files as values"""
 
-    fieldset = None
-    """Instance of :class:`parcels.fieldset.FieldSet` created using the ``field`` attribute"""
+    _fieldset = None
+
+    _indices = None
 
     var = None
     """Variable dictionary mapping of ``U`` and ``V`` on netcdf velocity variable names"""
@@ -42,45 +136,141 @@ class VelocityField(ABC):
     """Boolean indicating weather the velocity field is global or not, used to add ``halo_*`` constants on the 
     ``fieldset`` attribute"""
 
+    mask_cache = True
+    """Cache the bathymetry computed by :meth:`add_mask` on disk. Can be a boolean or the path to a cache directory. 
+    If set to True, the cache directory is given by :meth:`get_cache_dir`."""
+
+
+    lazy = False
+    """If True, the ``fieldset`` is only built on first access"""
+
+    timings = None
+    """Dictionary with the execution time (in seconds) of each step of the ``fieldset`` creation"""
+
+    subset = None
+    """Space/time domain the velocity field is clipped to, a dictionary with ``lon``, ``lat`` and ``time`` keys"""
+
+    prefetch = 0
+    """Number of velocity snapshots decoded in advance by a background thread, per variable, see 
+    :class:`app_parcels.SnapshotPrefetcher`. Set to 0 to let parcels load snapshots on demand."""
+
+    prefetcher = None
+    """The :class:`app_parcels.SnapshotPrefetcher` of the ``fieldset``, if any"""
+
+    _lat_clipped = False
 
     def __repr__(self):
         summary = ["<VelocityField.%s>" % self.name]
+        if self._fieldset is None and self.lazy:
+            summary.append("- FieldSet not built yet (lazy)")
         return "\n".join(summary)
 
+    @property
+    def fieldset(self):
+        """Instance of :class:`parcels.fieldset.FieldSet` created using the ``field`` attribute
+
+        With a lazy velocity field, the FieldSet is built on first access.
+        """
+        if self._fieldset is None and self.lazy:
+            self.build()
+        return self._fieldset
+
+    @fieldset.setter
+    def fieldset(self, value):
+        self._fieldset = value
+
+    def _timeit(self, step, func, *args, **kwargs):
+        """Execute a FieldSet creation step and log its execution time"""
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        if self.timings is None:
+            self.timings = {}
+        self.timings[step] = time.perf_counter() - start
+        log.info("%s: %s done in %0.3fs" % (self.name, step, self.timings[step]))
+        return result
+
+    @abstractmethod
+    def build(self):
+        """Build the ``fieldset``, with global halo and bathymetric mask
+
+        This must be implemented by all velocity fields, and return the instance.
+        """
+
     def plot(self):
         """Quick plot of the ParticleSet"""
         temp_pset = ParticleSet(fieldset=self.fieldset, pclass=ArgoParticle, lon=0, lat=0, depth=0)
         temp_pset.show(field=self.fieldset.U, with_particles=False)
         # temp_pset.show(field = self.fieldset.V,with_particles = False)
 
+    def _mask_source(self):
+        """Return the first time step of the velocity field used to compute the bathymetry, and its source file"""
+        if isinstance(self.field, xr.core.dataset.Dataset):
+            ds = self.field
+            source = None
+        else:
+            source = glob.glob(self.field['U'])[0] if isinstance(self.field['U'], str) else self.field['U'][0]
+            # log.debug('mask_file: %s' % source)
+            ds = xr.open_dataset(source)
+            if self._indices is not None:
+                ds = ds.isel({self.dim[d]: self._indices[d] for d in self._indices})
+        ds = ds[{self.dim['time']: 0}]
+        ds = ds[[self.var['U'], self.var['V']]].squeeze()
+        return ds, source
+
+    def _mask_cache_file(self, ds, source):
+        """Return the cache file of the bathymetry computed from a source file, or None if it can't be cached
+
+        The cache key is made of the source file path, size and modification time, and of a hash of the grid.
+        """
+        if not self.mask_cache or source is None or not os.path.exists(source):
+            return None
+        cache_dir = get_cache_dir() if self.mask_cache is True else self.mask_cache
+
+        grid = hashlib.sha1()
+        for d in ['lon', 'lat', 'depth']:
+            grid.update(np.ascontiguousarray(ds[self.dim[d]].values).tobytes())
+        stat = os.stat(source)
+        key = "|".join([os.path.abspath(source), str(stat.st_size), str(stat.st_mtime_ns), grid.hexdigest(),
+                        self.var['U'], str(BATHY_SECURITY_DEPTH)])
+        return os.path.join(cache_dir, "bathy_%s.npy" % hashlib.sha1(key.encode()).hexdigest())
+
     def add_mask(self):
         """Create bathymetric mask for grounding management
 
+        The bathymetry is computed from the first time step of the velocity field. When the velocity field comes from
+        a dictionary of files, the bathymetry is cached on disk (see :attr:`mask_cache`) and memory-mapped by the next
+        :class:`VelocityField` created from the same source file.
+
         Requires:
             - ``self.field`` with ``U`` and ``V`` keys
             - ``self.dim`` with ``lon``, ``lat``, ``depth`` and ``time`` keys
             - ``self.var`` with ``U`` and ``V`` keys
         """
         if self.fieldset:
-            if isinstance(self.field, xr.core.dataset.Dataset):
-                ds = self.field[{self.dim['time']: 0}]
-                ds = ds[[self.var['U'], self.var['V']]].squeeze()
+            ds, source = self._mask_source()
+            cache_file = self._mask_cache_file(ds, source)
+
+            if cache_file is not None and os.path.exists(cache_file):
+                log.debug("Load bathymetry from cache: %s" % cache_file)
+                mask = np.load(cache_file, mmap_mode='r')
             else:
-                mask_file = glob.glob(self.field['U'])[0]
-                # log.debug('mask_file: %s' % mask_file)
-                ds = xr.open_dataset(mask_file)
-                ds = ds[{self.dim['time']: 0}]
-                ds = ds[[self.var['U'], self.var['V']]].squeeze()
-
-            #mask = ~(ds.where((~ds[self.var['U']].isnull()) | (~ds[self.var['V']].isnull()))[
-            #         self.var['U']].isnull()).transpose(self.dim['lon'], self.dim['lat'], self.dim['depth'])
-            # Generate bathymetric values with a 50m security
-            ds['mk'] = (~ds[self.var['U']].isnull()).astype(int)
-            ix = (ds['mk'].cumsum(self.dim['depth']).max(self.dim['depth']) - 1)
-            mask = (ds[self.dim['depth']][ix] - 50).transpose(self.dim['lon'], self.dim['lat'])
-            mask = mask.values
-            mask[mask<0] = 0
-            
+                #mask = ~(ds.where((~ds[self.var['U']].isnull()) | (~ds[self.var['V']].isnull()))[
+                #         self.var['U']].isnull()).transpose(self.dim['lon'], self.dim['lat'], self.dim['depth'])
+                # Generate bathymetric values with a 50m security
+                ds['mk'] = (~ds[self.var['U']].isnull()).astype(int)
+                ix = (ds['mk'].cumsum(self.dim['depth']).max(self.dim['depth']) - 1)
+                mask = (ds[self.dim['depth']][ix] - BATHY_SECURITY_DEPTH).transpose(self.dim['lon'], self.dim['lat'])
+                mask = mask.values
+                mask[mask<0] = 0
+
+                if cache_file is not None:
+                    log.debug("Save bathymetry to cache: %s" % cache_file)
+                    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                    with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_file), suffix='.npy',
+                                                     delete=False) as f:
+                        np.save(f, mask)
+                    os.replace(f.name, cache_file)  # Atomic, in case several processes write the same cache
+
             # create a new parcels field that's going to be interpolated during simulation
             self.fieldset.add_field(Field('bathy',
                                           data=mask,
@@ -92,18 +282,52 @@ class VelocityField(ABC):
         else:
             raise ValueError("Can't create mask because `fieldset` is not defined")
 
+    def set_prefetch(self):
+        """Decode the next velocity snapshots in a background thread, while kernels integrate the current ones
+
+        This only applies to a velocity field loaded from files, whose snapshots are loaded on demand by parcels.
+        """
+        if self.prefetch and not isinstance(self.field, xr.core.dataset.Dataset):
+            self.prefetcher = SnapshotPrefetcher(window=self.prefetch)
+            self.prefetcher.attach(self.fieldset.U).attach(self.fieldset.V)
+            log.info("%s: prefetching %i velocity snapshot(s) ahead" % (self.name, self.prefetch))
+        return self
+
+    def close(self):
+        """Stop prefetching velocity snapshots, if any
+
+        The ``fieldset`` can still be used afterwards, snapshots are then loaded on demand by parcels. A velocity field
+        can also be used as a context manager, closed on exit.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
     def set_global(self):
-        """Ensure a global fieldset"""
+        """Ensure a global fieldset
+
+        If the velocity field was clipped in latitude (see :attr:`subset`), only a zonal halo is added, and the
+        ``halo_south`` and ``halo_north`` constants are set to the poles, so that floats are not wrapped in latitude.
+        """
         if self.isglobal:
+            meridional = not self._lat_clipped
             self.fieldset.add_constant(
                 'halo_west', self.fieldset.U.grid.lon[0])
             self.fieldset.add_constant(
                 'halo_east', self.fieldset.U.grid.lon[-1])
             self.fieldset.add_constant(
-                'halo_south', self.fieldset.U.grid.lat[0])
+                'halo_south', self.fieldset.U.grid.lat[0] if meridional else -90.)
             self.fieldset.add_constant(
-                'halo_north', self.fieldset.U.grid.lat[-1])
-            self.fieldset.add_periodic_halo(zonal=True, meridional=True)
+                'halo_north', self.fieldset.U.grid.lat[-1] if meridional else 90.)
+            self.fieldset.add_periodic_halo(zonal=True, meridional=meridional)
 
 
 class VelocityField_CUSTOM(VelocityField):
@@ -146,27 +370,224 @@ class VelocityField_CUSTOM(VelocityField):
         self.var = variables  # Dictionary mapping 'U' and 'V' to netcdf velocity variable names
         self.dim = dimensions  # Dictionary mapping 'time', 'depth', 'lat' and 'lon' to netcdf velocity variable names
         self.isglobal = isglobal
+        if 'mask_cache' in kwargs:
+            self.mask_cache = kwargs['mask_cache']
+        if 'prefetch' in kwargs:
+            self.prefetch = DEFAULT_PREFETCH_WINDOW if kwargs['prefetch'] is True else int(kwargs['prefetch'])
+
+        self.field = src  # Xarray dataset or dictionary with 'U' and 'V' as keys and list of corresponding files
+
+        # Possibly clip the velocity field to the domain reachable by a fleet:
+        subset = kwargs['subset'] if 'subset' in kwargs else None
+        if isinstance(subset, str) and subset == 'auto':
+            if 'plan' not in kwargs or 'duration' not in kwargs:
+                raise ValueError("subset='auto' requires the 'plan' and 'duration' arguments")
+            max_speed = kwargs['max_speed'] if 'max_speed' in kwargs else DEFAULT_MAX_DRIFT_SPEED
+            subset = get_subset_box(kwargs['plan'], kwargs['duration'], max_speed=max_speed)
+        elif subset is not None and not isinstance(subset, dict):
+            raise ValueError("'subset' must be 'auto' or a dictionary with 'lon', 'lat' and 'time' keys")
+        self.subset = subset
+
+        self.lazy = kwargs['lazy'] if 'lazy' in kwargs else False
+        if not self.lazy:
+            self.build()
+
+    def build(self):
+        """Build the ``fieldset``, with global halo and bathymetric mask
+
+        This is called when the :class:`VelocityField` is created, or on first access to ``fieldset`` if the
+        velocity field is lazy. Execution time of each step is logged and stored in :attr:`timings`.
+        """
+        if self.subset is not None:
+            self._timeit('subset', self.apply_subset)
 
         # Define parcels fieldset
-        if not isinstance(src, xr.core.dataset.Dataset):
-            self.field = src  # Dictionary with 'U' and 'V' as keys and list of corresponding files as values
-            self.fieldset = FieldSet.from_netcdf(
-                src, self.var, self.dim,
-                allow_time_extrapolation=True,
-                time_periodic=False,
-                deferred_load=True)
+        if not isinstance(self.field, xr.core.dataset.Dataset):
+            self.fieldset = self._timeit('FieldSet.from_netcdf', FieldSet.from_netcdf,
+                                         self.field, self.var, self.dim,
+                                         indices=self._indices,
+                                         allow_time_extrapolation=True,
+                                         time_periodic=False,
+                                         deferred_load=True)
+            self._timeit('set_prefetch', self.set_prefetch)
         else:
-            self.field = src  # Xarray dataset
-            self.fieldset = FieldSet.from_xarray_dataset(
-                src, self.var, self.dim,
-                allow_time_extrapolation=True,
-                time_periodic=False)
+            self.fieldset = self._timeit('FieldSet.from_xarray_dataset', FieldSet.from_xarray_dataset,
+                                         self.field, self.var, self.dim,
+                                         allow_time_extrapolation=True,
+                                         time_periodic=False)
 
         # Possibly handle a global field:
-        self.set_global()
+        self._timeit('set_global', self.set_global)
 
         # Create mask to manage grounding:
-        self.add_mask()
+        self._timeit('add_mask', self.add_mask)
+        return self
+
+
+    def apply_subset(self):
+        """Clip the velocity field source to the :attr:`subset` domain
+
+        A :class:`xarray.Dataset` source is clipped in space and time. For a dictionary of files, files are selected
+        according to their time coverage, and space indices are passed on to :meth:`parcels.fieldset.FieldSet.from_netcdf`.
+        A global velocity field is only clipped in longitude if the subset domain does not cover the entire globe, in
+        which case it is no longer considered global. If it is only clipped in latitude, it remains periodic in longitude
+        only (see :meth:`set_global`).
+
+        The subset domain is wrapped to the longitude convention of the velocity field (-180/180 or 0/360). If it
+        crosses the seam of this convention, e.g. the antimeridian for a -180/180 velocity field, the velocity field is
+        not clipped in longitude and a warning is logged.
+        """
+        box = self.subset
+        if isinstance(self.field, xr.core.dataset.Dataset):
+            grid = self.field
+        else:
+            files = {v: sorted(glob.glob(self.field[v])) if isinstance(self.field[v], str) else list(self.field[v])
+                     for v in ['U', 'V']}
+            grid = xr.open_dataset(files['U'][0])
+
+        lon, lat = grid[self.dim['lon']].values, grid[self.dim['lat']].values
+        indices = {'lat': _subset_slice(lat, *box['lat'])}
+        self._lat_clipped = indices['lat'].start > 0 or indices['lat'].stop < len(lat)
+        lon_box = _wrap_lon_box(lon, box['lon'])
+        if lon_box is None:
+            if box['lon'][1] - box['lon'][0] < 360.:
+                log.warning("%s: the subset domain crosses the %s, the seam of the velocity field longitudes, it is "
+                            "not clipped in longitude" % (self.name, "Greenwich meridian" if np.max(lon) > 180.
+                                                          else "antimeridian"))
+        elif lon_box[0] > np.min(lon) or lon_box[1] < np.max(lon):
+            indices['lon'] = _subset_slice(lon, *lon_box)
+            if self.isglobal:
+                log.info("%s: velocity field clipped in longitude, it is no longer global" % self.name)
+                self.isglobal = False
+
+        tmin, tmax = np.datetime64(box['time'][0], 'ns'), np.datetime64(box['time'][1], 'ns')
+        if isinstance(self.field, xr.core.dataset.Dataset):
+            tim = self.field[self.dim['time']].values
+            if np.issubdtype(tim.dtype, np.datetime64):
+                indices['time'] = _subset_slice(tim, tmin, tmax)
+            else:
+                log.debug("%s: time coordinate is not a date, no time subsetting" % self.name)
+            self.field = self.field.isel({self.dim[d]: indices[d] for d in indices})
+        else:
+            # Select files with at least one time step in the window, plus the files just before and after:
+            keep = []
+            for ifile, file in enumerate(files['U']):
+                with xr.open_dataset(file) as ds:
+                    tim = ds[self.dim['time']].values.astype('datetime64[ns]')
+                keep.append(np.any((tim >= tmin) & (tim <= tmax)))
+            ii = np.flatnonzero(keep)
+            if len(ii) == 0:
+                raise ValueError("Velocity files do not cover the subset time window [%s, %s]" % (tmin, tmax))
+            ifiles = slice(max(ii.min() - 1, 0), ii.max() + 2)
+            self.field = {v: files[v][ifiles] for v in files}
+            self._indices = {d: list(range(indices[d].start, indices[d].stop)) for d in indices}
+        log.info("%s: velocity field clipped to lon=[%0.2f, %0.2f], lat=[%0.2f, %0.2f], time=[%s, %s]"
+                 % (self.name, *(box['lon'] if lon_box is None else lon_box), *box['lat'], tmin, tmax))
+        return self
+
+
+class VelocityField_NESTED(VelocityField):
+    """Nested composite of velocity fields with different resolutions and domains
+
+    Velocity and bathymetry are sampled from the first velocity field whose domain contains the virtual float, e.g. a
+    high-resolution regional product, and from the next ones outside of it, e.g. a coarse global product. This relies
+    on :class:`parcels.field.NestedField`.
+
+    Each member velocity field builds its own grid and bathymetry, so that memory and I/O scale with the area of each
+    member rather than with the area of the finest member. To further reduce memory use, members can be clipped to the
+    domain reachable by a fleet with the ``subset`` option.
+
+    Examples
+    --------
+    >>> VELfield = Velocity(model='nested', members=[
+    >>>     {'model': 'MEDSEA_ANALYSISFORECAST_PHY_006_013', 'src': "/home/data/MEDSEA/*.nc"},
+    >>>     {'model': 'GLORYS12V1', 'src': "/home/data/GLORYS12V1/*.nc"}],
+    >>>     subset='auto', plan=my_plan, duration=timedelta(days=365))
+    """
+    name = "NESTED"
+
+    members = None
+    """List of member :class:`VelocityField`, from the highest to the lowest priority"""
+
+    member_options = ['mask_cache', 'subset', 'plan', 'duration', 'max_speed', 'prefetch']
+    """Options of the nested velocity field passed on to members given as dictionaries"""
+
+    def __init__(self, members: list, **kwargs):
+        """Create a nested composite of velocity fields
+
+        Parameters
+        ----------
+        members: list
+            List of at least two :class:`VelocityField`, or of dictionaries with :meth:`Velocity` arguments, from the
+            highest to the lowest priority. The last member is usually global.
+        **kwargs
+            Options ``mask_cache``, ``subset``, ``plan``, ``duration``, ``max_speed`` and ``prefetch`` are passed on to
+            members given as dictionaries, unless already defined in the member dictionary. With ``lazy=True``, the
+            ``fieldset`` and all members are only built on first access.
+        """
+        if not isinstance(members, (list, tuple)) or len(members) < 2:
+            raise ValueError("'members' must be a list of at least two velocity fields")
+        if 'name' in kwargs:
+            self.name = kwargs['name']
+        self.lazy = kwargs['lazy'] if 'lazy' in kwargs else False
+
+        self.members = []
+        for member in members:
+            if isinstance(member, dict):
+                opts = {key: kwargs[key] for key in self.member_options if key in kwargs and key not in member}
+                member = VelocityFieldFacade(**{**member, **opts, 'lazy': True})
+            elif not isinstance(member, VelocityField):
+                raise ValueError("'members' must be VelocityField instances or dictionaries")
+            self.members.append(member)
+        self.isglobal = self.members[-1].isglobal
+        self.field = [member.field for member in self.members]
+
+        if not self.lazy:
+            self.build()
+
+    def __repr__(self):
+        summary = ["<VelocityField.%s>" % self.name]
+        if self._fieldset is None and self.lazy:
+            summary.append("- FieldSet not built yet (lazy)")
+        for ii, member in enumerate(self.members):
+            summary.append("- Level %i: %s" % (ii, member.name))
+        return "\n".join(summary)
+
+    def build(self):
+        """Build the ``fieldset``, nesting the velocity and bathymetry fields of all members
+
+        Members are built first, each with its own halo and bathymetric mask. The nested velocity field is global if
+        the last member is still global once built, e.g. if it was not clipped to a subset domain, in which case
+        constants of the global halo are taken from the last member.
+        """
+        for member in self.members:
+            self._timeit('build %s' % member.name, lambda: member.fieldset)
+        fieldsets = [member.fieldset for member in self.members]
+        self.isglobal = self.members[-1].isglobal and hasattr(fieldsets[-1], 'halo_west')
+
+        fields = {'bathy': NestedField('bathy', [fs.bathy for fs in fieldsets])}
+        self.fieldset = self._timeit('FieldSet', FieldSet,
+                                     NestedField('U', [fs.U for fs in fieldsets]),
+                                     NestedField('V', [fs.V for fs in fieldsets]),
+                                     fields=fields)
+        if self.isglobal:
+            for key in ['halo_west', 'halo_east', 'halo_south', 'halo_north']:
+                self.fieldset.add_constant(key, getattr(fieldsets[-1], key))
+        return self
+
+    def close(self):
+        """Stop prefetching velocity snapshots of all members"""
+        for member in self.members:
+            member.close()
+        return self
+
+    def add_mask(self):
+        """Do nothing, the ``bathy`` field is nested from the members bathymetric masks in :meth:`build`"""
+        return self
+
+    def set_global(self):
+        """Do nothing, the periodic halo is added by the last member and its constants are copied in :meth:`build`"""
+        return self
 
 
 def VelocityFieldFacade(model: str = 'GLOBAL_ANALYSIS_FORECAST_PHY_001_024', *args: object, **kwargs: object) -> object:
@@ -183,6 +604,23 @@ def VelocityFieldFacade(model: str = 'GLOBAL_ANALYSIS_FORECAST_PHY_001_024', *ar
             -  ``GLORYS12V1``, ``PSY4QV3R1``, ``GLOBAL_ANALYSIS_FORECAST_PHY_001_024``
             -  ``MEDSEA_ANALYSISFORECAST_PHY_006_013``
             -  ``ARMOR3D``, ``MULTIOBS_GLO_PHY_TSUV_3D_MYNRT_015_012``
+            -  ``nested`` to combine velocity fields with different resolutions and domains, given with the ``members``
+               argument, see :class:`VelocityField_NESTED`
+    mask_cache: bool or str, optional
+        Cache the bathymetry computed from velocity files on disk, see :attr:`VelocityField.mask_cache`.
+        Default is True.
+    lazy: bool, optional
+        Only build the :attr:`VelocityField.fieldset` on first access, e.g. when passed on to a :class:`VirtualFleet`.
+        Default is False.
+    subset: str or dict, optional
+        Clip the velocity field to a space/time domain before building the :attr:`VelocityField.fieldset`. Use
+        ``'auto'`` to compute this domain from the ``plan`` and ``duration`` arguments (see :meth:`get_subset_box`),
+        or give a dictionary with ``lon``, ``lat`` and ``time`` keys and [min, max] values. Floats leaving this domain
+        are deleted by the simulation, so that ``max_speed`` (m/s) should be an upper bound of the floats drift speed.
+    prefetch: bool or int, optional
+        Number of velocity snapshots decoded in advance by a background thread, per variable, so that reading and
+        decoding velocity files overlaps with the simulation. Use True for :data:`DEFAULT_PREFETCH_WINDOW` snapshots.
+        This requires a velocity field from files, and each snapshot in the window is held in memory. Default is 0.
 
     Returns
     -------
@@ -233,6 +671,9 @@ def VelocityFieldFacade(model: str = 'GLOBAL_ANALYSIS_FORECAST_PHY_001_024', *ar
     elif model.lower() in ['custom']:
         return VelocityField_CUSTOM(*args, **kwargs)
 
+    elif model.lower() in ['nested']:
+        return VelocityField_NESTED(*args, **kwargs)
+
     else:
         raise ValueError('Unknown model')
 
@@ -259,7 +700,8 @@ def VelocityField_PSY4QV3R1(**kwargs):
                   'lat': 'latitude',
                   'lon': 'longitude'}
     isglobal = kwargs['isglobal'] if 'isglobal' in kwargs else False
-    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=isglobal)
+    opts = {key: kwargs[key] for key in kwargs if key not in ['src', 'isglobal']}
+    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=isglobal, **opts)
     V.name = 'PSY4QV3R1'
     return V
 
@@ -285,7 +727,8 @@ def VelocityField_MEDSEA_ANALYSISFORECAST_PHY_006_013(**kwargs):
                   'depth': 'depth',
                   'lat': 'lat',
                   'lon': 'lon'}
-    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=False)
+    opts = {key: kwargs[key] for key in kwargs if key not in ['src', 'isglobal']}
+    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=False, **opts)
     V.name = 'MEDSEA_ANALYSISFORECAST_PHY_006_013'
     return V
 
@@ -312,6 +755,7 @@ def VelocityField_ARMOR3D(**kwargs):
                   'lat': 'latitude',
                   'lon': 'longitude'}
     isglobal = kwargs['isglobal'] if 'isglobal' in kwargs else False
-    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=isglobal)
+    opts = {key: kwargs[key] for key in kwargs if key not in ['src', 'isglobal']}
+    V = VelocityField_CUSTOM(src=src, variables=variables, dimensions=dimensions, isglobal=isglobal, **opts)
     V.name = 'ARMOR3D'
     return V
\ No newline at end of file
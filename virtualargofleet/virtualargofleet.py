@@ -8,10 +8,12 @@ from parcels import ParticleSet, FieldSet, AdvectionRK4, StatusCode
 import datetime
 from datetime import timedelta
 import os
+import json
 import tempfile
 import pandas as pd
 import numpy as np
 import xarray as xr
+import zarr
 import logging
 from .app_parcels import (
     ArgoParticle,
@@ -19,11 +21,16 @@ from .app_parcels import (
     ArgoFloatKernel,
     ArgoFloatKernel_exp,
     PeriodicBoundaryConditionKernel,
+    ArgoParticleFile,
+    ProfileCollector,
+    SimulationProfiler,
     KeepInDomain, KeepInWater #, KeepInColumn,
 )
 from .velocity_helpers import VelocityField
-from .utilities import SimulationSet, FloatConfiguration
-from .utilities import simu2csv, simu2index, strfdelta, getSystemInfo
+from .utilities import SimulationSet, FloatConfiguration, MissionTable, MissionCatalogue
+from .utilities import simu2csv, simu2index, simu2parquet, index2parquet, strfdelta, getSystemInfo, get_memory_hwm
+from .utilities import ResourceSampler
+from .utilities import DEFAULT_INDEX_BLOCK_SIZE
 import time
 from typing import Union, Iterable
 
@@ -35,6 +42,30 @@ DEFAULT_DEPLOYMENT_DEPTH = 1.0
 """Default deployment depth when not set in the plan"""
 
 
+DEFAULT_MONITOR_INTERVAL = 1.
+"""Interval, in seconds, of the resource sampling during simulations run with ``monitor=True``"""
+
+
+STATE_VARIABLES = ['cycle_phase', 'cycle_number', 'cycle_age', 'drift_age', 'in_water']
+"""Particle variables holding the cycling state of a virtual float"""
+
+
+CHECKPOINT_PARCELS_VERSIONS = ("3.1.0", "4.0.0")
+"""Range of parcels versions (min included, max excluded) supported by simulation checkpoints"""
+
+
+def _check_checkpoint_support():
+    """Raise an error if checkpoints are not supported by the installed parcels version
+
+    Checkpoints save and restore the layout of the trajectory file from private attributes of
+    :class:`parcels.particlefile.ParticleFile`, that are only known for these versions.
+    """
+    vmin, vmax = CHECKPOINT_PARCELS_VERSIONS
+    if not version.parse(vmin) <= version.parse(parcels.__version__) < version.parse(vmax):
+        raise ValueError("Segmented simulations with checkpoints require parcels >= %s and < %s, but parcels %s is "
+                         "installed" % (vmin, vmax, parcels.__version__))
+
+
 class VirtualFleet:
     """Argo Virtual Fleet simulator.
 
@@ -44,7 +75,8 @@ class VirtualFleet:
     def __init__(self,
                  plan: dict,
                  fieldset: Union[FieldSet, VelocityField],
-                 mission: Union[dict, FloatConfiguration, Iterable[dict], Iterable[FloatConfiguration]],
+                 mission: Union[dict, FloatConfiguration, Iterable[dict], Iterable[FloatConfiguration],
+                                pd.DataFrame, MissionTable, MissionCatalogue, str],
                  isglobal: bool = False,
                  **kwargs):
         """Create an Argo Virtual Fleet simulator
@@ -57,14 +89,20 @@ class VirtualFleet:
             Depth is optional, if not provided it will be set to 1m.
         fieldset: :class:`parcels.fieldset.FieldSet` or :class:`VelocityField`
             A velocity field
-        mission: dict or :class:`FloatConfiguration` or an iterable of those
+        mission: dict or :class:`FloatConfiguration` or an iterable of those, :class:`pandas.DataFrame`, :class:`MissionTable`, :class:`MissionCatalogue` or str
             A dictionary with the following Argo float mission parameters: ``parking_depth``, ``profile_depth``,
             ``vertical_speed`` and ``cycle_duration``. A :class:`FloatConfiguration` instance can also be passed.
 
             An iterable of dictionaries or :class:`FloatConfiguration` can be passed to specified mission parameters for each
             virtual floats. In this case, the length of the iterable must match the length of the deployment plan.
+            Mission parameters for each virtual floats can also be given as a :class:`pandas.DataFrame` with one column
+            per parameter, or as a :class:`MissionTable`.
+
+            A :class:`MissionCatalogue`, or the path to a catalogue Parquet or NetCDF file, can also be passed. If the
+            catalogue is keyed by WMO, the deployment plan must have a ``wmo`` key to select the mission of each float.
         isglobal: bool, optional, default=False
-            A boolean indicating weather the velocity field is global or not
+            A boolean indicating weather the velocity field is global or not. If ``fieldset`` is a
+            :class:`VelocityField` that is not global, e.g. because it was clipped to a subset domain, this is ignored.
 
         """
         self._isglobal = bool(isglobal)
@@ -79,45 +117,17 @@ class VirtualFleet:
             self.deployment_plan['depth'] = np.full(self.deployment_plan['lat'].shape, DEFAULT_DEPLOYMENT_DEPTH)
 
         # Mission parameters:
-        if not isinstance(mission,(list,tuple,np.ndarray)):
-            mission = list([mission])
-            
-        if len(mission)!=len(self.deployment_plan['lat']):
-            if(len(mission)==1): #if mission's len is 1, apply to all floats
-                mission = np.repeat(mission,len(self.deployment_plan['lat']))
+        if isinstance(mission, (str, os.PathLike)):
+            mission = MissionCatalogue.read(mission)
+        if isinstance(mission, MissionCatalogue):
+            mission = mission.for_plan(self.deployment_plan)
+        mission = MissionTable.from_any(mission)
+        if len(mission) != len(self.deployment_plan['lat']):
+            if len(mission) == 1:  # if mission's len is 1, apply to all floats
+                mission = mission.broadcast(len(self.deployment_plan['lat']))
             else:
                 raise TypeError("When providing a `mission` array, it should be the same lenght as your `plan`")
-        
-        #
-        for i in range(len(mission)):
-            if isinstance(mission[i], FloatConfiguration):  # be nice when we forget to set the correct input
-                mission[i] = mission[i].mission
-                
-            if not isinstance(mission[i], dict):
-                raise TypeError("The `mission` argument must be a dictionary or a `FloatConfiguration` instance")
-            
-            # standard parameters
-            for key in ['parking_depth', 'profile_depth', 'cycle_duration', 'vertical_speed', 'life_expectancy']:
-                if key not in mission[i]:
-                    raise ValueError("The 'mission' argument must have a '%s' key" % key)
-                
-            # Depending on the specific kernel used, we should check keys here
-
-            if mission[i]['parking_depth'] < 0 or mission[i]['parking_depth'] > 6000:
-                raise ValueError('Parking depth must be in [0-6000] db')
-
-            if mission[i]['profile_depth'] < 0 or mission[i]['profile_depth'] > 6000:
-                raise ValueError('Profile depth must be in [0-6000] db')
-
-            if mission[i]['cycle_duration'] < 0:
-                raise ValueError('Cycle duration must be positive')
-
-            if mission[i]['vertical_speed'] < 0:
-                raise ValueError('Vertical speed must be positive')
-            if mission[i]['vertical_speed'] > 1:
-                warnings.warn("%f m/s is pretty fast for an Argo float ! Typical speed is 0.09 m/s" % mission[i]['vertical_speed'])
-        
-        self.mission = mission        
+        self.mission = mission
 
         if 'vfield' in kwargs:
             raise ValueError("The 'vfield' option is deprecated. You can use the 'fieldset' "
@@ -125,7 +135,11 @@ class VirtualFleet:
 
         # Velocity/Hydrodynamic field:
         if isinstance(fieldset, VelocityField):  # be nice when we forget to set the correct input
-            fieldset = fieldset.fieldset
+            velocity, fieldset = fieldset, fieldset.fieldset  # A lazy velocity field is built and possibly clipped here
+            if self._isglobal and not velocity.isglobal:
+                log.info("The %s velocity field is not global (e.g. clipped to a subset domain), periodic boundary "
+                         "conditions are not used" % velocity.name)
+                self._isglobal = False
         if not isinstance(fieldset, FieldSet):
             raise TypeError("The `fieldset` argument must be a `FieldSet` Parcels or `VelocityField` instance")
        
@@ -180,6 +194,7 @@ class VirtualFleet:
     def __init_ParticleSet(self):
         pid_orig = np.arange(self.deployment_plan['lon'].size)
         # print(pid_orig)
+        self._parcels['id_offset'] = self._parcels['Particle'].lastID  # Parcels shifts ids of each new ParticleSet
         P = ParticleSet(
             fieldset=self._parcels['fieldset'],
             pclass=self._parcels['Particle'],
@@ -188,16 +203,22 @@ class VirtualFleet:
             depth=self.deployment_plan['depth'],
             time=self.deployment_plan['time'],
             pid_orig=pid_orig,
+            **{key: self.mission[key] for key in MissionTable.required},  # set mission per particles
         )
-        # set mission per particles
-        for i in range(len(P)):
-            P[i].parking_depth = self.mission[i]['parking_depth']
-            P[i].profile_depth = self.mission[i]['profile_depth']
-            P[i].vertical_speed = self.mission[i]['vertical_speed']
-            P[i].cycle_duration = self.mission[i]['cycle_duration']
-            P[i].life_expectancy = self.mission[i]['life_expectancy']           
-
-        self._parcels['ParticleSet'] = P
+        return self.__set_particles(P)
+
+    def __set_particles(self, P: ParticleSet):
+        """Replace virtual floats with the particles of a new ParticleSet
+
+        Particles are moved into the current ParticleSet, if any, so that kernels compiled by parcels for the current
+        ParticleSet are re-used by the next simulation, instead of being compiled again.
+        """
+        current = self._parcels['ParticleSet']
+        if current is None:
+            self._parcels['ParticleSet'] = P
+        else:
+            current.remove_indices(np.arange(current.size))
+            current.add(P)
         return self
 
     def __init_kernels(self):
@@ -213,6 +234,8 @@ class VirtualFleet:
         K += self._parcels['ParticleSet'].Kernel(KeepInDomain)
 
         self._parcels['kernels'] = K
+        self._parcels['kernel_functions'] = [self._parcels['FloatKernel'], AdvectionRK4] \
+            + ([PeriodicBoundaryConditionKernel] if self._isglobal else []) + [KeepInWater, KeepInDomain]
         return self
 
     def __repr__(self):
@@ -232,6 +255,10 @@ class VirtualFleet:
             else:
                 summary.append("\t- Simulation trajectories were not saved on file")
             summary.append("\t- Execution time: %s" % strfdelta(last_sim['execution_wall_time']))
+            if last_sim.get('resources', None) is not None:
+                peaks = last_sim['resources']['peaks']
+                summary.append("\t- Peak memory: %0.2f GB, peak CPU: %0.0f%%, peak open files: %i"
+                               % (peaks['rss'] / 1024 ** 3, peaks['cpu_percent'], peaks['open_files']))
             summary.append("\t- Executed on: %s" % last_sim['execution_system']['hostname'])
             # summary.append(self.simulations_set.__repr__())
         else:
@@ -259,6 +286,66 @@ class VirtualFleet:
         return self._parcels['ParticleSet'].fieldset
         # return self._parcels['fieldset']
 
+    def _fulltime(self, t: np.ndarray) -> np.ndarray:
+        """Convert ParticleSet times, in seconds since the FieldSet time origin, to dates"""
+        origin = self.fieldset.time_origin
+        if origin.calendar == 'np_datetime64':
+            return np.datetime64(origin.time_origin, 'ns') + np.round(t * 1e9).astype('timedelta64[ns]')
+        else:
+            return np.array(origin.fulltime(t))
+
+    def get_state(self) -> dict:
+        """Return the state of each virtual float in the ParticleSet
+
+        Returns
+        -------
+        dict
+            A dictionary of arrays with the index of each float in the deployment plan (``float``), its position
+            (``lon``, ``lat``, ``depth``), date (``time``), cycling state (``cycle_phase``, ``cycle_number``,
+            ``cycle_age``, ``drift_age``, ``in_water``) and mission parameters.
+            Floats deleted during a simulation are not included.
+
+        See Also
+        --------
+        :meth:`VirtualFleet.set_state`
+        """
+        data = self._parcels['ParticleSet'].particledata.data
+        state = {'float': data['id'] - self._parcels['id_offset']}
+        for key in ['lon', 'lat', 'depth']:
+            state[key] = data['%s_nextloop' % key].copy()
+        state['time'] = self._fulltime(data['time_nextloop'])
+        for key in STATE_VARIABLES + MissionTable.required:
+            state[key] = data[key].copy()
+        return state
+
+    def set_state(self, state: dict):
+        """Replace the ParticleSet with virtual floats in a given state
+
+        Kernels compiled for the current ParticleSet are kept, so that the next simulation does not compile them again.
+        Use :meth:`VirtualFleet.simulate` with ``restart=True`` to continue a simulation from this state.
+
+        Parameters
+        ----------
+        state: dict
+            A dictionary of arrays, as returned by :meth:`VirtualFleet.get_state`
+
+        Returns
+        -------
+        self
+        """
+        self._parcels['id_offset'] = self._parcels['Particle'].lastID
+        P = ParticleSet(
+            fieldset=self._parcels['fieldset'],
+            pclass=self._parcels['Particle'],
+            lon=state['lon'],
+            lat=state['lat'],
+            depth=state['depth'],
+            time=state['time'],
+            pid_orig=np.asarray(state['float']),
+            **{key: state[key] for key in STATE_VARIABLES + MissionTable.required},
+        )
+        return self.__set_particles(P)
+
     def plot_positions(self):
         """Plot the last position of virtual Argo Floats
 
@@ -296,6 +383,52 @@ class VirtualFleet:
         output_folder: str
             Name of folder where to store the 'output_file' zarr archive
 
+        output_chunks: tuple of int, optional
+            Chunk sizes (trajectories, observations) of the zarr trajectory store, passed on to the parcels
+            ParticleFile. By default, parcels uses one observation per chunk, and extends the store at every record.
+
+        sampling: str, default='period'
+            How trajectories are sampled: ``period`` to write all floats every ``record``, or ``events`` to only
+            write floats on cycle events (cycle phase transitions and surface fixes), see :class:`app_parcels.ArgoParticleFile`.
+
+        drift_record: :class:`datetime.timedelta`, optional
+            With ``sampling='events'``, also write floats every ``drift_record`` (in hours if numeric) while drifting
+            at parking depth. By default, there is no record during the drift.
+
+        index: bool, default=False
+            Build the profile index during the simulation: a profile is recorded whenever a float moves from phase 3
+            to phase 4, at the time and position of surfacing. The index is then returned by :meth:`VirtualFleet.to_index`
+            without reading the trajectory file, and is available even if ``output=False``. Note that this is not the
+            convention of :meth:`utilities.simu2index`, that dates and positions a profile with the last recorded
+            observation of its cycle: profiles are the same, but dates and positions differ by the surface drift
+            during transmission and by the ``record`` sampling. Floats still profiling at the end of the simulation
+            are not indexed.
+
+        chunk: :class:`datetime.timedelta`, optional
+            Run the simulation in segments of this length (in days if numeric), and write a checkpoint of the
+            virtual floats state after each segment. It must be a multiple of the recording period. Checkpoints rely
+            on parcels internals, and are only supported for the parcels versions of ``CHECKPOINT_PARCELS_VERSIONS``.
+
+        checkpoint: str, optional
+            Path to the checkpoint file written after each segment. By default, this is the trajectory file path
+            with a ``_checkpoint.npz`` suffix. Use :meth:`VirtualFleet.resume` to continue a simulation from a checkpoint.
+
+        profile: bool, default=False
+            Measure the time spent loading velocity snapshots, compiling and executing kernels and writing trajectories,
+            and the number of floats over time. The kernel compute time is then shared among kernels by running each
+            kernel in isolation for a few time steps. Results are stored in the ``profile`` entry of the simulation
+            meta-data, see :class:`app_parcels.SimulationProfiler`.
+
+        label: str, optional
+            A label for this simulation in the performance records of :attr:`simulations_set`, e.g. the name of the
+            velocity field product or of an experiment, to compare simulations with :meth:`utilities.SimulationSet.compare`.
+
+        monitor: bool or float, default=False
+            Sample the memory (RSS), CPU utilization, open file handles and I/O bytes of the process during the
+            simulation, every ``monitor`` seconds (every second if True). Samples and peak values are stored in the
+            ``resources`` entry of the simulation meta-data, see :class:`utilities.ResourceSampler`, and the peak
+            memory is recorded in :attr:`simulations_set`.
+
         Returns
         -------
         self
@@ -344,6 +477,20 @@ class VirtualFleet:
         if np.remainder(record, step) > timedelta(0):
             raise ValueError('The recording period must be a multiple of the computation time step')
 
+        sampling = kwargs["sampling"] if "sampling" in kwargs else "period"
+        if sampling not in ['period', 'events']:
+            raise ValueError("'sampling' must be 'period' or 'events'")
+        drift_record = kwargs["drift_record"] if "drift_record" in kwargs else None
+        if drift_record is not None:
+            drift_record = _validate(drift_record, name='drift_record', fallback='hours')
+
+        chunk = kwargs["chunk"] if "chunk" in kwargs else None
+        if chunk is not None:
+            chunk = _validate(chunk, name='chunk', fallback='days')
+            if np.remainder(chunk, record) > timedelta(0):
+                raise ValueError('The segment length must be a multiple of the recording period')
+            _check_checkpoint_support()
+
         # Handle output
         if not output:
             output_path = None
@@ -361,6 +508,10 @@ class VirtualFleet:
         warnings.warn(output_msg)
         log.info(output_msg)
 
+        checkpoint = kwargs["checkpoint"] if "checkpoint" in kwargs else None
+        if chunk is not None and checkpoint is None and output:
+            checkpoint = os.path.splitext(output_path)[0] + "_checkpoint.npz"
+
         # Now execute kernels
         log.info(
             "Starting Virtual Fleet simulation of %i days, with data recording every %f hours"
@@ -373,16 +524,43 @@ class VirtualFleet:
                 'output_file': None,
                 }
 
+        collector = None
+        if kwargs["index"] if "index" in kwargs else False:
+            collector = ProfileCollector(self._parcels['ParticleSet'])
+            opts['postIterationCallbacks'] = [collector]
+            opts['callbackdt'] = step
+
         if output:
             # log.info("Creating ParticleFile")
-            opts['output_file'] = self._parcels['ParticleSet'].ParticleFile(name=output_path, outputdt=record)
+            output_chunks = kwargs["output_chunks"] if "output_chunks" in kwargs else None
+            if sampling == 'events':
+                opts['output_file'] = ArgoParticleFile(name=output_path, particleset=self._parcels['ParticleSet'],
+                                                       outputdt=step, drift_outputdt=drift_record,
+                                                       chunks=output_chunks)
+            else:
+                opts['output_file'] = self._parcels['ParticleSet'].ParticleFile(name=output_path, outputdt=record,
+                                                                                chunks=output_chunks)
             # log.info("Parcels temporary files will be saved in: %s" % opts['output_file'].tempwritedir_base)
         log.debug(opts)
 
         log.info("starting ParticleSet execution")
         execution_start, process_start = time.time(), time.process_time()
-        P = self._parcels['ParticleSet']
-        P.execute(self._parcels['kernels'], **opts)
+        run = {'duration': duration, 'step': step, 'record': record, 'chunk': chunk, 'output_path': output_path,
+               'sampling': sampling, 'drift_record': drift_record}
+        profiler = None
+        sampler = self.__start_sampler(kwargs["monitor"] if "monitor" in kwargs else False)
+        try:
+            if kwargs["profile"] if "profile" in kwargs else False:
+                profiler = SimulationProfiler(self._parcels['ParticleSet'], self._parcels['kernels'],
+                                              output_file=opts['output_file'],
+                                              variables=STATE_VARIABLES + MissionTable.required)
+                with profiler:
+                    self.__execute(opts, run, checkpoint)
+            else:
+                self.__execute(opts, run, checkpoint)
+        finally:
+            if sampler is not None:
+                sampler.stop()
         log.info("ending ParticleSet execution")
 
         if output and version.parse(parcels.__version__) < version.parse("3.0.0"):
@@ -394,19 +572,188 @@ class VirtualFleet:
 
         # Internal recording of the simulation:
         execution_end, process_end = time.time(), time.process_time()
+        if profiler is not None:
+            profiler.profile_kernels(self._parcels['Particle'], self._parcels['kernel_functions'], step)
         this_run_params = {'duration': duration,
+                                      'N': self.deployment_plan['lon'].size,
+                                      'label': kwargs["label"] if "label" in kwargs else None,
                                       'step': step,
                                       'record': record,
                                       'output_path': output_path,
                                       'opts': opts,
+                                      'sampling': sampling,
+                                      'drift_record': drift_record,
+                                      'chunk': chunk,
+                                      'checkpoint': checkpoint,
+                                      'index': self.__collected_index(collector) if collector is not None else None,
+                                      'profile': profiler.to_dict() if profiler is not None else None,
+                                      'resources': sampler.to_dict() if sampler is not None else None,
                                       'execution_wall_time': pd.Timedelta(execution_end - execution_start, 's'),
                                       'execution_cpu_time': pd.Timedelta(process_end - process_start, 's'),
                                       'execution_date': pd.to_datetime("now", utc=True).strftime("%Y%m%d-%H%M%S"),
-                                      'execution_system': getSystemInfo()
+                                      'execution_system': getSystemInfo(),
+                                      'memory_hwm': sampler.peaks['rss'] if sampler is not None else None,
+                                      'process_memory_hwm': get_memory_hwm(),
                            }
         self.simulations_set.add(this_run_params)
         return self
 
+    def __execute(self, opts: dict, run: dict, checkpoint: str = None, elapsed: timedelta = timedelta(0)):
+        """Execute the ParticleSet, in segments of ``run['chunk']`` if set, with a checkpoint after each segment"""
+        P, K = self._parcels['ParticleSet'], self._parcels['kernels']
+        if run['chunk'] is None:
+            P.execute(K, **opts)
+            return self
+
+        while elapsed < run['duration'] and P.size > 0:
+            runtime = min(run['chunk'], run['duration'] - elapsed)
+            P.execute(K, **{**opts, 'runtime': runtime})
+            elapsed += runtime
+            log.info("Simulation segment done: %s out of %s" % (elapsed, run['duration']))
+            if checkpoint is not None:
+                self.__write_checkpoint(checkpoint, opts['output_file'], run, elapsed)
+        return self
+
+    def __start_sampler(self, monitor):
+        """Start sampling resources used by the process, every ``monitor`` seconds"""
+        if monitor is False or monitor is None:
+            return None
+        return ResourceSampler(interval=DEFAULT_MONITOR_INTERVAL if monitor is True else monitor).start()
+
+    def __collected_index(self, collector: ProfileCollector) -> pd.DataFrame:
+        """Return the profile index collected during a simulation, with the layout of :class:`utilities.simu2index`"""
+        profiles = collector.to_arrays()
+        traj_id = profiles['trajectory'].astype('int')
+        df = pd.DataFrame({
+            'date': self._fulltime(profiles['time']),
+            'latitude': np.fix(profiles['lat'] * 1000).astype('int') / 1000,
+            'longitude': np.fix(profiles['lon'] * 1000).astype('int') / 1000,
+            'wmo': traj_id + 9000000,
+            'cycle_number': profiles['cycle_number'].astype('int'),
+            'traj_id': traj_id,
+        })
+        return df.sort_values(['traj_id', 'date']).reset_index(drop=True)
+
+    def __write_checkpoint(self, checkpoint: str, pfile, run: dict, elapsed: timedelta):
+        """Write the virtual floats state and trajectory file rows to a npz file"""
+        data = self.get_state()
+        meta = {'duration': run['duration'].total_seconds(),
+                'step': run['step'].total_seconds(),
+                'record': run['record'].total_seconds(),
+                'chunk': run['chunk'].total_seconds(),
+                'elapsed': elapsed.total_seconds(),
+                'output_path': run['output_path'],
+                'sampling': run['sampling'],
+                'drift_record': run['drift_record'].total_seconds() if run['drift_record'] is not None else None,
+                'time_origin': str(self.fieldset.time_origin),
+                'maxids': 0}
+        if pfile is not None:
+            # Row of each float in the trajectory file, and number of observations already written:
+            ids = self._parcels['ParticleSet'].particledata.data['id']
+            data['row'] = np.array([pfile._pids_written.get(pid, -1) for pid in ids], dtype=np.int64)
+            data['obs_written'] = self._parcels['ParticleSet'].particledata.data['obs_written'].copy()
+            meta['maxids'] = pfile._maxids
+            if isinstance(pfile, ArgoParticleFile):
+                data['last_phase'], data['last_time'] = pfile.get_tracker(ids)
+        data['meta'] = np.array(json.dumps(meta))
+
+        tmp = checkpoint + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp, checkpoint)  # Never leave a partially written checkpoint
+        log.info("Checkpoint written: %s" % checkpoint)
+        return self
+
+    def resume(self, checkpoint: str, verbose_progress=True, monitor=False):
+        """Continue a segmented simulation from a checkpoint
+
+        The virtual floats state is restored from the checkpoint, and the simulation is run until the end of its initial
+        duration, appending trajectories to the same trajectory file. This virtual fleet must use the same velocity
+        field as the simulation that wrote the checkpoint. Kernels are deterministic, so that no random generator state
+        is restored.
+
+        The layout of the trajectory file is restored in private attributes of
+        :class:`parcels.particlefile.ParticleFile`, so that this relies on parcels internals and is only supported for
+        the parcels versions of ``CHECKPOINT_PARCELS_VERSIONS``.
+
+        Parameters
+        ----------
+        checkpoint: str
+            Path to a checkpoint file written by :meth:`VirtualFleet.simulate` with the ``chunk`` option
+        verbose_progress: bool, default=True
+        monitor: bool or float, default=False
+            Sample the resources used by the process every ``monitor`` seconds, as with :meth:`VirtualFleet.simulate`
+
+        Returns
+        -------
+        self
+        """
+        _check_checkpoint_support()
+        with np.load(checkpoint) as data:
+            meta = json.loads(str(data['meta']))
+            state = {key: data[key] for key in ['float', 'lon', 'lat', 'depth', 'time']
+                     + STATE_VARIABLES + MissionTable.required}
+            rows = data['row'] if 'row' in data.files else None
+            obs_written = data['obs_written'] if 'obs_written' in data.files else None
+            tracker = (data['last_phase'], data['last_time']) if 'last_phase' in data.files else None
+        if meta['time_origin'] != str(self.fieldset.time_origin):
+            raise ValueError("The velocity field time origin (%s) is not the one of the checkpoint (%s)"
+                             % (self.fieldset.time_origin, meta['time_origin']))
+
+        run = {'duration': timedelta(seconds=meta['duration']),
+               'step': timedelta(seconds=meta['step']),
+               'record': timedelta(seconds=meta['record']),
+               'chunk': timedelta(seconds=meta['chunk']),
+               'output_path': meta['output_path'],
+               'sampling': meta['sampling'],
+               'drift_record': timedelta(seconds=meta['drift_record']) if meta['drift_record'] is not None else None}
+        elapsed = timedelta(seconds=meta['elapsed'])
+        log.info("Resuming simulation from %s, at %s out of %s" % (checkpoint, elapsed, run['duration']))
+
+        self.set_state(state)
+        P = self._parcels['ParticleSet']
+        opts = {'runtime': run['duration'],
+                'dt': run['step'],
+                'verbose_progress': verbose_progress,
+                'output_file': None,
+                }
+        if run['output_path'] is not None:
+            if run['sampling'] == 'events':
+                pfile = ArgoParticleFile(name=run['output_path'], particleset=P, outputdt=run['step'],
+                                         drift_outputdt=run['drift_record'], create_new_zarrfile=False)
+            else:
+                pfile = P.ParticleFile(name=run['output_path'], outputdt=run['record'], create_new_zarrfile=False)
+            ids = P.particledata.data['id']
+            if tracker is not None:
+                pfile.set_tracker(ids, *tracker)
+            pfile._pids_written = {pid: row for pid, row in zip(ids, rows) if row >= 0}
+            pfile._maxids = meta['maxids']
+            pfile._chunks = zarr.open_group(run['output_path'], mode='r')['lon'].chunks
+            P.particledata.setallvardata('obs_written', obs_written)  # Must be set after the ParticleFile creation
+            opts['output_file'] = pfile
+
+        execution_start, process_start = time.time(), time.process_time()
+        sampler = self.__start_sampler(monitor)
+        try:
+            self.__execute(opts, run, checkpoint, elapsed=elapsed)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+        execution_end, process_end = time.time(), time.process_time()
+        self.simulations_set.add({**run,
+                                  'N': self.deployment_plan['lon'].size,
+                                  'opts': opts,
+                                  'checkpoint': checkpoint,
+                                  'resources': sampler.to_dict() if sampler is not None else None,
+                                  'execution_wall_time': pd.Timedelta(execution_end - execution_start, 's'),
+                                  'execution_cpu_time': pd.Timedelta(process_end - process_start, 's'),
+                                  'execution_date': pd.to_datetime("now", utc=True).strftime("%Y%m%d-%H%M%S"),
+                                  'execution_system': getSystemInfo(),
+                                  'memory_hwm': sampler.peaks['rss'] if sampler is not None else None,
+                                  'process_memory_hwm': get_memory_hwm(),
+                                  })
+        return self
+
     @property
     def output(self):
         """Return absolute path to the last simulation trajectory output file"""
@@ -416,30 +763,88 @@ class VirtualFleet:
             output_path = None
         return os.path.abspath(output_path)
 
-    def to_index(self, file_name=None):
+    def to_parquet(self, path=None, block_size=DEFAULT_INDEX_BLOCK_SIZE):
+        """Export last simulation trajectories to a parquet dataset
+
+        Trajectories are written as one row per observation, partitioned by block of ``block_size`` trajectories
+        and by month. See :meth:`utilities.simu2parquet`.
+
+        Parameters
+        ----------
+        path: str, default: None
+            Path to the parquet dataset directory. By default, this is the trajectory file path with a ``.parquet``
+            extension.
+        block_size: int, optional
+            Number of trajectories per block
+
+        Returns
+        -------
+        path: str
+            Path to the parquet dataset created
+        """
+        if self.simulations_set.N > 0:
+            output_path = self.simulations_set.last['output_path']
+        else:
+            output_path = None
+        if not self.simulations_set.simulated or output_path is None:
+            raise ValueError("You must execute a simulation with trajectory recording to export trajectories")
+        return simu2parquet(output_path, path=path, block_size=block_size)
+
+    def to_index(self, file_name=None, block_size=DEFAULT_INDEX_BLOCK_SIZE, format='csv'):
         """Return last simulated profile index dataframe
 
         Return a pandas.Dataframe index of profiles.
         If the ``file_name`` option is provided, an Argo profile index csv file is writen.
+        With ``format='parquet'``, the index is written to a parquet dataset instead (see :meth:`utilities.index2parquet`),
+        by default next to the trajectory file.
+
+        If the last simulation was executed with ``index=True``, the index built during the simulation is returned,
+        with profiles dated and positioned at surfacing (see :meth:`VirtualFleet.simulate`). Otherwise, the trajectory
+        file is read by blocks of ``block_size`` trajectories, so that memory usage remains bounded for large
+        simulations, and profiles are dated and positioned with the last recorded observation of their cycle (see
+        :meth:`utilities.simu2index`).
 
         Parameters
         ----------
         file_name: str, default: None
             Name of the index file to write
+        block_size: int, optional
+            Number of trajectories to load at once
+        format: str, default='csv'
+            Format of the index file, ``csv`` or ``parquet``
         """
+        if format not in ['csv', 'parquet']:
+            raise ValueError("'format' must be 'csv' or 'parquet'")
         if self.simulations_set.N > 0:
             output_path = self.simulations_set.last['output_path']
+            index = self.simulations_set.last.get('index', None)
         else:
-            output_path = None
+            output_path, index = None, None
+
+        if format == 'parquet':
+            if file_name is None:
+                if output_path is None:
+                    raise ValueError("'file_name' must be provided when the simulation was not saved on file")
+                file_name = os.path.splitext(output_path)[0] + "_index.parquet"
+            df = index if index is not None else self.to_index(block_size=block_size)
+            return index2parquet(df, file_name, block_size=block_size)
+
+        if index is not None:
+            if file_name:
+                return simu2csv(output_path, index_file=file_name, df=index)
+            else:
+                return index.copy()
+
         if not self.simulations_set.simulated or output_path is None:
-            raise ValueError("You must execute a simulation with trajectory recording to get a virtual profile index")
+            raise ValueError("You must execute a simulation with trajectory recording, or with index=True, "
+                             "to get a virtual profile index")
 
         # How to open the trajectory file:
 
         if file_name:
-            return simu2csv(output_path, index_file=file_name, df=None)
+            return simu2csv(output_path, index_file=file_name, df=None, block_size=block_size)
         else:
             engine = 'zarr' if '.zarr' in output_path else 'netcdf4'
             ds = xr.open_dataset(output_path, engine=engine)
-            return simu2index(ds)
+            return simu2index(ds, block_size=block_size)
 